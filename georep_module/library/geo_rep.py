@@ -18,18 +18,109 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
 # USA.
 
+import os
 import sys
 import re
+import shlex
+import socket
+import time
+import xml.etree.ElementTree as ET
 from collections import OrderedDict
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 from ansible.module_utils.basic import *
+from ansible.module_utils.common.arg_spec import ArgumentSpecValidator
+from ansible.module_utils.gluster_state import (FactsCache, GlusterBatch, local_uuid,
+                                                 run_with_retry, synced_epoch)
 from ast import literal_eval
 
 
+# Worker statuses of a session that is running
+RUNNING_STATUSES = ['active', 'passive', 'initializing...', 'faulty']
+
+# Session config options that can be set from the playbook
+CONFIG_OPTIONS = ['gluster_log_file', 'gluster_log_level', 'log_file',
+                  'log_level', 'changelog_log_level', 'ssh_command',
+                  'rsync_command', 'use_tarssh', 'volume_id', 'timeout',
+                  'sync_jobs', 'ignore_deletes', 'checkpoint', 'sync_acls',
+                  'sync_xattrs', 'log_rsync_performance', 'rsync_options',
+                  'use_meta_volume', 'meta_volume_mnt']
+
+# Counters in the status detail output of a worker
+WORKER_COUNTERS = ['entry', 'data', 'meta', 'failures']
+
+# Files up to this size are small for the advisor, tar over ssh syncs them
+# faster than rsync which pays a round trip per file
+SMALL_FILE_SIZE = 256 * 1024
+
+# Fraction of small files above which tar over ssh is recommended
+SMALL_FILE_FRACTION = 0.7
+
+# Bounds of the sync_jobs recommendation, gsyncd defaults to 3
+MIN_SYNC_JOBS = 3
+MAX_SYNC_JOBS = 16
+
+
+class SessionExit(Exception):
+    def __init__(self, failed, result):
+        Exception.__init__(self, result.get('msg'))
+        self.failed = failed
+        self.result = result
+
+
+class SessionModule(object):
+    # Stands in for the module while one entry of `sessions` is handled in
+    # a worker thread: the session's keys override the module parameters
+    # and exiting returns the result to the caller instead of the process
+    def __init__(self, module, session):
+        self.module = module
+        self.params = dict(module.params, sessions=None)
+        if 'action' in session:
+            self.params['state'] = None
+        if 'state' in session:
+            self.params['action'] = None
+        self.params.update(session)
+
+    def run_command(self, *args, **kwargs):
+        return self.module.run_command(*args, **kwargs)
+
+    def get_bin_path(self, *args, **kwargs):
+        return self.module.get_bin_path(*args, **kwargs)
+
+    def exit_json(self, **kwargs):
+        raise SessionExit(False, kwargs)
+
+    def fail_json(self, **kwargs):
+        raise SessionExit(True, kwargs)
+
+
 class GeoRep(object):
-    def __init__(self, module):
+    def __init__(self, module, peers=None, cache=None):
         self.module = module
-        self.action = self._validated_params('action')
-        self.gluster_georep_ops()
+        # Hostnames in the trusted storage pool, read once when needed
+        self.peers = peers
+        # The pool and sessions cached on the node, shared with the gluster
+        # modules
+        self.cache = cache or FactsCache(self.module.params['cache_path'],
+                                         self.module.params['cache_ttl'])
+        if self.module.params['sessions']:
+            self.action = 'sessions'
+            self.georep_sessions()
+        elif self.module.params['state']:
+            self.action = 'state'
+            self.georep_state()
+        elif self.module.params['action'] == 'status':
+            self.action = 'status'
+            self.georep_status()
+        elif self.module.params['action'] == 'drain':
+            self.action = 'drain'
+            self.georep_drain()
+        elif self.module.params['action'] == 'advise':
+            self.action = 'advise'
+            self.georep_advise()
+        else:
+            self.action = self._validated_params('action')
+            self.gluster_georep_ops()
 
     def get_playbook_params(self, opt):
         return self.module.params[opt]
@@ -45,6 +136,8 @@ class GeoRep(object):
         mastervol = self._validated_params('mastervol')
         slavevol = self._validated_params('slavevol')
         slavevol = self.check_pool_exclusiveness(mastervol, slavevol)
+        if self.action == 'config' and self.requested_config():
+            self.georep_config(mastervol, slavevol)
         if self.action in ['delete', 'config']:
             force = ''
         else:
@@ -52,19 +145,9 @@ class GeoRep(object):
             force = 'force' if force == 'yes' else ' '
         options = 'no-verify' if self.action == 'create' \
             else self.config_georep()
-        if type(options) is list:
-            for opt in options:
-                rc, output, err = self.call_gluster_cmd('volume',
-                                                        'geo-replication',
-                                                        mastervol, slavevol,
-                                                        self.action, opt,
-                                                        force)
-        else:
-            rc, output, err = self.call_gluster_cmd('volume',
-                                                    'geo-replication',
-                                                    mastervol, slavevol,
-                                                    self.action, options,
-                                                    force)
+        rc, output, err = self.call_gluster_cmd('volume', 'geo-replication',
+                                                mastervol, slavevol,
+                                                self.action, options, force)
         self._get_output(rc, output, err)
         if self.action in ['stop', 'delete'] and self.user == 'root':
             self.user = 'geoaccount'
@@ -74,38 +157,531 @@ class GeoRep(object):
                                                     self.action, options, force)
             self._get_output(rc, output, err)
 
+    def georep_state(self):
+        # Read the sessions of the master volume once, and only issue the
+        # commands needed to move the session to the requested state
+        mastervol = self._validated_params('mastervol')
+        slavevol = self._validated_params('slavevol')
+        slavevol = self.check_pool_exclusiveness(mastervol, slavevol)
+        state = self.module.params['state']
+        force = 'force' if str(self.module.params['force']).lower() in \
+            ['yes', 'true', 'on', '1'] else ''
+        session = self.get_sessions(mastervol, cached=True).get(
+            self._slave_key(slavevol))
+        if session:
+            # The session may belong to another user than the one given,
+            # e.g. geoaccount instead of root
+            slavevol = session['slave']
+        current = session['state'] if session else 'absent'
+
+        actions = []
+        if state == 'absent':
+            if current in ['started', 'paused']:
+                actions.append('stop')
+            if current != 'absent':
+                actions.append('delete')
+        else:
+            if current == 'absent':
+                actions.append('create')
+                current = 'stopped'
+            if state in ['started', 'paused'] and current == 'stopped':
+                actions.append('start')
+                current = 'started'
+            if state == 'started' and current == 'paused':
+                actions.append('resume')
+            elif state == 'paused' and current == 'started':
+                actions.append('pause')
+            elif state == 'stopped' and current != 'stopped':
+                actions.append('stop')
+
+        for action in actions:
+            if action == 'create':
+                args = (action, 'no-verify', force)
+            elif action == 'delete':
+                args = (action, )
+            else:
+                args = (action, force)
+            rc, output, err = self.call_gluster_cmd('volume', 'geo-replication',
+                                                    mastervol, slavevol, *args)
+            if rc:
+                self.module.fail_json(msg=err or output, actions=actions)
+        self.module.exit_json(changed=bool(actions), actions=actions,
+                              slave=slavevol)
+
+    def georep_status(self):
+        # Per-worker sync status and lag of the session, as facts
+        mastervol = self._validated_params('mastervol')
+        slavevol = self._validated_params('slavevol')
+        slavevol = self.check_pool_exclusiveness(mastervol, slavevol)
+        session = self.get_sessions(mastervol, detail=True, cached=True).get(
+            self._slave_key(slavevol))
+        if not session:
+            self.module.fail_json(msg="No geo-replication session between "
+                                  "%s and %s" % (mastervol, slavevol))
+        self.module.exit_json(changed=False,
+                              ansible_facts={'georep_status': session})
+
+    def georep_drain(self):
+        # Set a checkpoint and wait until every active worker has synced up
+        # to it, so the slave holds everything written before the drain
+        mastervol = self._validated_params('mastervol')
+        slavevol = self._validated_params('slavevol')
+        slavevol = self.check_pool_exclusiveness(mastervol, slavevol)
+        key = self._slave_key(slavevol)
+        session = self.get_sessions(mastervol).get(key)
+        if not session or session['state'] != 'started':
+            self.module.fail_json(msg="The geo-replication session between "
+                                  "%s and %s has to be started to drain it" %
+                                  (mastervol, slavevol))
+        rc, output, err = self.call_gluster_cmd('volume', 'geo-replication',
+                                                mastervol, session['slave'],
+                                                'config', 'checkpoint', 'now')
+        if rc:
+            self.module.fail_json(msg=err or output)
+        start = time.time()
+        deadline = start + self.module.params['drain_timeout']
+        interval = 5
+        while True:
+            session = self.get_sessions(mastervol, detail=True).get(key)
+            now = time.time()
+            if session and session['checkpoint_completed']:
+                break
+            if now >= deadline:
+                self.module.fail_json(msg="Timed out waiting for the "
+                                      "checkpoint to complete",
+                                      drain_time=round(now - start, 1),
+                                      georep_status=session)
+            time.sleep(min(interval, deadline - now))
+            interval = min(interval * 2, 60)
+        self.module.exit_json(changed=True, drain_time=round(now - start, 1),
+                              lag=session['lag'],
+                              ansible_facts={'georep_status': session})
+
+    def georep_sessions(self):
+        # Handle every session of the list in a bounded pool of threads,
+        # sharing one read of the storage pool
+        # The entries are checked and converted against the module options,
+        # the way the module parameters are
+        validator = ArgumentSpecValidator(
+            self.module.argument_spec, mutually_exclusive=[['action', 'state']])
+        sessions = []
+        for session in self.module.params['sessions']:
+            if not isinstance(session, dict):
+                self.module.fail_json(msg="Each entry of sessions has to be "
+                                      "a dictionary")
+            unknown = set(session) - (set(self.module.params) -
+                                      set(['sessions', 'workers']))
+            if unknown:
+                self.module.fail_json(msg="Unsupported session parameters: "
+                                      "%s" % ', '.join(sorted(unknown)))
+            validated = validator.validate(dict(session))
+            if validated.error_messages:
+                self.module.fail_json(msg="Invalid session %s: %s" % (
+                    session, '; '.join(validated.error_messages)))
+            session = dict((key, validated.validated_parameters[key])
+                           for key in session)
+            sessions.append(session)
+            for opt in ['mastervol', 'slavevol']:
+                if not session.get(opt, self.module.params[opt]):
+                    self.module.fail_json(msg="Please provide %s for every "
+                                          "session!" % opt)
+        self.peers = self.get_pool_peers()
+
+        def run(session):
+            try:
+                GeoRep(SessionModule(self.module, session), self.peers,
+                       self.cache)
+            except SessionExit as e:
+                return e.failed, e.result
+            return False, {'changed': False}
+
+        pool = ThreadPool(max(1, min(self.module.params['workers'],
+                                     len(sessions))))
+        try:
+            outcomes = pool.map(run, sessions)
+        finally:
+            pool.close()
+            pool.join()
+
+        results = []
+        for session, (failed, result) in zip(sessions, outcomes):
+            result = dict(result, failed=failed,
+                          changed=bool(result.get('changed')),
+                          mastervol=session.get(
+                              'mastervol', self.module.params['mastervol']),
+                          slavevol=session.get(
+                              'slavevol', self.module.params['slavevol']))
+            results.append(result)
+        changed = any(result['changed'] for result in results)
+        failed = [result for result in results if result['failed']]
+        if failed:
+            self.module.fail_json(msg="%d of %d geo-replication sessions "
+                                  "failed" % (len(failed), len(results)),
+                                  changed=changed, results=results)
+        self.module.exit_json(changed=changed, results=results)
+
+    def get_sessions(self, mastervol, detail=False, cached=False):
+        # All geo-replication sessions of the master volume, keyed by slave
+        # host and volume. With cached, the sessions read by an earlier run
+        # are used while fresh.
+        # The lag is worked out from the last synced times when the sessions
+        # are returned, so a cached status does not report a stale one.
+        section = 'georep/%s%s' % (mastervol, '/detail' if detail else '')
+        sessions = self.cache.get(section) if cached else None
+        if sessions is not None:
+            sessions = dict((tuple(key), session) for key, session in sessions)
+        else:
+            sessions = self.read_sessions(mastervol, detail)
+            if cached:
+                self.cache.set(section, [[list(key), session]
+                                         for key, session in sessions.items()])
+                self.cache.save()
+        return dict((key, self._with_lag(session))
+                    for key, session in sessions.items())
+
+    def read_sessions(self, mastervol, detail):
+        status = ['status', 'detail'] if detail else ['status']
+        rc, output, err = self.call_gluster_cmd('volume', 'geo-replication',
+                                                mastervol, *(status + ['--xml']))
+        sessions = {}
+        if rc or not output:
+            return sessions
+        try:
+            root = ET.fromstring(output)
+        except ET.ParseError:
+            self.module.fail_json(msg="Unable to parse the geo-replication "
+                                  "status: %s" % output)
+        for session in root.iter('session'):
+            workers = [self._worker(pair) for pair in session.iter('pair')]
+            if not workers:
+                continue
+            user = workers[0].get('slave_user') or 'root'
+            match = re.search(r'([^/@:]+)::([^:]+)', workers[0].get('slave') or
+                              session.findtext('session_slave') or '')
+            if not match:
+                continue
+            statuses = [(w.get('status') or '').lower() for w in workers]
+            if any(status in RUNNING_STATUSES for status in statuses):
+                state = 'started'
+            elif 'paused' in statuses:
+                state = 'paused'
+            else:
+                state = 'stopped'
+            sessions[match.groups()] = {
+                'slave': '%s@%s::%s' % (user, match.group(1), match.group(2)),
+                'user': user, 'state': state, 'workers': workers,
+                'checkpoint_completed': all(
+                    w['checkpoint_completed'] for w in workers
+                    if (w.get('status') or '').lower() == 'active') and
+                any((w.get('status') or '').lower() == 'active'
+                    for w in workers)}
+        return sessions
+
+    def _worker(self, pair):
+        # One worker (master brick) of a session. The pending counters are
+        # integers and N/A becomes None
+        worker = {}
+        for field in pair:
+            value = field.text.strip() if field.text else None
+            worker[field.tag] = None if value in [None, 'N/A'] else value
+        for counter in WORKER_COUNTERS:
+            if worker.get(counter) is not None:
+                try:
+                    worker[counter] = int(worker[counter])
+                except ValueError:
+                    worker[counter] = None
+        worker['checkpoint_completed'] = \
+            (worker.get('checkpoint_completed') or '').lower() == 'yes'
+        return worker
+
+    def _with_lag(self, session):
+        # The session with the lag of every worker, the number of seconds
+        # its last synced time is behind now, and the largest of them
+        now = time.time()
+        workers = []
+        for worker in session['workers']:
+            synced = synced_epoch(worker.get('last_synced_utc'),
+                                  worker.get('last_synced'))
+            workers.append(dict(worker, lag=max(int(now - synced), 0)
+                                if synced is not None else None))
+        lags = [w['lag'] for w in workers if w['lag'] is not None]
+        return dict(session, workers=workers,
+                    lag=max(lags) if lags else None)
+
+    def _slave_key(self, slavevol):
+        match = re.search(r'([^/@:]+)::([^:]+)', slavevol)
+        return match.groups()
+
     def config_georep(self):
         if self.action != 'config':
             return ''
-        options = ['gluster_log_file', 'gluster_log_level', 'log_file',
-                   'log_level', 'changelog_log_level', 'ssh_command',
-                   'rsync_command', 'use_tarssh', 'volume_id', 'timeout',
-                   'sync_jobs', 'ignore_deletes', 'checkpoint', 'sync_acls',
-                   'sync_xattrs', 'log_rsync_performance', 'rsync_options',
-                   'use_meta_volume', 'meta_volume_mnt']
-        configs = []
-        for opt in options:
-            value = self._validated_params(opt)
-            if value:
-                if value == 'reset':
-                    configs.append("'!" + opt.replace('_', '-') + "'")
-                configs.append(opt.replace('_', '-') + ' ' + value)
-        if configs:
-            return configs
         value = self._validated_params('config')
         op = self._validated_params('op')
         return value + ' ' + op
 
-    def check_pool_exclusiveness(self, mastervol, slavevol):
+    def requested_config(self):
+        # The config options set in the playbook, 'reset' resets an option
+        configs = OrderedDict()
+        for opt in CONFIG_OPTIONS:
+            value = self.module.params[opt]
+            if value:
+                configs[opt] = value
+        return configs
+
+    def georep_config(self, mastervol, slavevol, configs=None, **result):
+        # Read the session config once and only change the options whose
+        # value differs, reporting the outcome of every option
+        if configs is None:
+            configs = self.requested_config()
+        rc, output, err = self.call_gluster_cmd('volume', 'geo-replication',
+                                                mastervol, slavevol, 'config')
+        if rc:
+            self.module.fail_json(msg=err or output)
+        current = self.parse_config(output)
+        overrides = self.session_overrides(mastervol, slavevol)
+        commands = []
+        results = OrderedDict()
+        for opt, value in configs.items():
+            name = opt.replace('_', '-')
+            if value == 'reset':
+                # Without the session config file to tell whether the option
+                # was changed, reset it anyway
+                if overrides is not None and opt not in overrides:
+                    continue
+                args = "'!%s'" % name
+            else:
+                if self._config_value(current.get(opt)) == \
+                        self._config_value(value):
+                    continue
+                args = '%s %s' % (name, value)
+            results[opt] = {'from': current.get(opt), 'to': value}
+            commands.append(('volume', 'geo-replication', mastervol, slavevol,
+                             'config', args))
+        if self.module.params['batch']:
+            outcomes = self.run_gluster_batch(commands)
+        else:
+            outcomes = [self.call_gluster_cmd(*args) for args in commands]
+        failed = []
+        for opt, (rc, output, err) in zip(list(results), outcomes):
+            results[opt]['rc'] = rc
+            if rc:
+                results[opt]['msg'] = err or output
+                failed.append(opt)
+        changed = len(results) > len(failed)
+        if failed:
+            self.module.fail_json(msg="Unable to set geo-replication config "
+                                  "%s" % ', '.join(failed), changed=changed,
+                                  results=results, **result)
+        self.module.exit_json(changed=changed, results=results, **result)
+
+    def georep_advise(self):
+        # Sample the session backlog over a window and the size of the files
+        # synced meanwhile, and recommend sync_jobs and the sync engine
+        mastervol = self._validated_params('mastervol')
+        slavevol = self._validated_params('slavevol')
+        slavevol = self.check_pool_exclusiveness(mastervol, slavevol)
+        key = self._slave_key(slavevol)
+        rc, output, err = self.call_gluster_cmd('volume', 'geo-replication',
+                                                mastervol, slavevol, 'config')
+        if rc:
+            self.module.fail_json(msg=err or output)
+        config = self.parse_config(output)
+        start = time.time()
+        first = self.get_sessions(mastervol, detail=True).get(key)
+        if not first or first['state'] != 'started':
+            self.module.fail_json(msg="The geo-replication session between "
+                                  "%s and %s has to be started to sample it" %
+                                  (mastervol, slavevol))
+        time.sleep(self.module.params['sample_window'])
+        last = self.get_sessions(mastervol, detail=True).get(key) or first
+        advice = self.recommend_sync(config, self._backlog(first),
+                                     self._backlog(last),
+                                     self.sampled_file_sizes(first['workers'],
+                                                             start))
+        facts = {'georep_advice': advice}
+        if self.module.params['apply']:
+            self.georep_config(mastervol, first['slave'], OrderedDict(
+                (opt, str(advice[opt]['recommended']).lower())
+                for opt in ['sync_jobs', 'use_tarssh']),
+                ansible_facts=facts)
+        self.module.exit_json(changed=False, ansible_facts=facts)
+
+    def _backlog(self, session):
+        # Pending entry, data and metadata operations of the active workers
+        active = [w for w in session['workers']
+                  if (w.get('status') or '').lower() == 'active']
+        return dict((counter, sum(w.get(counter) or 0 for w in active))
+                    for counter in WORKER_COUNTERS)
+
+    def sampled_file_sizes(self, workers, since):
+        # Sizes of the files changed on the bricks of this host since the
+        # given time, a file changed on several of them counts once
+        sizes = {}
+        for worker in self.local_workers(workers):
+            sizes.update(self.changed_file_sizes(worker.get('master_brick'),
+                                                 since))
+        return list(sizes.values())
+
+    def local_workers(self, workers):
+        # The workers of the bricks of this host, the only ones whose
+        # changelogs can be read here. Matched on the UUID of the node, or
+        # on its name when the status does not carry the UUID.
+        uuid = local_uuid()
+        names = set([socket.gethostname(), socket.getfqdn()])
+        names.update([name.split('.')[0] for name in names])
+
+        def is_local(worker):
+            if uuid and worker.get('master_node_uuid'):
+                return worker['master_node_uuid'] == uuid
+            return worker.get('master_node') in names
+        return [worker for worker in workers if is_local(worker)]
+
+    def changed_file_sizes(self, brick, since):
+        # Sizes, by gfid, of the files with data operations in the
+        # changelogs the brick rolled over since the given time. The files
+        # are found through their gfid link.
+        root = self.module.params['brick_root']
+        if not brick:
+            return {}
+        brick = os.path.join(root, brick.lstrip('/'))
+        changelogs = os.path.join(brick, '.glusterfs', 'changelogs')
+        try:
+            names = os.listdir(changelogs)
+        except OSError:
+            return {}
+        gfids = set()
+        for name in names:
+            match = re.match(r'^CHANGELOG\.(\d+)$', name)
+            if not match or int(match.group(1)) < since:
+                continue
+            try:
+                with open(os.path.join(changelogs, name), 'rb') as f:
+                    data = f.read().decode('utf-8', 'replace')
+            except (IOError, OSError):
+                continue
+            gfids.update(self.parse_changelog(data))
+        sizes = {}
+        for gfid in gfids:
+            try:
+                sizes[gfid] = os.stat(os.path.join(
+                    brick, '.glusterfs', gfid[0:2], gfid[2:4], gfid)).st_size
+            except OSError:
+                continue
+        return sizes
+
+    def parse_changelog(self, data):
+        # The gfids of the data operations of an ascii encoded changelog,
+        # one "D<gfid>" record each, separated by NUL characters
+        return re.findall(r'(?:^|\x00|\n)D([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-'
+                          r'[0-9a-f]{4}-[0-9a-f]{12})', data)
+
+    def recommend_sync(self, config, first, last, sizes):
+        # tar over ssh for mostly small files, rsync otherwise. More sync
+        # jobs while the data backlog is not draining, fewer when there is
+        # none.
+        reasons = []
+        sizes = sorted(sizes)
+        small = len([size for size in sizes if size <= SMALL_FILE_SIZE])
+        fraction = float(small) / len(sizes) if sizes else None
+        tarssh = self._config_value(config.get('use_tarssh')) == 'true'
+        if fraction is None:
+            reasons.append("No changed files were sampled, keeping the "
+                           "sync engine")
+        elif fraction >= SMALL_FILE_FRACTION:
+            tarssh = True
+            reasons.append("%d%% of the changed files are %d KiB or smaller, "
+                           "tar over ssh avoids a round trip per file" %
+                           (fraction * 100, SMALL_FILE_SIZE // 1024))
+        else:
+            tarssh = False
+            reasons.append("%d%% of the changed files are larger than %d KiB,"
+                           " rsync only sends their changed blocks" %
+                           ((1 - fraction) * 100, SMALL_FILE_SIZE // 1024))
+
+        try:
+            jobs = int(config.get('sync_jobs') or MIN_SYNC_JOBS)
+        except ValueError:
+            jobs = MIN_SYNC_JOBS
+        recommended = jobs
+        cpus = self.module.params['cpus'] or cpu_count()
+        if last['data'] and last['data'] >= first['data']:
+            recommended = max(MIN_SYNC_JOBS, min(jobs * 2, cpus,
+                                                 MAX_SYNC_JOBS))
+            reasons.append("The data backlog went from %d to %d, more sync "
+                           "jobs run more files in parallel" %
+                           (first['data'], last['data']))
+        elif not first['data'] and not last['data'] and jobs > MIN_SYNC_JOBS:
+            recommended = MIN_SYNC_JOBS
+            reasons.append("There is no data backlog, %d sync jobs are "
+                           "enough" % MIN_SYNC_JOBS)
+        return {'sync_jobs': {'current': jobs, 'recommended': recommended},
+                'use_tarssh': {'current': self._config_value(
+                    config.get('use_tarssh')) == 'true',
+                    'recommended': tarssh},
+                'files': {'sampled': len(sizes),
+                          'small_fraction': round(fraction, 2)
+                          if fraction is not None else None,
+                          'median_size': sizes[len(sizes) // 2]
+                          if sizes else None},
+                'backlog': {'start': first, 'end': last},
+                'reasons': reasons}
+
+    def parse_config(self, output):
+        # `config` prints one "name:value" line per option, older versions
+        # use dashes in the names
+        config = {}
+        for line in (output or '').split('\n'):
+            if ':' in line:
+                key, value = line.split(':', 1)
+                config[key.strip().replace('-', '_')] = value.strip()
+        return config
+
+    def session_overrides(self, mastervol, slavevol):
+        # The options explicitly set on the session, from its gsyncd.conf.
+        # None when the file cannot be found.
+        match = re.search(r'([^/@:]+)::([^:]+)', slavevol)
+        if not match:
+            return None
+        path = '/var/lib/glusterd/geo-replication/%s_%s_%s/gsyncd.conf' % \
+            (mastervol, match.group(1), match.group(2))
+        try:
+            with open(path) as f:
+                lines = f.readlines()
+        except (IOError, OSError):
+            return None
+        return [line.split('=', 1)[0].strip().replace('-', '_')
+                for line in lines if '=' in line]
+
+    def _config_value(self, value):
+        if value is None:
+            return None
+        value = str(value).strip().strip('"\'')
+        if value.lower() in ['true', 'yes', 'on', '1']:
+            return 'true'
+        if value.lower() in ['false', 'no', 'off', '0']:
+            return 'false'
+        return value
+
+    def get_pool_peers(self):
+        peers = self.cache.get('pool')
+        if peers is not None:
+            return peers
         rc, output, err = self.module.run_command(
             "gluster pool list")
-        peers_in_cluster = [line.split('\t')[1].strip() for
-                            line in filter(None, output.split('\n')[1:])]
+        peers = [line.split('\t')[1].strip() for
+                 line in filter(None, output.split('\n')[1:])]
+        self.cache.set('pool', peers)
+        self.cache.save()
+        return peers
+
+    def check_pool_exclusiveness(self, mastervol, slavevol):
+        if self.peers is None:
+            self.peers = self.get_pool_peers()
         val_group = re.search("(.*):(.*)", slavevol)
         if not val_group:
             self.module.fail_json(msg="Slave volume in Unknown format. "
                                   "Correct format: <hostname>:<volume name>")
-        if val_group.group(1) in peers_in_cluster:
+        if val_group.group(1) in self.peers:
             self.module.fail_json(msg="slave volume is in the trusted "
                                   "storage pool of master")
         self.user = 'root' if self.module.params['georepuser'] is None \
@@ -113,11 +689,28 @@ class GeoRep(object):
         return self.user + '@' + val_group.group(1) + '::' + val_group.group(2)
 
     def call_gluster_cmd(self, *args, **kwargs):
+        if not self._read_only(args):
+            self.cache.invalidate()
         params = ' '.join(opt for opt in args)
         key_value_pair = ' '.join(' %s %s ' % (key, value)
                                   for key, value in kwargs)
         return self._run_command('gluster', ' ' + params + ' ' + key_value_pair)
 
+    def run_gluster_batch(self, commands):
+        # Send all the commands through one gluster CLI session
+        if not all(self._read_only(args) for args in commands):
+            self.cache.invalidate()
+        batch = GlusterBatch(self.module, self.module.get_bin_path('gluster', True),
+                             self.module.params['lock_timeout'])
+        for args in commands:
+            batch.add(shlex.split(' '.join(args)))
+        return [result[1:] for result in batch.run()]
+
+    def _read_only(self, args):
+        # Status queries, and config without an option which lists it
+        args = [arg.strip() for arg in args if arg and arg.strip()]
+        return 'status' in args or args[-1] == 'config'
+
     def _get_output(self, rc, output, err):
         carryon = True if self.action in ['stop',
                                           'delete', 'resume'] else False
@@ -131,15 +724,20 @@ class GeoRep(object):
             self.module.fail_json(msg=err)
 
     def _run_command(self, op, opts):
+        # Sessions handled concurrently can contend for the volume lock,
+        # retry those commands
         cmd = self.module.get_bin_path(op, True) + opts
-        return self.module.run_command(cmd)
+        return run_with_retry(self.module, cmd, self.module.params['lock_timeout'])
 
 
 if __name__ == '__main__':
     module = AnsibleModule(
         argument_spec=dict(
-            action=dict(required=True, choices=['create', 'start',
-                                                'stop', 'delete', 'pause', 'resume', 'config']),
+            action=dict(choices=['create', 'start',
+                                 'stop', 'delete', 'pause', 'resume', 'config',
+                                 'status', 'drain', 'advise']),
+            state=dict(choices=['present', 'started', 'paused', 'stopped',
+                                'absent']),
             mastervol=dict(),
             slavevol=dict(),
             force=dict(),
@@ -162,8 +760,22 @@ if __name__ == '__main__':
             log_rsync_performance=dict(),
             rsync_options=dict(),
             use_meta_volume=dict(),
-            meta_volume_mnt=dict()
+            meta_volume_mnt=dict(),
+            batch=dict(type='bool', default=False),
+            drain_timeout=dict(type='int', default=3600),
+            sessions=dict(type='list'),
+            workers=dict(type='int', default=4),
+            lock_timeout=dict(type='int', default=60),
+            sample_window=dict(type='int', default=60),
+            brick_root=dict(default='/'),
+            cpus=dict(type='int'),
+            apply=dict(type='bool', default=False),
+            cache_ttl=dict(type='int', default=30),
+            cache_path=dict(type='path',
+                            default='/var/lib/gluster-ansible/facts.json')
         ),
+        required_one_of=[['action', 'state', 'sessions']],
+        mutually_exclusive=[['action', 'state']],
     )
 
     GeoRep(module)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Checks of the sync advisor of geo_rep against a status detail and the
+changelogs of the bricks of one host, kept in fixtures/.
+
+Run from georep_module with `python -m pytest tests/unit` or
+`python -m unittest discover tests/unit`, ansible has to be importable.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+MODULE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+import ansible.module_utils  # noqa: E402
+if os.path.join(MODULE_DIR, 'module_utils') not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(os.path.join(MODULE_DIR, 'module_utils'))
+sys.path.insert(0, os.path.join(MODULE_DIR, 'library'))
+
+import geo_rep  # noqa: E402
+
+HOST1 = '0d2f1c8e-1111-4a4a-9c9c-000000000001'
+
+# Data written on the bricks of host1, by gfid: the first file on both
+SIZES = {'data': {'c0ffee00-0000-4000-8000-000000000001': 4096,
+                  'c0ffee00-0000-4000-8000-000000000002': 1048576},
+         'data2': {'c0ffee00-0000-4000-8000-000000000001': 4096,
+                   'c0ffee00-0000-4000-8000-000000000004': 100}}
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+
+class FakeModule(object):
+
+    def __init__(self, **params):
+        self.params = params
+
+    def fail_json(self, **kwargs):
+        raise AssertionError(kwargs)
+
+
+class AdviseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        # The bricks of host1 with their changelogs and gfid links
+        for brick, files in SIZES.items():
+            path = os.path.join(self.root, 'gluster_bricks', brick, 'data', '.glusterfs')
+            os.makedirs(os.path.join(path, 'changelogs'))
+            shutil.copy(os.path.join(FIXTURES, 'CHANGELOG.%s.1792240000' % brick),
+                        os.path.join(path, 'changelogs', 'CHANGELOG.1792240000'))
+            for gfid, size in files.items():
+                if not os.path.isdir(os.path.join(path, gfid[0:2], gfid[2:4])):
+                    os.makedirs(os.path.join(path, gfid[0:2], gfid[2:4]))
+                with open(os.path.join(path, gfid[0:2], gfid[2:4], gfid), 'wb') as f:
+                    f.write(b'\0' * size)
+        self.georep = geo_rep.GeoRep.__new__(geo_rep.GeoRep)
+        self.georep.module = FakeModule(brick_root=self.root)
+        self.georep.call_gluster_cmd = lambda *args: (0, fixture('georep_status_detail.xml'), '')
+        self.uuid = geo_rep.local_uuid
+        self.workers = self.georep.read_sessions('data', True)[('backup1', 'data-dr')]['workers']
+
+    def tearDown(self):
+        geo_rep.local_uuid = self.uuid
+        shutil.rmtree(self.root)
+
+    def test_parse_changelog(self):
+        self.assertEqual(self.georep.parse_changelog(fixture('CHANGELOG.data.1792240000')),
+                         ['c0ffee00-0000-4000-8000-000000000001',
+                          'c0ffee00-0000-4000-8000-000000000002'])
+
+    def test_local_workers_by_uuid(self):
+        geo_rep.local_uuid = lambda: HOST1
+        self.assertEqual([(w['master_node'], w['master_brick'])
+                          for w in self.georep.local_workers(self.workers)],
+                         [('host1.example.com', '/gluster_bricks/data/data'),
+                          ('host1.example.com', '/gluster_bricks/data2/data')])
+
+    def test_local_workers_by_name(self):
+        # Without the UUID of this node
+        geo_rep.local_uuid = lambda: None
+        self.workers[2]['master_node'] = geo_rep.socket.gethostname()
+        self.assertEqual([w['master_node'] for w in self.georep.local_workers(self.workers)],
+                         [geo_rep.socket.gethostname()])
+
+    def test_sampled_sizes_count_files_once(self):
+        geo_rep.local_uuid = lambda: HOST1
+        # host2 has a brick of the same path, its changelogs are not on host1
+        self.assertEqual(sorted(self.georep.sampled_file_sizes(self.workers, 1792239000)),
+                         [100, 4096, 1048576])
+
+    def test_older_changelogs_are_skipped(self):
+        geo_rep.local_uuid = lambda: HOST1
+        self.assertEqual(self.georep.sampled_file_sizes(self.workers, 1792241000), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
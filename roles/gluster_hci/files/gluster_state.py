@@ -0,0 +1 @@
+../module_utils/gluster_state.py
\ No newline at end of file
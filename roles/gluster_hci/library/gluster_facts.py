@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = """
+module: gluster_facts
+short_description: Gather the peers, volumes and quotas of a GlusterFS pool
+description:
+  - Returns the same C(glusterfs) facts as the gluster_volume module without
+    changing anything, optionally only for some volumes.
+  - The state is cached on the node in I(cache_path), shared with the
+    gluster_volume and geo_rep modules. The cache is keyed by the op-version
+    and a checksum of the glusterd state files, which change with every
+    volume, peer and geo-replication change, and entries older than
+    I(cache_ttl) seconds are read again.
+options:
+  volumes:
+    description:
+      - Only return the facts of these volumes. All volumes by default.
+    type: list
+    aliases: ['name', 'volume']
+  quotas:
+    description:
+      - Also return the quota limits and usage of the volumes with quota
+        enabled.
+    type: bool
+    default: true
+  bricks:
+    description:
+      - Also return whether the brick processes of the started volumes are
+        online, from C(gluster volume status <volume> --xml), as
+        C(brick_status), and the bricks that are not online as
+        C(offline_bricks). The brick status is never cached.
+    type: bool
+    default: false
+  cache_ttl:
+    description:
+      - Seconds the cached state is reused for. 0 disables the cache.
+    type: int
+    default: 30
+  cache_path:
+    description:
+      - Where the cached state is kept.
+    default: /var/lib/gluster-ansible/facts.json
+"""
+
+EXAMPLES = """
+- name: Gather the facts of the HCI volumes
+  gluster_facts:
+    volumes:
+      - engine
+      - data
+  run_once: true
+
+- debug:
+    var: glusterfs.quota_usage
+
+- name: Wait until every brick of the data volume is online
+  gluster_facts:
+    volumes: data
+    quotas: false
+    bricks: true
+  register: data_bricks
+  until: data_bricks.ansible_facts is defined and
+         data_bricks.ansible_facts.glusterfs.offline_bricks | length == 0
+  retries: 30
+  delay: 5
+"""
+
+RETURN = """
+ansible_facts:
+  description: The C(glusterfs) facts.
+  returned: always
+  type: dict
+  sample:
+    glusterfs:
+      peers:
+        host2: [5f6f7a52-..., Peer in Cluster]
+      volumes:
+        data:
+          name: data
+          status: Started
+          bricks: [host1:/gluster_bricks/data/data]
+      quotas:
+        data:
+          /tenants/a: 100.0GB
+      quota_usage:
+        data:
+          /tenants/a:
+            hard_limit: 107374182400
+            used: 1073741824
+            headroom: 106300440576
+      brick_status:
+        data:
+          host1:/gluster_bricks/data/data:
+            online: true
+            pid: 4242
+            port: 49152
+      offline_bricks: []
+cached:
+  description: Whether the state was read from the cache.
+  returned: always
+  type: bool
+"""
+
+import xml.etree.ElementTree as ET
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.gluster_state import (FactsCache, parse_peer, parse_volume,
+                                                 parse_quota, quota_headroom)
+
+
+def parse_brick_status(elem):
+    """The brick name and status of a <node> of `volume status --xml`, None for
+    the self-heal daemon and the other services, whose path is not a directory."""
+    path = elem.findtext('path') or ''
+    if not path.startswith('/'):
+        return None, None
+    pid = elem.findtext('pid')
+    port = elem.findtext('port')
+    return '%s:%s' % (elem.findtext('hostname'), path), {
+        'online': elem.findtext('status') == '1',
+        'pid': int(pid) if pid and pid.isdigit() and pid != '0' else None,
+        'port': int(port) if port and port.isdigit() and port != '0' else None}
+
+
+class GlusterFacts(object):
+
+    def __init__(self, module):
+        self.module = module
+        self.glusterbin = module.get_bin_path('gluster', True)
+        self.cache = FactsCache(module.params['cache_path'], module.params['cache_ttl'])
+        self.cached = True
+
+    def query(self, *args):
+        rc, out, err = self.module.run_command([self.glusterbin, '--mode=script'] +
+                                               list(args) + ['--xml'])
+        if rc != 0:
+            self.module.fail_json(msg='error running gluster (%s) command: %s' %
+                                      (' '.join(args), err or out))
+        try:
+            return ET.fromstring(out)
+        except ET.ParseError as e:
+            self.module.fail_json(msg='unable to parse gluster xml output: %s' % e)
+
+    def section(self, name, read):
+        value = self.cache.get(name)
+        if value is None:
+            self.cached = False
+            value = read()
+            self.cache.set(name, value)
+        return value
+
+    def peers(self):
+        peers = {}
+        for elem in self.query('peer', 'status').iter('peer'):
+            names, info = parse_peer(elem)
+            for name in names:
+                peers[name] = info
+        return peers
+
+    def volumes(self):
+        volumes = {}
+        for elem in self.query('volume', 'info').iter('volume'):
+            volume = parse_volume(elem)
+            if volume['name']:
+                volumes[volume['name']] = volume
+        return volumes
+
+    def quota_usage(self, name):
+        usage = {}
+        for elem in self.query('volume', 'quota', name, 'list').iter('limit'):
+            path, limit = parse_quota(elem)
+            if path:
+                usage[path] = limit
+        return usage
+
+    def brick_status(self, name, bricks):
+        """Status of every brick of a volume, offline when glusterd does not
+        list it."""
+        status = dict((brick, {'online': False, 'pid': None, 'port': None}) for brick in bricks)
+        for elem in self.query('volume', 'status', name).iter('node'):
+            brick, info = parse_brick_status(elem)
+            if brick is not None:
+                status[brick] = info
+        return status
+
+    def gather(self):
+        scope = self.module.params['volumes']
+        peers = self.section('peers', self.peers)
+        volumes = self.section('volumes', self.volumes)
+        if scope:
+            missing = [name for name in scope if name not in volumes]
+            if missing:
+                self.module.fail_json(msg='volume not found %s' % ', '.join(missing))
+            volumes = dict((name, volumes[name]) for name in scope)
+        facts = {'peers': peers, 'volumes': volumes}
+        if self.module.params['quotas']:
+            usage = {}
+            for name, volume in volumes.items():
+                if volume['quota'] and volume['status'] == 'Started':
+                    usage[name] = self.section('quota_usage/' + name,
+                                               lambda: self.quota_usage(name))
+            facts['quotas'] = dict((name, dict((path, limit['limit'])
+                                               for path, limit in limits.items()))
+                                   for name, limits in usage.items())
+            facts['quota_usage'] = dict((name, dict((path, quota_headroom(limit))
+                                                    for path, limit in limits.items()))
+                                        for name, limits in usage.items())
+        if self.module.params['bricks']:
+            facts['brick_status'] = dict((name, self.brick_status(name, volume['bricks']))
+                                         for name, volume in volumes.items()
+                                         if volume['status'] == 'Started')
+            facts['offline_bricks'] = sorted(brick for status in facts['brick_status'].values()
+                                             for brick, info in status.items()
+                                             if not info['online'])
+        self.cache.save()
+        return facts
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            volumes=dict(type='list', aliases=['name', 'volume']),
+            quotas=dict(type='bool', default=True),
+            bricks=dict(type='bool', default=False),
+            cache_ttl=dict(type='int', default=30),
+            cache_path=dict(type='path', default='/var/lib/gluster-ansible/facts.json'),
+        ),
+        supports_check_mode=True,
+    )
+    facts = GlusterFacts(module)
+    glusterfs = facts.gather()
+    module.exit_json(changed=False, cached=facts.cached, ansible_facts={'glusterfs': glusterfs})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = """
+module: gluster_heal
+short_description: Report and wait for the self-heal backlog of GlusterFS volumes
+description:
+  - Reads C(gluster volume heal <volume> info summary) and reports the entries
+    pending heal, in split-brain and possibly healing on every brick.
+  - With I(wait) the summary is sampled until the entries pending heal or
+    possibly being healed of every volume are at most I(threshold), none is
+    in split-brain and all the bricks are connected, which
+    makes the module usable as a gate between the restarts of a rolling
+    operation. The heal rate and the time left are estimated from the samples.
+    A heal info that fails while waiting, e.g. while the bricks and the
+    self-heal daemon come back after a restart, counts as not settled.
+  - Volumes that are neither replicate nor disperse have nothing to heal and
+    are reported as skipped.
+options:
+  volumes:
+    description:
+      - Names of the volumes to check.
+    required: true
+    type: list
+    aliases: ['name', 'volume']
+  wait:
+    description:
+      - Wait until the backlog is at most I(threshold).
+    type: bool
+    default: false
+  threshold:
+    description:
+      - Number of entries pending heal or possibly being healed per volume
+        at or below which the heal is considered settled.
+    type: int
+    default: 0
+  timeout:
+    description:
+      - Seconds to wait for the backlog to settle before failing.
+    type: int
+    default: 3600
+  interval:
+    description:
+      - Seconds between the first samples, doubled up to a minute while
+        waiting.
+    type: int
+    default: 10
+  fail_on_split_brain:
+    description:
+      - Fail as soon as an entry is in split-brain, as those are not healed
+        without intervention. Otherwise a volume with entries in split-brain
+        is not settled and the wait times out.
+    type: bool
+    default: true
+"""
+
+EXAMPLES = """
+- name: Report the heal backlog
+  gluster_heal:
+    volumes:
+      - engine
+      - data
+
+- name: Wait for the heals to settle before restarting the next host
+  gluster_heal:
+    volumes: "{{ gluster_features_hci_volumes | map(attribute='volname') | list }}"
+    wait: true
+    timeout: 1800
+  run_once: true
+"""
+
+RETURN = """
+ansible_facts:
+  description: The heal backlog of every volume as C(gluster_heal_info).
+  returned: always
+  type: dict
+  sample:
+    gluster_heal_info:
+      data:
+        type: Replicate
+        pending: 120
+        split_brain: 0
+        healing: 4
+        backlog: 124
+        settled: false
+        rate: 2.5
+        eta: 48
+        bricks:
+          - name: host1:/gluster_bricks/data/data
+            status: Connected
+            pending: 120
+            split_brain: 0
+            healing: 4
+      scratch:
+        type: Distribute
+        skipped: true
+        settled: true
+waited:
+  description: Seconds spent waiting for the backlog to settle.
+  returned: always
+  type: float
+"""
+
+import time
+import xml.etree.ElementTree as ET
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.gluster_state import HEAL_TYPES
+
+
+# Samples used to estimate the heal rate
+RATE_SAMPLES = 5
+
+
+def count(brick, tag):
+    """An entry counter of a brick, None while the brick is unreachable."""
+    try:
+        return int(brick.findtext(tag))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_heal_summary(out):
+    """Per-brick counters of the heal info summary XML output."""
+    root = ET.fromstring(out)
+    if root.findtext('opRet', '0') != '0':
+        raise ValueError(root.findtext('opErrstr') or 'heal info failed')
+    bricks = []
+    for brick in root.iter('brick'):
+        bricks.append({'name': brick.findtext('name'),
+                       'status': brick.findtext('status'),
+                       'pending': count(brick, 'numberOfEntriesInHealPending'),
+                       'split_brain': count(brick, 'numberOfEntriesInSplitBrain'),
+                       'healing': count(brick, 'numberOfEntriesPossiblyHealing')})
+    return bricks
+
+
+def summarize(bricks, threshold):
+    """Totals of a volume, settled once every brick answers, no entry is in
+    split-brain and the entries pending or possibly being healed are at most
+    threshold."""
+    info = {'bricks': bricks}
+    for key in ['pending', 'split_brain', 'healing']:
+        info[key] = sum(brick[key] or 0 for brick in bricks)
+    info['backlog'] = info['pending'] + info['healing']
+    connected = all(brick['pending'] is not None for brick in bricks)
+    info['settled'] = connected and not info['split_brain'] and info['backlog'] <= threshold
+    return info
+
+
+def heal_rate(samples):
+    """Entries healed per second over the last samples of (time, backlog)."""
+    samples = samples[-RATE_SAMPLES:]
+    if len(samples) < 2 or samples[-1][0] <= samples[0][0]:
+        return None
+    return max(samples[0][1] - samples[-1][1], 0) / (samples[-1][0] - samples[0][0])
+
+
+def heal_summary(module, glusterbin, volume):
+    """The per-brick counters of a volume, or None and the error."""
+    rc, out, err = module.run_command([glusterbin, '--mode=script', 'volume', 'heal',
+                                       volume, 'info', 'summary', '--xml'])
+    if rc != 0:
+        return None, 'unable to read the heal info of %s: %s' % (volume, (err or out).strip())
+    try:
+        return parse_heal_summary(out), None
+    except (ET.ParseError, ValueError) as e:
+        return None, 'unable to parse the heal info of %s: %s' % (volume, e)
+
+
+def volume_type(module, glusterbin, volume):
+    """The type of a volume, e.g. Distributed-Replicate, or None and the error."""
+    rc, out, err = module.run_command([glusterbin, '--mode=script', 'volume', 'info',
+                                       volume, '--xml'])
+    if rc != 0:
+        return None, 'unable to read the volume info of %s: %s' % (volume, (err or out).strip())
+    try:
+        kind = ET.fromstring(out).findtext('.//volume/typeStr')
+    except ET.ParseError as e:
+        return None, 'unable to parse the volume info of %s: %s' % (volume, e)
+    if kind is None:
+        return None, 'volume %s not found' % volume
+    return kind, None
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            volumes=dict(type='list', required=True, aliases=['name', 'volume']),
+            wait=dict(type='bool', default=False),
+            threshold=dict(type='int', default=0),
+            timeout=dict(type='int', default=3600),
+            interval=dict(type='int', default=10),
+            fail_on_split_brain=dict(type='bool', default=True),
+        ),
+        supports_check_mode=True,
+    )
+    glusterbin = module.get_bin_path('gluster', True)
+    params = module.params
+    start = time.time()
+    deadline = start + params['timeout']
+    interval = max(params['interval'], 1)
+    samples = dict((volume, []) for volume in params['volumes'])
+    types = {}
+
+    while True:
+        facts = {}
+        for volume in params['volumes']:
+            error = None
+            if volume not in types:
+                kind, error = volume_type(module, glusterbin, volume)
+                if kind is not None:
+                    types[volume] = kind
+            if types.get(volume) is not None and types[volume] not in HEAL_TYPES:
+                facts[volume] = {'type': types[volume], 'skipped': True, 'settled': True,
+                                 'bricks': [], 'pending': 0, 'split_brain': 0, 'healing': 0,
+                                 'backlog': 0, 'rate': None, 'eta': 0}
+                continue
+            if error is None:
+                bricks, error = heal_summary(module, glusterbin, volume)
+            if error is not None:
+                # Right after a restart the bricks and the self-heal daemon
+                # may not answer yet, keep sampling while waiting
+                if not params['wait']:
+                    module.fail_json(msg=error)
+                facts[volume] = {'type': types.get(volume), 'error': error, 'settled': False,
+                                 'bricks': [], 'pending': None, 'split_brain': 0,
+                                 'healing': None, 'backlog': None, 'rate': None,
+                                 'eta': None}
+                continue
+            info = summarize(bricks, params['threshold'])
+            info['type'] = types[volume]
+            now = time.time()
+            if all(brick['pending'] is not None for brick in info['bricks']):
+                samples[volume].append((now, info['backlog']))
+            rate = heal_rate(samples[volume])
+            info['rate'] = round(rate, 2) if rate is not None else None
+            if info['settled']:
+                info['eta'] = 0
+            elif rate and info['backlog'] > params['threshold']:
+                info['eta'] = int((info['backlog'] - params['threshold']) / rate)
+            else:
+                info['eta'] = None
+            facts[volume] = info
+
+        now = time.time()
+        result = dict(changed=False, waited=round(now - start, 1),
+                      ansible_facts={'gluster_heal_info': facts})
+        split_brain = [volume for volume in facts if facts[volume]['split_brain']]
+        if params['wait'] and split_brain and params['fail_on_split_brain']:
+            module.fail_json(msg='entries in split-brain on %s' % ', '.join(split_brain),
+                             **result)
+        if not params['wait'] or all(info['settled'] for info in facts.values()):
+            module.exit_json(**result)
+        if now >= deadline:
+            errors = [facts[v]['error'] for v in facts if facts[v].get('error')]
+            module.fail_json(msg='timed out waiting for the heals of %s to settle%s' %
+                             (', '.join(v for v in facts if not facts[v]['settled']),
+                              ' (%s)' % '; '.join(errors) if errors else ''),
+                             **result)
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval * 2, 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = """
+module: gluster_host_profile
+short_description: Describe the hardware of a GlusterFS brick host
+description:
+  - Reads the CPU count, memory, NIC speed and the kind of device (rotational,
+    SSD or NVMe) backing each brick from procfs and sysfs.
+  - The profiles of all the brick hosts are passed to the gluster_volume
+    module as I(host_profiles) to derive the volume tuning.
+options:
+  bricks:
+    description:
+      - Brick paths on this host.
+    type: list
+  sysfs_root:
+    description:
+      - Where sysfs is mounted, or the root of a copy of its tree.
+    type: str
+    default: /sys
+  procfs_root:
+    description:
+      - Where procfs is mounted, or the root of a copy of its tree.
+    type: str
+    default: /proc
+"""
+
+EXAMPLES = """
+- name: Describe the brick hosts
+  gluster_host_profile:
+    bricks:
+      - /gluster_bricks/engine/engine
+      - /gluster_bricks/data/data
+
+- name: Tune the volumes for the slowest brick host
+  gluster_volume:
+    state: present
+    name: data
+    tune: apply
+    host_profiles: "{{ ansible_play_hosts | map('extract', hostvars,
+                       'gluster_host_profile') | list }}"
+  run_once: true
+"""
+
+RETURN = """
+ansible_facts:
+  description: The host profile as C(gluster_host_profile).
+  returned: always
+  type: dict
+  sample:
+    gluster_host_profile:
+      cpus: 16
+      memory_mb: 64216
+      nic_speed_mbps: 10000
+      storage: ssd
+      bricks:
+        - path: /gluster_bricks/data/data
+          device: sdb
+          rotational: false
+          nvme: false
+"""
+
+import os
+import re
+
+from ansible.module_utils.basic import AnsibleModule
+
+
+def read_file(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return default
+
+
+def cpu_count(procfs_root):
+    cpuinfo = read_file(os.path.join(procfs_root, 'cpuinfo'), '')
+    return len(re.findall(r'^processor\s*:', cpuinfo, re.M)) or 1
+
+
+def memory_mb(procfs_root):
+    meminfo = read_file(os.path.join(procfs_root, 'meminfo'), '')
+    m = re.search(r'^MemTotal:\s*(\d+)\s*kB', meminfo, re.M)
+    return int(m.group(1)) // 1024 if m else 0
+
+
+def nic_speed(sysfs_root):
+    """Speed in Mb/s of the fastest network interface that is up."""
+    net = os.path.join(sysfs_root, 'class', 'net')
+    speeds = [0]
+    try:
+        interfaces = os.listdir(net)
+    except OSError:
+        return 0
+    for iface in interfaces:
+        if iface == 'lo' or read_file(os.path.join(net, iface, 'operstate')) != 'up':
+            continue
+        speed = read_file(os.path.join(net, iface, 'speed'), '')
+        if re.match(r'^\d+$', speed):
+            speeds.append(int(speed))
+    return max(speeds)
+
+
+def mount_device(path, procfs_root):
+    """The source device of the mount holding path."""
+    mounts = read_file(os.path.join(procfs_root, 'mounts'), '')
+    device = None
+    longest = -1
+    for line in mounts.split('\n'):
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        mountpoint = fields[1].rstrip('/') or '/'
+        if (path == mountpoint or path.startswith(mountpoint.rstrip('/') + '/')) \
+                and len(mountpoint) > longest:
+            device, longest = fields[0], len(mountpoint)
+    return device
+
+
+def block_devices(device, sysfs_root):
+    """Whole-disk block devices behind a device node, following dm slaves."""
+    block = os.path.join(sysfs_root, 'block')
+    name = os.path.basename(device)
+    if device.startswith('/dev/mapper/'):
+        for dm in os.listdir(block) if os.path.isdir(block) else []:
+            if read_file(os.path.join(block, dm, 'dm', 'name')) == name:
+                name = dm
+                break
+    if not os.path.isdir(os.path.join(block, name)):
+        # A partition, e.g. sdb1 or nvme0n1p1
+        name = re.sub(r'(?<=\d)p\d+$', '', name) if name.startswith('nvme') \
+            else re.sub(r'\d+$', '', name)
+    slaves = os.path.join(block, name, 'slaves')
+    if os.path.isdir(slaves) and os.listdir(slaves):
+        disks = []
+        for slave in sorted(os.listdir(slaves)):
+            disks.extend(block_devices(slave, sysfs_root))
+        return disks
+    return [name]
+
+
+def brick_profile(path, sysfs_root, procfs_root):
+    device = mount_device(path, procfs_root)
+    if device is None:
+        return {'path': path, 'device': None, 'rotational': None, 'nvme': None}
+    disks = block_devices(device, sysfs_root)
+    rotational = any(read_file(os.path.join(sysfs_root, 'block', disk, 'queue',
+                                            'rotational')) == '1' for disk in disks)
+    return {'path': path, 'device': ','.join(disks), 'rotational': rotational,
+            'nvme': all(disk.startswith('nvme') for disk in disks)}
+
+
+def host_profile(bricks, sysfs_root='/sys', procfs_root='/proc'):
+    profile = {'cpus': cpu_count(procfs_root),
+               'memory_mb': memory_mb(procfs_root),
+               'nic_speed_mbps': nic_speed(sysfs_root),
+               'bricks': [brick_profile(path, sysfs_root, procfs_root)
+                          for path in bricks or []]}
+    known = [brick for brick in profile['bricks'] if brick['device']]
+    if any(brick['rotational'] for brick in known):
+        profile['storage'] = 'rotational'
+    elif known and all(brick['nvme'] for brick in known):
+        profile['storage'] = 'nvme'
+    else:
+        profile['storage'] = 'ssd'
+    return profile
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            bricks=dict(type='list'),
+            sysfs_root=dict(type='str', default='/sys'),
+            procfs_root=dict(type='str', default='/proc'),
+        ),
+        supports_check_mode=True,
+    )
+    profile = host_profile(module.params['bricks'], module.params['sysfs_root'],
+                           module.params['procfs_root'])
+    module.exit_json(changed=False, ansible_facts={'gluster_host_profile': profile})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,435 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = """
+module: gluster_net_bench
+short_description: Measure the TCP round trip time and throughput between hosts
+description:
+  - Run on every host of a cluster at the same time. Each host listens on
+    I(port) and measures the round trip time and the TCP throughput to every
+    other host in I(hosts).
+  - The pairs of hosts are measured in rounds of disjoint pairs, so a host
+    only exchanges traffic with one peer at a time and the throughput is the
+    one of the link, not a share of it. The round trip times of all the
+    pairs are measured before any throughput, on idle links.
+  - The row of this host in the latency/bandwidth matrix is returned, with
+    the peers that do not meet I(min_mbps) or I(max_rtt_ms) flagged.
+  - Replica and arbiter writes wait for the slowest link between the brick
+    hosts, run this before placing bricks on them.
+options:
+  hosts:
+    description:
+      - The hosts of the cluster, including this one, in the same order on
+        every host.
+    required: true
+    type: list
+  host:
+    description:
+      - The name of this host in I(hosts). By default the entry of I(hosts)
+        that resolves to an address of this host.
+  port:
+    description:
+      - TCP port to listen on and connect to. It has to be reachable between
+        the hosts.
+    type: int
+    default: 5201
+  duration:
+    description:
+      - Seconds the throughput of each direction of a pair is measured for.
+        With N hosts the throughput phase takes about 2 * N * I(duration)
+        seconds.
+    type: int
+    default: 3
+  pings:
+    description:
+      - Number of round trips to measure to each peer.
+    type: int
+    default: 20
+  timeout:
+    description:
+      - Seconds to wait for a peer to start listening and to reach the round
+        of its pair with this host.
+    type: int
+    default: 60
+  min_mbps:
+    description:
+      - Throughput in Mb/s below which a peer is flagged. Not checked when
+        I(duration) is 0.
+    type: float
+  max_rtt_ms:
+    description:
+      - Median round trip time in milliseconds above which a peer is flagged.
+        Not checked when I(pings) is 0.
+    type: float
+  fail_on_threshold:
+    description:
+      - Fail when a peer is flagged. Otherwise the flagged peers are only
+        reported.
+    type: bool
+    default: true
+"""
+
+EXAMPLES = """
+- name: Measure the network between the brick hosts
+  gluster_net_bench:
+    hosts: "{{ gluster_features_hci_cluster }}"
+    min_mbps: 1000
+    max_rtt_ms: 1
+
+- name: Assemble the matrix
+  set_fact:
+    net_matrix: "{{ dict(ansible_play_hosts | zip(ansible_play_hosts |
+                    map('extract', hostvars, ['gluster_net_bench', 'peers']))) }}"
+  run_once: true
+"""
+
+RETURN = """
+ansible_facts:
+  description: The row of this host in the matrix as C(gluster_net_bench).
+  returned: always
+  type: dict
+  sample:
+    gluster_net_bench:
+      host: host1
+      flagged: [host3]
+      peers:
+        host2:
+          rtt_ms: 0.21
+          rtt_max_ms: 0.48
+          mbps: 9410.2
+        host3:
+          rtt_ms: 0.25
+          rtt_max_ms: 0.61
+          mbps: 940.7
+"""
+
+import socket
+import struct
+import threading
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+
+
+# Size of the round trip messages and of the throughput writes
+PING_SIZE = 64
+CHUNK_SIZE = 128 * 1024
+
+
+def recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise socket.error('connection closed')
+        data += chunk
+    return data
+
+
+def rounds(hosts):
+    """Round-robin schedule of the pairs of hosts: every pair meets in exactly
+    one round and no host is in two pairs of a round. With an odd number of
+    hosts one of them sits each round out."""
+    ring = list(hosts) + ([None] if len(hosts) % 2 else [])
+    schedule = []
+    for r in range(len(ring) - 1):
+        half = len(ring) // 2
+        schedule.append([(ring[i], ring[-1 - i]) for i in range(half)
+                         if ring[i] is not None and ring[-1 - i] is not None])
+        # The first host stays, the others turn around it
+        ring = [ring[0], ring[-1]] + ring[1:-1]
+    return schedule
+
+
+def partner(pairs, me, hosts):
+    """The peer of this host in a round, and whether this host measures first."""
+    for a, b in pairs:
+        if me in (a, b):
+            peer = b if a == me else a
+            return peer, hosts.index(me) < hosts.index(peer)
+    return None, False
+
+
+def is_local(host):
+    """Whether host resolves to an address of this host, which can then be
+    bound to."""
+    try:
+        addresses = socket.getaddrinfo(host, None, 0, socket.SOCK_STREAM)
+    except socket.error:
+        return False
+    for family, socktype, proto, canonname, address in addresses:
+        sock = socket.socket(family, socktype)
+        try:
+            sock.bind((address[0], 0) + tuple(address[2:]))
+            return True
+        except socket.error:
+            pass
+        finally:
+            sock.close()
+    return False
+
+
+class BenchServer(object):
+    """Answers the round trip and throughput tests of the peers. A test is
+    only answered once this host has reached the step of the schedule it is
+    for, so the peers wait for the pair they are in to be free."""
+
+    def __init__(self, port):
+        # Listen on IPv6 and IPv4 where the host has IPv6
+        try:
+            self.sock = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+        except (socket.error, AttributeError):
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('', port))
+        self.sock.listen(64)
+        self.step = -1
+        self.served = set()
+        self.arrived = 0
+        self.closed = False
+        self.lock = threading.Condition()
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except socket.error:
+                return
+            thread = threading.Thread(target=self.handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def handle(self, conn):
+        try:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            command, step = struct.unpack('!cI', recv_exactly(conn, 5))
+            if command == b'B':
+                with self.lock:
+                    self.arrived += 1
+                    self.lock.notify_all()
+                conn.sendall(b'R')
+                return
+            with self.lock:
+                while self.step < step and not self.closed:
+                    self.lock.wait(1)
+            conn.sendall(b'R')
+            if command == b'P':
+                while True:
+                    try:
+                        message = recv_exactly(conn, PING_SIZE)
+                    except socket.error:
+                        break
+                    conn.sendall(message)
+            elif command == b'T':
+                received = 0
+                while True:
+                    chunk = conn.recv(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    received += len(chunk)
+                conn.sendall(struct.pack('!Q', received))
+            with self.lock:
+                self.served.add(step)
+                self.lock.notify_all()
+        except socket.error:
+            pass
+        finally:
+            conn.close()
+
+    def advance(self, step):
+        with self.lock:
+            self.step = step
+            self.lock.notify_all()
+
+    def wait_served(self, step, deadline):
+        """Wait until the peer of the step has measured this host."""
+        with self.lock:
+            while step not in self.served and time.time() < deadline:
+                self.lock.wait(max(min(deadline - time.time(), 1), 0.01))
+            return step in self.served
+
+    def wait_arrived(self, peers, deadline):
+        """Wait until every peer is done with the round trip times."""
+        with self.lock:
+            while self.arrived < peers and time.time() < deadline:
+                self.lock.wait(max(min(deadline - time.time(), 1), 0.01))
+            return self.arrived
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+        # shutdown wakes up the accept of the serving thread
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+
+
+def connect(peer, port, command, step, deadline):
+    """Connect to the bench server of peer, retrying until it listens, and
+    wait until it is ready for the step."""
+    while True:
+        try:
+            sock = socket.create_connection((peer, port), timeout=max(deadline - time.time(), 1))
+            break
+        except socket.error:
+            if time.time() >= deadline:
+                raise
+            time.sleep(0.5)
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.sendall(struct.pack('!cI', command, step))
+        recv_exactly(sock, 1)
+    except socket.error:
+        sock.close()
+        raise
+    return sock
+
+
+def round_trips(peer, port, step, pings, deadline):
+    sock = connect(peer, port, b'P', step, deadline)
+    try:
+        message = b'x' * PING_SIZE
+        rtts = []
+        for i in range(pings):
+            start = time.time()
+            sock.sendall(message)
+            recv_exactly(sock, PING_SIZE)
+            rtts.append(time.time() - start)
+    finally:
+        sock.close()
+    rtts.sort()
+    if not rtts:
+        return {}
+    return {'rtt_ms': round(rtts[len(rtts) // 2] * 1000, 3),
+            'rtt_max_ms': round(rtts[-1] * 1000, 3)}
+
+
+def throughput(peer, port, step, duration, deadline):
+    sock = connect(peer, port, b'T', step, deadline)
+    try:
+        chunk = b'\0' * CHUNK_SIZE
+        start = time.time()
+        end = start + duration
+        while time.time() < end:
+            sock.sendall(chunk)
+        sock.shutdown(socket.SHUT_WR)
+        received = struct.unpack('!Q', recv_exactly(sock, 8))[0]
+        if duration <= 0:
+            return {}
+        return {'mbps': round(received * 8 / (time.time() - start) / 1e6, 1)}
+    finally:
+        sock.close()
+
+
+def flags(result, min_mbps, max_rtt_ms):
+    # A measurement that was not taken, with no pings or no duration, is
+    # not checked
+    if 'error' in result:
+        return True
+    if min_mbps is not None and result.get('mbps') is not None and result['mbps'] < min_mbps:
+        return True
+    return max_rtt_ms is not None and result.get('rtt_ms') is not None and \
+        result['rtt_ms'] > max_rtt_ms
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            hosts=dict(type='list', required=True),
+            host=dict(type='str'),
+            port=dict(type='int', default=5201),
+            duration=dict(type='int', default=3),
+            pings=dict(type='int', default=20),
+            timeout=dict(type='int', default=60),
+            min_mbps=dict(type='float'),
+            max_rtt_ms=dict(type='float'),
+            fail_on_threshold=dict(type='bool', default=True),
+        ),
+    )
+    params = module.params
+    hosts = []
+    for host in params['hosts']:
+        if host not in hosts:
+            hosts.append(host)
+    # The inventory name of a host is not necessarily the name it has in the
+    # cluster, so this host is found by its addresses
+    if params['host'] in hosts:
+        me = params['host']
+    else:
+        local = [host for host in hosts if is_local(host)]
+        if len(local) != 1:
+            module.fail_json(msg='%s of %s resolve to an address of this host' %
+                                 (', '.join(local) or 'none', ', '.join(hosts)))
+        me = local[0]
+    peers = [host for host in hosts if host != me]
+    schedule = rounds(hosts)
+    timeout = params['timeout']
+    row = dict((peer, {'rtt_ms': None, 'rtt_max_ms': None, 'mbps': None}) for peer in peers)
+    missed = set()
+    try:
+        server = BenchServer(params['port'])
+    except socket.error as e:
+        module.fail_json(msg='unable to listen on port %d: %s' % (params['port'], e))
+
+    def run_phase(offset, test):
+        for r, pairs in enumerate(schedule):
+            step = offset + r
+            server.advance(step)
+            peer, first = partner(pairs, me, hosts)
+            if peer is None:
+                continue
+            # One side of the pair measures, then the other
+            if not first and not server.wait_served(step, time.time() + timeout):
+                missed.add(peer)
+            try:
+                row[peer].update(test(peer, step, time.time() + timeout))
+            except socket.error as e:
+                row[peer]['error'] = str(e)
+                continue
+            if first and not server.wait_served(step, time.time() + timeout):
+                missed.add(peer)
+
+    try:
+        run_phase(0, lambda peer, step, deadline: round_trips(
+            peer, params['port'], step, params['pings'], deadline))
+        # No throughput until every host is done with the round trip times
+        deadline = time.time() + timeout
+        for peer in peers:
+            try:
+                connect(peer, params['port'], b'B', 0, deadline).close()
+            except socket.error as e:
+                row[peer]['error'] = str(e)
+        server.wait_arrived(len(peers), deadline)
+        run_phase(len(schedule), lambda peer, step, deadline: throughput(
+            peer, params['port'], step, params['duration'], deadline))
+    finally:
+        server.close()
+
+    flagged = [peer for peer in peers if flags(row[peer], params['min_mbps'], params['max_rtt_ms'])]
+    output = dict(changed=False, ansible_facts={'gluster_net_bench': {
+        'host': me, 'peers': row, 'flagged': flagged}})
+    if missed:
+        module.warn('%s did not measure this host' % ', '.join(sorted(missed)))
+    if flagged and params['fail_on_threshold']:
+        module.fail_json(msg='slow or unreachable peers: %s' % ', '.join(flagged), **output)
+    module.exit_json(**output)
+
+
+if __name__ == '__main__':
+    main()
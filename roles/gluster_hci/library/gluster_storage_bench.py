@@ -0,0 +1,276 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = """
+module: gluster_storage_bench
+short_description: Measure the throughput and latency of mount points
+description:
+  - Runs sequential and 4k random read and write workloads with direct I/O
+    against a file in each of the given directories, all directories in
+    parallel, and reports the throughput, IOPS and latency percentiles.
+  - The I/O buffers are page aligned as direct I/O requires. Directories on
+    file systems without direct I/O support, such as tmpfs, are measured with
+    synchronous writes instead and reported with C(direct) false.
+  - Any local directory can be measured, GlusterFS mounts or not.
+options:
+  paths:
+    description:
+      - Directories to measure.
+    required: true
+    type: list
+  size_mb:
+    description:
+      - Size of the test file written in each directory, in MiB.
+    type: int
+    default: 64
+  runtime:
+    description:
+      - Seconds each random workload runs for.
+    type: int
+    default: 5
+  block_size_kb:
+    description:
+      - Block size of the sequential workloads, in KiB.
+    type: int
+    default: 1024
+  random_block_size_kb:
+    description:
+      - Block size of the random workloads, in KiB.
+    type: int
+    default: 4
+  thresholds:
+    description:
+      - Pass thresholds, keyed by C(<workload>.<metric>). The workloads are
+        C(seq_write), C(seq_read), C(rand_write) and C(rand_read). C(mbps)
+        and C(iops) are minimums, C(p50_ms), C(p99_ms) and C(p999_ms) are
+        maximums.
+    type: dict
+    default: {}
+  fail_on_threshold:
+    description:
+      - Fail when a directory does not meet a threshold. Otherwise the
+        failures are only reported.
+    type: bool
+    default: true
+"""
+
+EXAMPLES = """
+- name: Measure the volume mounts
+  gluster_storage_bench:
+    paths:
+      - /mnt/tmp/engine
+      - /mnt/tmp/data
+    runtime: 10
+    thresholds:
+      rand_write.p99_ms: 20
+      seq_write.mbps: 100
+"""
+
+RETURN = """
+ansible_facts:
+  description: The measurements of every directory as C(gluster_storage_bench).
+  returned: always
+  type: dict
+  sample:
+    gluster_storage_bench:
+      /mnt/tmp/data:
+        direct: true
+        failures: []
+        rand_write:
+          ops: 5120
+          mbps: 4.0
+          iops: 1024.0
+          p50_ms: 0.8
+          p99_ms: 3.1
+          p999_ms: 7.9
+"""
+
+import errno
+import mmap
+import os
+import math
+import random
+import time
+from multiprocessing.pool import ThreadPool
+
+from ansible.module_utils.basic import AnsibleModule
+
+
+WORKLOADS = ['seq_write', 'seq_read', 'rand_write', 'rand_read']
+
+# Metrics that have to reach a threshold, the others must stay below it
+MINIMUM_METRICS = ['mbps', 'iops']
+MAXIMUM_METRICS = ['p50_ms', 'p99_ms', 'p999_ms']
+
+# Clocks that do not step with the wall clock, for the run deadlines and
+# for the latency of a single I/O (python 2 has neither)
+monotonic = getattr(time, 'monotonic', time.time)
+perf_counter = getattr(time, 'perf_counter', time.time)
+
+
+def percentile(latencies, fraction):
+    """Nearest-rank percentile of sorted latencies: the smallest one that at
+    least fraction of them do not exceed."""
+    if not latencies:
+        return None
+    rank = int(math.ceil(round(len(latencies) * fraction, 9)))
+    return latencies[min(max(rank, 1), len(latencies)) - 1]
+
+
+def summarize(latencies, block_size, elapsed):
+    latencies.sort()
+    ops = len(latencies)
+    elapsed = elapsed or 1e-9
+    return {'ops': ops,
+            'mbps': round(ops * block_size / elapsed / 1048576, 2),
+            'iops': round(ops / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if ops else None,
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if ops else None,
+            'p999_ms': round(percentile(latencies, 0.999) * 1000, 3) if ops else None}
+
+
+def open_file(path, flags):
+    """Open for direct I/O, or synchronous I/O where the file system refuses it."""
+    try:
+        return os.open(path, flags | os.O_DIRECT, 0o600), True
+    except OSError as e:
+        if e.errno != errno.EINVAL:
+            raise
+    return os.open(path, flags | os.O_DSYNC, 0o600), False
+
+
+def run_io(fd, buf, offsets, write, deadline=None):
+    """Issue one I/O of len(buf) per offset, returning the latency of each."""
+    latencies = []
+    for offset in offsets:
+        if deadline is not None and monotonic() >= deadline:
+            break
+        os.lseek(fd, offset, os.SEEK_SET)
+        start = perf_counter()
+        done = os.write(fd, buf) if write else os.readv(fd, [buf])
+        latencies.append(perf_counter() - start)
+        if done != len(buf):
+            raise IOError('short %s of %d bytes at offset %d' %
+                          ('write' if write else 'read', done, offset))
+    return latencies
+
+
+def random_offsets(size, block_size):
+    blocks = size // block_size
+    while True:
+        yield random.randrange(blocks) * block_size
+
+
+def bench_path(path, size, block_size, random_block_size, runtime):
+    """Run the workloads against a test file in path, one after the other."""
+    filename = os.path.join(path, '.gluster-storage-bench.%d' % os.getpid())
+    result = {}
+    seq_buf = mmap.mmap(-1, block_size)
+    rand_buf = mmap.mmap(-1, random_block_size)
+    seq_buf.write(os.urandom(block_size))
+    rand_buf.write(os.urandom(random_block_size))
+    try:
+        fd, result['direct'] = open_file(filename, os.O_RDWR | os.O_CREAT | os.O_TRUNC)
+        try:
+            for workload in WORKLOADS:
+                write = workload.endswith('write')
+                if workload.startswith('seq'):
+                    offsets, buf, deadline = range(0, size, block_size), seq_buf, None
+                else:
+                    offsets, buf = random_offsets(size, random_block_size), rand_buf
+                    deadline = monotonic() + runtime
+                start = monotonic()
+                latencies = run_io(fd, buf, offsets, write, deadline)
+                result[workload] = summarize(latencies, len(buf), monotonic() - start)
+        finally:
+            os.close(fd)
+    except (IOError, OSError) as e:
+        result['error'] = '%s: %s' % (filename, e)
+    finally:
+        seq_buf.close()
+        rand_buf.close()
+        try:
+            os.unlink(filename)
+        except OSError:
+            pass
+    return result
+
+
+def check_thresholds(result, thresholds):
+    failures = []
+    for key, limit in thresholds.items():
+        workload, metric = key.split('.', 1)
+        value = result.get(workload, {}).get(metric)
+        if value is None:
+            continue
+        if (metric in MINIMUM_METRICS and value < float(limit)) or \
+                (metric in MAXIMUM_METRICS and value > float(limit)):
+            failures.append('%s is %s, the threshold is %s' % (key, value, limit))
+    return failures
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            paths=dict(type='list', required=True),
+            size_mb=dict(type='int', default=64),
+            runtime=dict(type='int', default=5),
+            block_size_kb=dict(type='int', default=1024),
+            random_block_size_kb=dict(type='int', default=4),
+            thresholds=dict(type='dict', default={}),
+            fail_on_threshold=dict(type='bool', default=True),
+        ),
+    )
+    params = module.params
+    for key in params['thresholds']:
+        workload, _, metric = key.partition('.')
+        if workload not in WORKLOADS or metric not in MINIMUM_METRICS + MAXIMUM_METRICS:
+            module.fail_json(msg='unknown threshold %s' % key)
+    block_size = params['block_size_kb'] * 1024
+    random_block_size = params['random_block_size_kb'] * 1024
+    size = max(params['size_mb'] * 1048576 // block_size, 1) * block_size
+    if block_size % mmap.PAGESIZE or random_block_size % 512 or random_block_size > size:
+        module.fail_json(msg='block sizes have to be multiples of the page size '
+                             'and 512 bytes, and fit in the test file')
+    for path in params['paths']:
+        if not os.path.isdir(path):
+            module.fail_json(msg='%s is not a directory' % path)
+
+    pool = ThreadPool(len(params['paths']))
+    try:
+        outcomes = pool.map(lambda path: bench_path(path, size, block_size,
+                                                    random_block_size, params['runtime']),
+                            params['paths'])
+    finally:
+        pool.close()
+        pool.join()
+
+    facts = {}
+    failed = []
+    errors = False
+    for path, result in zip(params['paths'], outcomes):
+        if 'error' in result:
+            errors = True
+            result['failures'] = [result.pop('error')]
+        else:
+            result['failures'] = check_thresholds(result, params['thresholds'])
+        if result['failures']:
+            failed.append(path)
+        facts[path] = result
+    output = dict(changed=False, ansible_facts={'gluster_storage_bench': facts})
+    if errors or (failed and params['fail_on_threshold']):
+        module.fail_json(msg='storage benchmark failed on %s' % ', '.join(failed), **output)
+    module.exit_json(**output)
+
+
+if __name__ == '__main__':
+    main()
@@ -20,15 +20,30 @@ version_added: '1.9'
 options:
   name:
     description:
-      - The volume name.
-    required: true
+      - The volume name. Either I(name) or I(volumes) is required.
     aliases: ['volume']
   state:
     description:
       - Use present/absent ensure if a volume exists or not.
         Use started/stopped to control its availability.
-    required: true
+      - Required with I(name). With I(volumes) it is the default state of the
+        entries, which otherwise default to present.
     choices: ['absent', 'present', 'started', 'stopped']
+  volumes:
+    description:
+      - List of volume specs to manage in a single call, instead of I(name).
+        Each entry takes C(name), C(state), C(cluster), C(bricks), C(replicas),
+        C(arbiters), C(stripes), C(disperses), C(redundancies), C(transport),
+        C(options), C(quota), C(directory), C(quotas), C(start_on_create), C(force)
+        and C(rebalance); keys that are not set fall back to the module options of
+        the same name. The entry options are merged over the module I(options).
+      - C(volname), C(brick), C(arbiter) and C(servers) are accepted for
+        C(name), C(bricks), C(arbiters) and C(cluster). An entry with any other
+        key fails the module.
+      - The cluster state is read once and the changes of all the volumes are
+        applied together, one kind of operation at a time. The per-volume
+        outcome is returned as C(results), the quota facts are keyed by volume.
+    type: list
   cluster:
     description:
       - List of hosts to use for probing and brick setup.
@@ -62,6 +77,21 @@ options:
     description:
       - Brick paths on servers. Multiple brick paths can be separated by commas.
     aliases: [ brick ]
+  placement:
+    description:
+      - How the bricks are grouped into replica or disperse sets.
+      - C(ordered) lists the bricks path by path across the hosts in
+        I(cluster) order.
+      - C(spread) builds every set from distinct hosts, from distinct zones
+        when I(topology) has labels, and balances the bricks by host capacity.
+        New bricks of an existing volume are only added in full sets.
+    choices: ['ordered', 'spread']
+    default: ordered
+  topology:
+    description:
+      - Failure domain and capacity of the hosts for the C(spread) placement,
+        as a dictionary of host to C(zone) (or C(rack)) and C(capacity).
+    type: dict
   start_on_create:
     description:
       - Controls whether the volume is started after creation or not.
@@ -72,15 +102,42 @@ options:
       - Controls whether the cluster is rebalanced after changes.
     type: bool
     default: 'no'
+  rebalance_wait:
+    description:
+      - Wait for the rebalance to complete. The aggregate and per-node files
+        scanned and moved, bytes moved, failures, skips, transfer rates and
+        the estimated time left are returned in C(results) as C(rebalance).
+    type: bool
+    default: 'no'
+  rebalance_timeout:
+    description:
+      - Seconds to wait for the rebalance to complete with I(rebalance_wait).
+    type: int
+    default: 3600
   directory:
     description:
       - Directory for limit-usage.
   options:
     description:
       - A dictionary/hash with options/settings for the volume.
+      - The effective values are read once with C(gluster volume get <name> all)
+        and only the options that differ are set, all in one C(volume set).
+      - C(group) is expanded from the group files in C(/var/lib/glusterd/groups);
+        options given explicitly take precedence over the group values.
   quota:
     description:
       - Quota value for limit-usage (be sure to use 10.0MB instead of 10MB, see quota list).
+  quotas:
+    description:
+      - Map of directories to their quota. A value is either the hard limit,
+        a dictionary with C(hard) and an optional C(soft) limit in percent of
+        the hard one, or C(absent) (or null) to remove the quota of the
+        directory. Quota is enabled on the volume if needed.
+      - The quotas are read once with C(gluster volume quota <name> list) and
+        only the limits that differ are set or removed.
+      - The usage and headroom of every directory are returned in the
+        C(glusterfs) facts as C(quota_usage).
+    type: dict
   force:
     description:
       - If brick is being created in the root partition, module will fail.
@@ -91,6 +148,127 @@ options:
       - The node from which to run the volume commands. This is required for the
         API calls in GlusterFS 4.0 and above
     version_added: '2.7'
+  verify:
+    description:
+      - Reach the GlusterD2 REST API of C(master) over HTTPS and check its
+        certificate, against the system CA bundle with C(yes) or against the
+        CA bundle at the given path.
+      - With C(no) the API is reached over plain HTTP.
+    type: str
+    default: 'no'
+  batch:
+    description:
+      - Send the start, option and quota commands of this run through a single
+        gluster CLI session instead of starting one gluster process per command.
+    type: bool
+    default: 'no'
+  probe_workers:
+    description:
+      - Number of hosts from C(cluster) that are probed concurrently.
+    type: int
+    default: 8
+  peer_timeout:
+    description:
+      - Seconds to wait, in total, for all newly probed hosts to reach the
+        'Peer in Cluster' state. The join latency of every probed host is
+        returned as C(peer_join_latency).
+    type: int
+    default: 60
+  lock_timeout:
+    description:
+      - Seconds, in total, to keep retrying gluster commands that fail because
+        another transaction holds the cluster lock. Retries back off
+        exponentially with jitter. The number of retries and the time spent
+        waiting are returned as C(lock_retries). Set to 0 to disable retrying.
+    type: int
+    default: 60
+  tune:
+    description:
+      - Derive C(client.event-threads), C(server.event-threads),
+        C(performance.io-thread-count), C(cluster.shd-max-threads),
+        C(cluster.shd-wait-qlength), C(performance.write-behind-window-size)
+        and C(performance.read-ahead-page-count) from I(host_profiles).
+      - With C(report) the recommended and current values are returned in
+        C(results) as C(tuning). With C(apply) the recommended values are also
+        set, options given in I(options) take precedence.
+    choices: ['none', 'report', 'apply']
+    default: none
+  host_profiles:
+    description:
+      - The C(gluster_host_profile) facts of all the brick hosts, gathered by
+        the gluster_host_profile module. Required with I(tune).
+    type: list
+  cache_ttl:
+    description:
+      - Seconds the peer, volume, option and quota state cached on the node
+        by earlier runs is reused for, see the gluster_facts module. The cache
+        is only used while the glusterd state files are unchanged, and any
+        change made by the module invalidates it. 0 disables the cache.
+    type: int
+    default: 30
+  cache_path:
+    description:
+      - Where the cached state is kept.
+    default: /var/lib/gluster-ansible/facts.json
+  facts_scope:
+    description:
+      - Return the facts of all the volumes of the pool, or only of the
+        volumes managed by this call.
+    choices: ['all', 'managed']
+    default: all
+  action:
+    description:
+      - Run a diagnostic on the volumes of I(name) or I(volumes) instead of
+        managing them, I(state) is not required.
+      - C(profile) starts C(gluster volume profile) on the volumes, samples
+        the FOP counters of every brick each I(profile_interval) seconds for
+        I(profile_window) seconds and stops profiling again, unless it was
+        already on. The calls and min/avg/max latency of every FOP per brick,
+        the hottest bricks and FOPs by the time spent in FOPs and the calls
+        and latency of every sample are returned as C(profile).
+      - C(top) runs C(gluster volume top) once for every metric in
+        I(top_metrics) on each volume, the volumes in parallel, and merges
+        the results of the bricks into the I(top_n) paths of each volume.
+        The bricks of a replica or disperse set see the same operations on a
+        file, so the count of a path is the highest within its set, summed
+        over the sets. The paths, the open fd counters and the throughput
+        measured on every brick are returned in the C(gluster_top) facts,
+        with the errors of the metrics that failed.
+    choices: ['profile', 'top']
+  profile_window:
+    description:
+      - Seconds the volumes are profiled for.
+    type: int
+    default: 60
+  profile_interval:
+    description:
+      - Seconds between the profile samples.
+    type: int
+    default: 10
+  top_metrics:
+    description:
+      - The C(gluster volume top) metrics collected by the C(top) action.
+      - C(read-perf) and C(write-perf) measure the throughput of every brick
+        with I(top_block_size) and I(top_block_count), and otherwise list the
+        throughput of the files.
+    type: list
+    choices: ['open', 'read', 'write', 'opendir', 'readdir', 'read-perf', 'write-perf']
+    default: ['open', 'read', 'write', 'opendir', 'readdir']
+  top_block_size:
+    description:
+      - Block size in bytes of the C(read-perf) and C(write-perf) measurements.
+    type: int
+  top_block_count:
+    description:
+      - Number of blocks read and written by the C(read-perf) and
+        C(write-perf) measurements.
+    type: int
+  top_n:
+    description:
+      - Number of bricks, FOPs or paths in the rankings of I(action), at most
+        100 for C(top).
+    type: int
+    default: 10
 notes:
   - Requires cli tools for GlusterFS on servers.
   - Will add new bricks, but not remove them.
@@ -117,6 +295,16 @@ EXAMPLES = """
     options:
       performance.cache-size: 256MB
 
+- name: tune, applying all options through one gluster session
+  gluster_volume:
+    state: present
+    name: test1
+    batch: yes
+    options:
+      performance.cache-size: 256MB
+      performance.io-thread-count: '32'
+      network.ping-timeout: '30'
+
 - name: Set multiple options on GlusterFS volume
   gluster_volume:
     state: present
@@ -127,6 +315,28 @@ EXAMPLES = """
         quick-read: 'on'
       }
 
+- name: create several gluster volumes in one call
+  gluster_volume:
+    state: present
+    replicas: 3
+    cluster:
+      - 192.0.2.10
+      - 192.0.2.11
+      - 192.0.2.12
+    options:
+      network.ping-timeout: '30'
+    volumes:
+      - name: engine
+        bricks: /gluster_bricks/engine/engine
+      - name: data
+        bricks: /gluster_bricks/data/data
+        arbiters: 1
+        options:
+          performance.strict-o-direct: 'on'
+      - name: scratch
+        state: absent
+  run_once: true
+
 - name: start gluster volume
   gluster_volume:
     state: started
@@ -139,6 +349,35 @@ EXAMPLES = """
     directory: /foo
     quota: 20.0MB
 
+- name: limit usage of many directories, removing the quota of /old
+  gluster_volume:
+    state: present
+    name: test1
+    quotas:
+      /tenants/a: 100GB
+      /tenants/b:
+        hard: 1TB
+        soft: 70
+      /old: absent
+
+- name: profile the FOP latency of a slow volume for two minutes
+  gluster_volume:
+    action: profile
+    name: data
+    profile_window: 120
+  run_once: true
+  register: data_profile
+
+- name: find the hot files and measure the brick throughput
+  gluster_volume:
+    action: top
+    name: data
+    top_metrics: [open, read, write, read-perf, write-perf]
+    top_block_size: 1048576
+    top_block_count: 256
+    top_n: 20
+  run_once: true
+
 - name: stop gluster volume
   gluster_volume:
     state: stopped
@@ -160,18 +399,46 @@ EXAMPLES = """
   run_once: true
 """
 
-import re
+import base64
+import hashlib
+import hmac
+import json
+import os
 import socket
+import ssl
 import time
 import traceback
+import xml.etree.ElementTree as ET
 from distutils.version import LooseVersion
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils._text import to_native
-from glusterapilib import Client
-from glusterapilib.exceptions import GlusterApiError
+from ansible.module_utils._text import to_bytes, to_native
+from ansible.module_utils.six.moves import http_client
+from ansible.module_utils.gluster_state import (BATCH_LINE_MAX, FactsCache, GlusterBatch,
+                                                 parse_size, parse_percent, parse_peer,
+                                                 parse_volume, parse_quota, quota_headroom,
+                                                 run_with_retry)
 
 glusterbin = ''
+batch = None
+
+# Seconds, in total, to keep retrying commands rejected because another
+# transaction holds the cluster lock, and what those retries cost, counted
+# by run_with_retry
+lock_timeout = 60
+lock_retries = {'retries': 0, 'wait_time': 0.0}
+
+# Option group files expanded for the `group` option
+GROUPS_DIR = '/var/lib/glusterd/groups'
+
+# Spellings glusterd accepts for boolean option values
+TRUE_VALUES = ('on', 'yes', 'true', 'enable', '1')
+FALSE_VALUES = ('off', 'no', 'false', 'disable', '0')
+
+# Volumes whose top is collected at once by the top action
+TOP_WORKERS = 32
 
 
 def run_gluster(gargs, **kwargs):
@@ -180,10 +447,11 @@ def run_gluster(gargs, **kwargs):
     args = [glusterbin, '--mode=script']
     args.extend(gargs)
     try:
-        rc, out, err = module.run_command(args, **kwargs)
+        rc, out, err = run_with_retry(module, args, lock_timeout, lock_retries, **kwargs)
         if rc != 0:
             module.fail_json(msg='error running gluster (%s) command (rc=%d): %s' %
-                                 (' '.join(args), rc, out or err), exception=traceback.format_exc())
+                                 (' '.join(args), rc, out or err), exception=traceback.format_exc(),
+                             lock_retries=lock_retries)
     except Exception as e:
         module.fail_json(msg='error running gluster (%s) command: %s' % (' '.join(args),
                                                                          to_native(e)), exception=traceback.format_exc())
@@ -195,120 +463,408 @@ def run_gluster_nofail(gargs, **kwargs):
     global module
     args = [glusterbin]
     args.extend(gargs)
-    rc, out, err = module.run_command(args, **kwargs)
+    rc, out, err = run_with_retry(module, args, lock_timeout, lock_retries, **kwargs)
     if rc != 0:
         return None
     return out
 
 
+def run_gluster_queued(gargs):
+    """Run a gluster command, or queue it when a batch session is open."""
+    global batch
+    if batch is None:
+        return run_gluster(gargs)
+    batch.add(gargs)
+
+
+def flush_gluster():
+    """Run all queued commands and fail on the first one that failed."""
+    global batch
+    global module
+    if batch is None:
+        return
+    for gargs, rc, out, err in batch.run():
+        if rc != 0:
+            module.fail_json(msg='error running gluster (%s) command (rc=%d): %s' %
+                                 (' '.join(gargs), rc, err or out), lock_retries=lock_retries)
+
+
+def iter_xml(out, tag):
+    """Yield every <tag> element of a gluster --xml document.
+
+    The document is parsed incrementally and each element is cleared once the
+    caller is done with it, so a pool with hundreds of volumes never has its
+    whole output materialised as a tree.
+    """
+    global module
+    try:
+        for event, elem in ET.iterparse(BytesIO(to_bytes(out)), events=('end',)):
+            if elem.tag == tag:
+                yield elem
+                elem.clear()
+    except ET.ParseError as e:
+        module.fail_json(msg='unable to parse gluster xml output: %s' % to_native(e),
+                         exception=traceback.format_exc())
+
+
 def get_peers():
-    out = run_gluster(['peer', 'status'])
+    out = run_gluster(['peer', 'status', '--xml'])
     peers = {}
-    hostname = None
-    uuid = None
-    state = None
-    shortNames = False
-    for row in out.split('\n'):
-        if ': ' in row:
-            key, value = row.split(': ')
-            if key.lower() == 'hostname':
-                hostname = value
-                shortNames = False
-            if key.lower() == 'uuid':
-                uuid = value
-            if key.lower() == 'state':
-                state = value
-                peers[hostname] = [uuid, state]
-        elif row.lower() == 'other names:':
-            shortNames = True
-        elif row != '' and shortNames is True:
-            peers[row] = [uuid, state]
-        elif row == '':
-            shortNames = False
+    for elem in iter_xml(out, 'peer'):
+        names, info = parse_peer(elem)
+        for name in names:
+            peers[name] = info
     return peers
 
 
-def get_volumes():
-    out = run_gluster(['volume', 'info'])
-
+def get_volumes(name=None):
+    args = ['volume', 'info']
+    if name:
+        args.append(name)
+    args.append('--xml')
+    if name:
+        # A volume that does not exist is not an error when refreshing
+        out = run_gluster_nofail(args)
+        if not out:
+            return {}
+    else:
+        out = run_gluster(args)
     volumes = {}
-    volume = {}
-    for row in out.split('\n'):
-        if ': ' in row:
-            key, value = row.split(': ')
-            if key.lower() == 'volume name':
-                volume['name'] = value
-                volume['options'] = {}
-                volume['quota'] = False
-            if key.lower() == 'volume id':
-                volume['id'] = value
-            if key.lower() == 'status':
-                volume['status'] = value
-            if key.lower() == 'transport-type':
-                volume['transport'] = value
-            if value.lower().endswith(' (arbiter)'):
-                if 'arbiters' not in volume:
-                    volume['arbiters'] = []
-                value = value[:-10]
-                volume['arbiters'].append(value)
-            if key.lower() != 'bricks' and key.lower()[:5] == 'brick':
-                if 'bricks' not in volume:
-                    volume['bricks'] = []
-                volume['bricks'].append(value)
-            # Volume options
-            if '.' in key:
-                if 'options' not in volume:
-                    volume['options'] = {}
-                volume['options'][key] = value
-                if key == 'features.quota' and value == 'on':
-                    volume['quota'] = True
-        else:
-            if row.lower() != 'bricks:' and row.lower() != 'options reconfigured:':
-                if len(volume) > 0:
-                    volumes[volume['name']] = volume
-                volume = {}
+    for elem in iter_xml(out, 'volume'):
+        volume = parse_volume(elem)
+        if volume['name']:
+            volumes[volume['name']] = volume
     return volumes
 
 
-def get_quotas(name, nofail):
-    quotas = {}
+def get_quota_usage(name, nofail):
+    args = ['volume', 'quota', name, 'list', '--xml']
     if nofail:
-        out = run_gluster_nofail(['volume', 'quota', name, 'list'])
+        out = run_gluster_nofail(args)
         if not out:
-            return quotas
+            return {}
     else:
-        out = run_gluster(['volume', 'quota', name, 'list'])
-    for row in out.split('\n'):
-        if row[:1] == '/':
-            q = re.split(r'\s+', row)
-            quotas[q[0]] = q[1]
+        out = run_gluster(args)
+    quotas = {}
+    for elem in iter_xml(out, 'limit'):
+        path, usage = parse_quota(elem)
+        if path:
+            quotas[path] = usage
     return quotas
 
 
-def wait_for_peer(host):
-    for x in range(0, 4):
-        peers = get_peers()
-        if host in peers and peers[host][1].lower().find('peer in cluster') != -1:
-            return True
-        time.sleep(1)
-    return False
+def quota_limit(value):
+    """The (hard, soft percent) of a `quotas` value, None to remove the quota."""
+    global module
+    if value is None or str(value).lower() == 'absent':
+        return None
+    if isinstance(value, dict):
+        hard, soft = value.get('hard'), value.get('soft')
+    else:
+        hard, soft = value, None
+    if parse_size(hard) is None or (soft is not None and parse_percent(soft) is None):
+        module.fail_json(msg='invalid quota %s' % value)
+    return str(hard), parse_percent(soft)
+
+
+def quota_changes(desired, usage):
+    """The limit-usage and remove commands that bring usage to desired."""
+    changes = []
+    for directory in sorted(desired):
+        limit = desired[directory]
+        if limit is None:
+            if directory in usage:
+                changes.append(['remove', directory])
+            continue
+        hard, soft = limit
+        current = usage.get(directory)
+        if current is not None and current['hard_limit'] == parse_size(hard) and \
+                (soft is None or parse_percent(current['soft_limit_percent']) == soft):
+            continue
+        change = ['limit-usage', directory, hard]
+        if soft is not None:
+            change.append('%d%%' % soft)
+        changes.append(change)
+    return changes
+
+
+def get_quotas(name, nofail):
+    return dict((path, usage['limit']) for path, usage in
+                get_quota_usage(name, nofail).items())
+
+
+def get_volume_options(name):
+    """Effective value of every option of a volume, defaults included."""
+    out = run_gluster(['volume', 'get', name, 'all', '--xml'])
+    options = {}
+    for elem in iter_xml(out, 'Opt'):
+        value = elem.findtext('Value') or ''
+        if value.endswith(' (DEFAULT)'):
+            value = value[:-10]
+        options[elem.findtext('Option')] = value
+    return options
+
+
+def read_option_group(group, groups_dir=GROUPS_DIR):
+    """Options of a glusterd group file, None if there is no such group."""
+    try:
+        with open(os.path.join(groups_dir, group)) as f:
+            lines = f.readlines()
+    except (IOError, OSError):
+        return None
+    options = {}
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#') and '=' in line:
+            key, value = line.split('=', 1)
+            options[key.strip()] = value.strip()
+    return options
+
 
+def expand_options(options, groups_dir=GROUPS_DIR):
+    """Replace the `group` option with the options of its group files.
 
-def probe(host, myhostname):
+    Options given explicitly take precedence over the group values.
+    """
     global module
-    out = run_gluster(['peer', 'probe', host])
-    if out.find('localhost') == -1 and not wait_for_peer(host):
-        module.fail_json(msg='failed to probe peer %s on %s' % (host, myhostname))
+    expanded = {}
+    if options.get('group'):
+        for group in str(options['group']).split(','):
+            values = read_option_group(group.strip(), groups_dir)
+            if values is None:
+                module.fail_json(msg='option group %s not found in %s' % (group, groups_dir))
+            expanded.update(values)
+    expanded.update((key, value) for key, value in options.items() if key != 'group')
+    return expanded
+
+
+def option_text(value):
+    """An option value as it is sent to glusterd, YAML booleans as on/off."""
+    if isinstance(value, bool):
+        return 'on' if value else 'off'
+    return str(value).strip()
+
+
+def option_value(value):
+    """Normalise an option value so equivalent boolean spellings compare equal."""
+    value = option_text(value)
+    if value.lower() in TRUE_VALUES:
+        return 'on'
+    if value.lower() in FALSE_VALUES:
+        return 'off'
+    return value
+
+
+def same_option_value(current, desired):
+    """Whether two option values are equal.
+
+    The boolean spellings only compare equal when both values are boolean
+    words, so that e.g. an integer option at 8 differs from a desired 1.
+    """
+    current, desired = option_text(current), option_text(desired)
+    booleans = TRUE_VALUES + FALSE_VALUES
+    if current.lower() in booleans and desired.lower() in booleans:
+        return option_value(current) == option_value(desired)
+    return current == desired
+
+
+def option_changes(desired, current):
+    """The options of desired whose values differ from current."""
+    return dict((key, value) for key, value in desired.items()
+                if key not in current or not same_option_value(current[key], value))
+
+
+def clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+def recommend_options(profiles):
+    """Derive volume tuning from the gluster_host_profile of every brick host.
+
+    A volume is only as fast as its weakest brick host, so the smallest CPU
+    count, memory and NIC speed and the slowest storage of all the hosts
+    are used.
+    """
+    order = ['nvme', 'ssd', 'rotational']
+    cpus = min(profile.get('cpus') or 1 for profile in profiles)
+    memory_gb = min(profile.get('memory_mb') or 0 for profile in profiles) // 1024
+    nic = min(profile.get('nic_speed_mbps') or 0 for profile in profiles)
+    storage = max((profile.get('storage') or 'ssd' for profile in profiles), key=order.index)
+
+    event_threads = clamp(cpus // 4, 2, 16)
+    if nic and nic < 10000:
+        # The network, not the CPU, is the bottleneck below 10GbE
+        event_threads = min(event_threads, 4)
+    if storage == 'rotational':
+        io_threads, shd_threads, shd_qlength, ra_pages = 16, 1, 1024, 16
+    elif storage == 'ssd':
+        io_threads, shd_threads, shd_qlength, ra_pages = clamp(cpus // 2, 16, 32), \
+            clamp(cpus // 16, 1, 4), 4096, 8
+    else:
+        io_threads, shd_threads, shd_qlength, ra_pages = clamp(cpus, 16, 64), \
+            clamp(cpus // 8, 1, 8), 10000 if memory_gb >= 64 else 4096, 4
+    if memory_gb >= 128 and nic >= 25000:
+        wb_window = '8MB'
+    elif memory_gb >= 32:
+        wb_window = '4MB'
+    else:
+        wb_window = '1MB'
+    return {'client.event-threads': str(event_threads),
+            'server.event-threads': str(event_threads),
+            'performance.io-thread-count': str(io_threads),
+            'cluster.shd-max-threads': str(shd_threads),
+            'cluster.shd-wait-qlength': str(shd_qlength),
+            'performance.write-behind-window-size': wb_window,
+            'performance.read-ahead-page-count': str(ra_pages)}
+
+
+class ClusterSnapshot(object):
+    """Peer, volume and quota state read once per module run.
+
+    Each part is queried lazily on first use and cached.  After changing a
+    volume only that volume is re-read with `gluster volume info <name>`,
+    instead of listing the whole pool again.  With a FactsCache the state
+    left by earlier runs is used while it is fresh, and what this run read is
+    stored back by save().
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self._read = {}
+        self._peers = self.cached('peers')
+        self._volumes = self.cached('volumes')
+        self._quotas = {}
+        self._options = {}
+
+    def cached(self, section):
+        return self.cache.get(section) if self.cache else None
+
+    @property
+    def peers(self):
+        if self._peers is None:
+            self._peers = self._read['peers'] = get_peers()
+        return self._peers
+
+    @property
+    def volumes(self):
+        if self._volumes is None:
+            self._volumes = self._read['volumes'] = get_volumes()
+        return self._volumes
+
+    def quota_usage(self, name, nofail=False):
+        if name not in self._quotas:
+            section = 'quota_usage/' + name
+            self._quotas[name] = self.cached(section)
+            if self._quotas[name] is None:
+                self._quotas[name] = self._read[section] = get_quota_usage(name, nofail)
+        return self._quotas[name]
+
+    def option_values(self, name):
+        if name not in self._options:
+            section = 'option_values/' + name
+            self._options[name] = self.cached(section)
+            if self._options[name] is None:
+                self._options[name] = self._read[section] = get_volume_options(name)
+        return self._options[name]
+
+    def quotas(self, name, nofail=False):
+        return dict((path, usage['limit']) for path, usage in
+                    self.quota_usage(name, nofail).items())
+
+    def save(self):
+        """Store the state read by this run, which must not have changed it."""
+        if self.cache is None:
+            return
+        for section, value in self._read.items():
+            self.cache.set(section, value)
+        self.cache.save()
+
+    def refresh_peers(self):
+        self._peers = None
+        return self.peers
+
+    def refresh_volume(self, name):
+        self._quotas.pop(name, None)
+        self._options.pop(name, None)
+        if self._volumes is None:
+            return self.volumes.get(name)
+        volume = get_volumes(name).get(name)
+        if volume is None:
+            self._volumes.pop(name, None)
+        else:
+            self._volumes[name] = volume
+        return volume
+
+    def refresh_quotas(self, name):
+        self._quotas.pop(name, None)
+
+
+def wait_for_peers(pending, timeout):
+    """Wait until every host in pending is 'Peer in Cluster'.
+
+    pending maps a host to the time its probe was issued.  All hosts are
+    watched from one shared `peer status` poll whose interval doubles up to a
+    few seconds, until the overall timeout expires.  Returns the join latency
+    of each host and the hosts that did not make it in time.
+    """
+    latency = {}
+    pending = dict(pending)
+    deadline = time.time() + timeout
+    delay = 0.25
+    while pending:
+        peers = get_peers()
+        now = time.time()
+        for host in list(pending):
+            if host in peers and peers[host][1].lower().find('peer in cluster') != -1:
+                latency[host] = round(now - pending.pop(host), 3)
+        if not pending or now >= deadline:
+            break
+        time.sleep(min(delay, max(deadline - now, 0)))
+        delay = min(delay * 2, 5)
+    return latency, sorted(pending)
+
+
+def probe(host):
+    """Issue `peer probe` for host, returns (host, rc, output, probed_at).
+
+    Runs in a worker thread, so errors are returned instead of failing.
+    """
+    global glusterbin
+    global module
+    probed_at = time.time()
+    rc, out, err = run_with_retry(module, [glusterbin, '--mode=script', 'peer', 'probe', host],
+                                 lock_timeout, lock_retries)
+    return host, rc, out or err, probed_at
 
 
-def probe_all_peers(hosts, peers, myhostname):
-    for host in hosts:
-        host = host.strip()  # Clean up any extra space for exact comparison
-        if host not in peers:
-            probe(host, myhostname)
+def probe_all_peers(hosts, peers, myhostname, workers=8, timeout=60):
+    global module
+    # Clean up any extra space for exact comparison
+    hosts = [host.strip() for host in hosts]
+    hosts = [host for host in hosts if host not in peers]
+    if not hosts:
+        return {}
+    pool = ThreadPool(max(1, min(workers, len(hosts))))
+    try:
+        results = pool.map(probe, hosts)
+    finally:
+        pool.close()
+        pool.join()
+
+    pending = {}
+    for host, rc, out, probed_at in results:
+        if rc != 0:
+            module.fail_json(msg='failed to probe peer %s on %s: %s' % (host, myhostname, out))
+        if out.find('localhost') == -1:
+            pending[host] = probed_at
+    latency, missing = wait_for_peers(pending, timeout)
+    if missing:
+        module.fail_json(msg='failed to probe peer %s on %s' % (', '.join(missing), myhostname),
+                         peer_join_latency=latency)
+    return latency
 
 
-def create_volume(name, stripe, replica, arbiter, disperse, redundancy, transport, hosts, bricks, force):
+def create_volume(name, stripe, replica, arbiter, disperse, redundancy, transport, bricks, force):
     args = ['volume', 'create']
     args.append(name)
     if stripe:
@@ -328,16 +884,127 @@ def create_volume(name, stripe, replica, arbiter, disperse, redundancy, transpor
         args.append(str(redundancy))
     args.append('transport')
     args.append(transport)
-    for brick in bricks:
-        for host in hosts:
-            args.append(('%s:%s' % (host, brick)))
+    args.extend(bricks)
     if force:
         args.append('force')
     run_gluster(args)
 
 
+def place_bricks(candidates, set_size, topology=None, existing=(), arbiter=False):
+    """Order candidate bricks into sets spread across failure domains.
+
+    candidates are 'host:path' bricks, in the order their paths should be
+    used on each host.  topology optionally maps a host to its `zone` (or
+    `rack`) and brick `capacity`; hosts without a zone are a failure domain
+    of their own and the capacity defaults to 1.  Bricks in existing count
+    towards the load of their hosts, so an expansion evens out the hosts the
+    volume already uses.
+
+    Every set takes its bricks from distinct hosts, from distinct zones
+    whenever enough zones have bricks left, preferring the zones and then
+    the hosts with the most bricks left, and then the least load relative to
+    capacity.  Hosts
+    holding a brick for every remaining set always go first, so no brick is
+    stranded on a single host at the end.  With an
+    arbiter the last brick of each set is the arbiter, rotated to the host
+    holding the fewest arbiters.  Returns the ordered bricks, in full sets,
+    and the candidates left over, either because they do not fill a set or
+    because a set would need two bricks of the same host.
+    """
+    topology = topology or {}
+    set_size = max(set_size or 1, 1)
+    queues = {}
+    hosts = []
+    for brick in candidates:
+        host = brick.rsplit(':', 1)[0]
+        if host not in queues:
+            queues[host] = []
+            hosts.append(host)
+        queues[host].append(brick)
+
+    def label(host, key, default):
+        value = topology.get(host, {}).get(key)
+        return default if value is None else value
+
+    order = dict((host, index) for index, host in enumerate(hosts))
+    zone = dict((host, label(host, 'zone', label(host, 'rack', host))) for host in hosts)
+    capacity = dict((host, float(label(host, 'capacity', 1)) or 1.0) for host in hosts)
+    load = dict((host, 0.0) for host in hosts)
+    arbiters = dict((host, 0) for host in hosts)
+    for brick in existing:
+        host = brick.rsplit(':', 1)[0]
+        if host in load:
+            load[host] += 1
+
+    ordered = []
+    for _ in range(len(candidates) // set_size):
+        zone_left = {}
+        for host in hosts:
+            zone_left[zone[host]] = zone_left.get(zone[host], 0) + len(queues[host])
+        available = sorted((host for host in hosts if queues[host]),
+                           key=lambda host: (-zone_left[zone[host]], -len(queues[host]),
+                                             load[host] / capacity[host], order[host]))
+        if len(available) < set_size:
+            # Another set would need two bricks of the same host
+            break
+        # A host with a brick for every set still to build has to be in this
+        # one, or its bricks could not all be placed on distinct hosts
+        sets_left = sum(len(queues[host]) for host in available) // set_size
+        chosen = [host for host in available if len(queues[host]) >= sets_left][:set_size]
+        for host in available:
+            if len(chosen) < set_size and zone[host] not in [zone[c] for c in chosen]:
+                chosen.append(host)
+        for host in available:
+            if len(chosen) < set_size and host not in chosen:
+                chosen.append(host)
+        if arbiter and set_size > 1:
+            chosen.sort(key=lambda host: (arbiters[host], -load[host] / capacity[host]))
+            arbiter_host = chosen.pop(0)
+            chosen.append(arbiter_host)
+            arbiters[arbiter_host] += 1
+        for position, host in enumerate(chosen):
+            ordered.append(queues[host].pop(0))
+            if not (arbiter and position == set_size - 1):
+                load[host] += 1
+    placed = set(ordered)
+    return ordered, [brick for brick in candidates if brick not in placed]
+
+
+def brick_layout(spec, volume=None):
+    """Bricks to create a volume with, or to add to it, in add order.
+
+    With the `ordered` placement the bricks are listed path by path for a
+    new volume and host by host for an expansion.  With `spread` they are
+    arranged by place_bricks, an expansion only in full sets.
+    """
+    global module
+    existing = volume['bricks'] if volume else []
+    if module.params['placement'] == 'ordered':
+        if volume is None:
+            return ['%s:%s' % (host, path) for path in spec['bricks'] for host in spec['cluster']]
+        return ['%s:%s' % (host, path) for host in spec['cluster'] for path in spec['bricks']
+                if '%s:%s' % (host, path) not in existing]
+    candidates = ['%s:%s' % (host, path) for path in spec['bricks'] for host in spec['cluster']
+                  if '%s:%s' % (host, path) not in existing]
+    if volume is None:
+        set_size = spec['replicas'] or spec['disperses'] or 1
+        arbiter = bool(spec['arbiters'])
+    else:
+        set_size = volume.get('replica_count') or volume.get('disperse_count') or 1
+        arbiter = bool(volume.get('arbiter_count'))
+    ordered, unused = place_bricks(candidates, set_size, module.params['topology'],
+                                   existing, arbiter)
+    if unused and volume is None:
+        module.fail_json(msg='unable to place bricks %s of volume %s in sets of %d on distinct hosts' %
+                             (', '.join(unused), spec['name'], set_size))
+    if unused:
+        module.warn('bricks %s of volume %s were not added, they do not fill a set of %d on distinct hosts' %
+                    (', '.join(unused), spec['name'], set_size))
+    return ordered
+
+
 def start_volume(name):
-    run_gluster(['volume', 'start', name])
+    run_gluster_queued(['volume', 'start', name])
 
 
 def stop_volume(name):
@@ -345,7 +1012,20 @@ def stop_volume(name):
 
 
 def set_volume_option(name, option, parameter):
-    run_gluster(['volume', 'set', name, option, parameter])
+    run_gluster_queued(['volume', 'set', name, option, parameter])
+
+
+def set_volume_options(name, options):
+    # `volume set` takes any number of key/value pairs, as many as fit on a
+    # line of the CLI input
+    args = ['volume', 'set', name]
+    for option in sorted(options):
+        pair = [option, option_text(options[option])]
+        if len(args) > 3 and len(' '.join(args + pair)) > BATCH_LINE_MAX:
+            run_gluster_queued(args)
+            args = ['volume', 'set', name]
+        args.extend(pair)
+    run_gluster_queued(args)
 
 
 def add_bricks(name, new_bricks, stripe, replica, force):
@@ -366,12 +1046,394 @@ def do_rebalance(name):
     run_gluster(['volume', 'rebalance', name, 'start'])
 
 
+def parse_rebalance_counters(elem):
+    counters = {'files_moved': int(elem.findtext('files') or 0),
+                'bytes_moved': int(elem.findtext('size') or 0),
+                'files_scanned': int(elem.findtext('lookups') or 0),
+                'failures': int(elem.findtext('failures') or 0),
+                'skipped': int(elem.findtext('skipped') or 0),
+                'status': (elem.findtext('statusStr') or '').lower(),
+                'runtime': float(elem.findtext('runtime') or 0)}
+    if elem.findtext('time_left') is not None:
+        counters['time_left'] = int(elem.findtext('time_left') or 0)
+    return counters
+
+
+def get_rebalance_status(name):
+    out = run_gluster(['volume', 'rebalance', name, 'status', '--xml'])
+    status = {'nodes': {}}
+    for elem in iter_xml(out, 'volRebalance'):
+        for node in elem.iterfind('node'):
+            status['nodes'][node.findtext('nodeName')] = parse_rebalance_counters(node)
+        if elem.find('aggregate') is not None:
+            status.update(parse_rebalance_counters(elem.find('aggregate')))
+    return status
+
+
+def count_used_inodes(name):
+    """Inodes in use on the bricks of a volume, divided by its replica count.
+
+    Approximates the number of files a rebalance has to look up.
+    """
+    out = run_gluster_nofail(['volume', 'status', name, 'detail', '--xml'])
+    if not out:
+        return None
+    used = 0
+    for elem in iter_xml(out, 'node'):
+        if elem.findtext('inodesTotal') is not None:
+            used += int(elem.findtext('inodesTotal')) - int(elem.findtext('inodesFree') or 0)
+    volume = get_volumes(name).get(name, {})
+    copies = max(volume.get('replica_count') or 1, 1)
+    return used // copies or None
+
+
+def wait_for_rebalance(name, timeout):
+    """Poll the rebalance of a volume until it is done or timeout expires.
+
+    The poll interval adapts to the estimated time left, between 2 and 30
+    seconds.  Returns the aggregate and per-node counters with the transfer
+    rates of the whole run and of the last interval, and the estimated time
+    left.
+    """
+    global module
+    start = time.time()
+    deadline = start + timeout
+    total_files = count_used_inodes(name)
+    previous = None
+    interval = 2
+    while True:
+        now = time.time()
+        status = get_rebalance_status(name)
+        runtime = status.get('runtime') or (now - start)
+        status['files_per_sec'] = round(status.get('files_scanned', 0) / runtime, 2) if runtime else 0
+        status['mib_per_sec'] = round(status.get('bytes_moved', 0) / 1048576.0 / runtime, 2) if runtime else 0
+        for node in status['nodes'].values():
+            node['files_per_sec'] = round(node['files_scanned'] / node['runtime'], 2) if node['runtime'] else 0
+            node['mib_per_sec'] = round(node['bytes_moved'] / 1048576.0 / node['runtime'], 2) if node['runtime'] else 0
+        if previous is not None and now > previous[0]:
+            elapsed = now - previous[0]
+            status['current_files_per_sec'] = round(
+                (status.get('files_scanned', 0) - previous[1].get('files_scanned', 0)) / elapsed, 2)
+            status['current_mib_per_sec'] = round(
+                (status.get('bytes_moved', 0) - previous[1].get('bytes_moved', 0)) / 1048576.0 / elapsed, 2)
+        times_left = [node['time_left'] for node in status['nodes'].values() if 'time_left' in node]
+        if times_left:
+            status['eta_seconds'] = max(times_left)
+        elif total_files and status['files_per_sec']:
+            status['eta_seconds'] = int(max(total_files - status.get('files_scanned', 0), 0) /
+                                        status['files_per_sec'])
+        status['elapsed'] = round(now - start, 1)
+
+        state = status.get('status')
+        if state == 'completed':
+            return status
+        if state in ('failed', 'stopped'):
+            module.fail_json(msg='rebalance of volume %s %s' % (name, state), rebalance=status)
+        if now >= deadline:
+            module.fail_json(msg='timed out waiting for the rebalance of volume %s' % name,
+                             rebalance=status)
+        previous = (now, status)
+        if status.get('eta_seconds'):
+            interval = clamp(status['eta_seconds'] // 10, 2, 30)
+        else:
+            interval = min(interval * 2, 30)
+        time.sleep(min(interval, max(deadline - now, 0)))
+
+
 def enable_quota(name):
     run_gluster(['volume', 'quota', name, 'enable'])
 
 
 def set_quota(name, directory, value):
-    run_gluster(['volume', 'quota', name, 'limit-usage', directory, value])
+    run_gluster_queued(['volume', 'quota', name, 'limit-usage', directory, value])
+
+
+def parse_profile(out):
+    """Per-brick FOP counters of `gluster volume profile <name> info --xml`.
+
+    The interval stats are used where present, as printed by `info
+    incremental`, the cumulative stats otherwise.  Returns the duration, the
+    bytes read and written and, for every FOP that was called, the calls and
+    the min/avg/max latency in microseconds, keyed by brick.  Raises
+    ValueError when the output reports an error.
+    """
+    root = ET.fromstring(out)
+    if root.findtext('opRet', '0') != '0':
+        raise ValueError(root.findtext('opErrstr') or 'profile info failed')
+    bricks = {}
+    for brick in root.iter('brick'):
+        stats = brick.find('intervalStats')
+        if stats is None:
+            stats = brick.find('cumulativeStats')
+        if stats is None or not brick.findtext('brickName'):
+            continue
+        fops = {}
+        for fop in stats.iterfind('fopStats/fop'):
+            calls = int(fop.findtext('hits') or 0)
+            if calls:
+                fops[fop.findtext('name')] = {'calls': calls,
+                                              'min_us': float(fop.findtext('minLatency') or 0),
+                                              'avg_us': float(fop.findtext('avgLatency') or 0),
+                                              'max_us': float(fop.findtext('maxLatency') or 0)}
+        bricks[brick.findtext('brickName')] = {'duration': int(stats.findtext('duration') or 0),
+                                               'read_bytes': int(stats.findtext('totalRead') or 0),
+                                               'write_bytes': int(stats.findtext('totalWrite') or 0),
+                                               'fops': fops}
+    return bricks
+
+
+def merge_profile(samples):
+    """Sum successive incremental profile samples into one per brick."""
+    merged = {}
+    for sample in samples:
+        for name, stats in sample.items():
+            brick = merged.setdefault(name, {'duration': 0, 'read_bytes': 0,
+                                             'write_bytes': 0, 'fops': {}})
+            for key in ('duration', 'read_bytes', 'write_bytes'):
+                brick[key] += stats[key]
+            for op, fop in stats['fops'].items():
+                total = brick['fops'].get(op)
+                if total is None:
+                    brick['fops'][op] = dict(fop)
+                    continue
+                calls = total['calls'] + fop['calls']
+                total['avg_us'] = (total['avg_us'] * total['calls'] +
+                                   fop['avg_us'] * fop['calls']) / calls
+                total['min_us'] = min(total['min_us'], fop['min_us'])
+                total['max_us'] = max(total['max_us'], fop['max_us'])
+                total['calls'] = calls
+    return merged
+
+
+def rank_profile(bricks, top):
+    """The hottest bricks and FOPs of a volume, by the time spent in FOPs.
+
+    Adds the total calls and FOP time to every brick, and the share of the
+    brick FOP time to every FOP.  The FOPs are ranked over all the bricks.
+    """
+    fops = {}
+    for name, brick in bricks.items():
+        brick['calls'] = sum(fop['calls'] for fop in brick['fops'].values())
+        brick['latency_us'] = sum(fop['calls'] * fop['avg_us'] for fop in brick['fops'].values())
+        brick['calls_per_sec'] = round(brick['calls'] / brick['duration'], 2) if brick['duration'] else None
+        for op, fop in brick['fops'].items():
+            spent = fop['calls'] * fop['avg_us']
+            fop['latency_percent'] = round(spent * 100 / brick['latency_us'], 2) if brick['latency_us'] else 0
+            fop['avg_us'] = round(fop['avg_us'], 2)
+            total = fops.setdefault(op, {'fop': op, 'calls': 0, 'latency_us': 0.0, 'max_us': 0.0})
+            total['calls'] += fop['calls']
+            total['latency_us'] += spent
+            total['max_us'] = max(total['max_us'], fop['max_us'])
+        brick['latency_us'] = round(brick['latency_us'], 2)
+    for fop in fops.values():
+        fop['avg_us'] = round(fop['latency_us'] / fop['calls'], 2)
+        fop['latency_us'] = round(fop['latency_us'], 2)
+    hot_bricks = sorted(bricks, key=lambda name: (bricks[name]['latency_us'], bricks[name]['calls']),
+                        reverse=True)[:top]
+    hot_fops = sorted(fops.values(), key=lambda fop: (fop['latency_us'], fop['calls']),
+                      reverse=True)[:top]
+    return ([{'brick': name, 'calls': bricks[name]['calls'], 'latency_us': bricks[name]['latency_us'],
+              'calls_per_sec': bricks[name]['calls_per_sec']} for name in hot_bricks], hot_fops)
+
+
+def get_profile_info(name):
+    global module
+    out = run_gluster(['volume', 'profile', name, 'info', 'incremental', '--xml'])
+    try:
+        return parse_profile(out)
+    except (ET.ParseError, ValueError) as e:
+        module.fail_json(msg='unable to parse the profile info of volume %s: %s' % (name, to_native(e)))
+
+
+def profile_volumes(snapshot, names, window, interval, top):
+    """Profile the FOPs of volumes for window seconds.
+
+    Profiling is started on the volumes that do not have it on already, and
+    stopped again on those once the window is over, also when sampling fails.
+    The interval counters are sampled every interval seconds and summed; the
+    calls and average latency of every sample are kept as a timeline.
+    """
+    global module
+    volumes = snapshot.volumes
+    for name in names:
+        if name not in volumes:
+            module.fail_json(msg='volume not found %s' % name)
+        if volumes[name]['status'].lower() != 'started':
+            module.fail_json(msg='volume %s is not started' % name)
+    started = [name for name in names
+               if not (option_value(volumes[name]['options'].get('diagnostics.latency-measurement')) == 'on' and
+                       option_value(volumes[name]['options'].get('diagnostics.count-fop-hits')) == 'on')]
+    samples = dict((name, []) for name in names)
+    timelines = dict((name, []) for name in names)
+    try:
+        for name in started:
+            run_gluster(['volume', 'profile', name, 'start'])
+        # Reset the interval counters, the first sample then covers the
+        # first interval only
+        for name in names:
+            get_profile_info(name)
+        start = time.time()
+        deadline = start + window
+        while True:
+            time.sleep(max(min(interval, deadline - time.time()), 0))
+            for name in names:
+                sample = get_profile_info(name)
+                samples[name].append(sample)
+                calls = sum(fop['calls'] for brick in sample.values() for fop in brick['fops'].values())
+                spent = sum(fop['calls'] * fop['avg_us'] for brick in sample.values()
+                            for fop in brick['fops'].values())
+                duration = max([brick['duration'] for brick in sample.values()] or [0])
+                timelines[name].append({'elapsed': round(time.time() - start, 1),
+                                        'calls_per_sec': round(calls / duration, 2) if duration else None,
+                                        'avg_latency_us': round(spent / calls, 2) if calls else None})
+            if time.time() >= deadline:
+                break
+    finally:
+        for name in started:
+            run_gluster_nofail(['--mode=script', 'volume', 'profile', name, 'stop'])
+
+    profile = {}
+    for name in names:
+        bricks = merge_profile(samples[name])
+        hot_bricks, hot_fops = rank_profile(bricks, top)
+        profile[name] = {'window': window, 'samples': len(samples[name]), 'bricks': bricks,
+                         'hot_bricks': hot_bricks, 'hot_fops': hot_fops,
+                         'timeline': timelines[name], 'stopped': name in started}
+    return profile
+
+
+def parse_top(out):
+    """Per-brick results of `gluster volume top <name> <metric> --xml`.
+
+    Returns a list of bricks with their (path, count) entries, the open fd
+    counters for open and the measured throughput in MB/s and seconds taken
+    for read-perf and write-perf with a block size and count.
+    For the perf metrics the count of a file is its throughput.  Raises
+    ValueError when the output reports an error.
+    """
+    root = ET.fromstring(out)
+    if root.findtext('opRet', '0') != '0':
+        raise ValueError(root.findtext('opErrstr') or 'volume top failed')
+    bricks = []
+    for elem in root.iter('brick'):
+        brick = {'name': elem.findtext('name'), 'files': []}
+        for key, tag in (('current_open', 'currentOpen'), ('max_open', 'maxOpen'),
+                         ('max_open_time', 'maxOpenTime'), ('throughput', 'throughput'),
+                         ('time', 'timeTaken')):
+            if elem.findtext(tag) is not None:
+                brick[key] = elem.findtext(tag)
+        for key in ('current_open', 'max_open'):
+            if key in brick:
+                brick[key] = int(brick[key])
+        for key in ('throughput', 'time'):
+            if key in brick:
+                brick[key] = float(brick[key])
+        for entry in elem.iterfind('file'):
+            brick['files'].append((entry.findtext('filename'), float(entry.findtext('count') or 0)))
+        bricks.append(brick)
+    return bricks
+
+
+def brick_sets(volume):
+    """Map every brick of a volume to the index of its replica or disperse
+    set, the bricks of a set being listed one after the other."""
+    size = volume.get('disperse_count') or volume.get('replica_count') or 1
+    return dict((brick, index // size) for index, brick in enumerate(volume['bricks']))
+
+
+def merge_top(bricks, metric, top, sets=None):
+    """The cluster-wide top paths of a metric from the per-brick results.
+
+    Every brick of a replica or disperse set sees the operations on the
+    files of the set, so the count of a path is the highest of its set and
+    the counts of the sets are summed.  sets maps a brick to its set, a
+    brick that is not in it is a set of its own.  Throughputs are not
+    summed, the best brick is kept.
+    """
+    perf = metric.endswith('-perf')
+    sets = sets or {}
+    paths = {}
+    for brick in bricks:
+        subvolume = sets.get(brick['name'], brick['name'])
+        for path, count in brick['files']:
+            entry = paths.setdefault(path, {'path': path, 'sets': {}, 'bricks': []})
+            entry['sets'][subvolume] = max(entry['sets'].get(subvolume, 0), count)
+            entry['bricks'].append(brick['name'])
+    for entry in paths.values():
+        counts = entry.pop('sets').values()
+        entry['count'] = max(counts) if perf else int(sum(counts))
+    return sorted(paths.values(), key=lambda entry: (-entry['count'], entry['path']))[:top]
+
+
+def get_top(name, metric, top, block_size=None, block_count=None):
+    """Run one `volume top` on a volume, which answers for all its bricks,
+    returning (bricks, error)."""
+    global glusterbin
+    args = [glusterbin, '--mode=script', 'volume', 'top', name, metric]
+    if metric.endswith('-perf') and block_size and block_count:
+        args.extend(['bs', str(block_size), 'count', str(block_count)])
+    args.extend(['list-cnt', str(top), '--xml'])
+    rc, out, err = run_with_retry(module, args, lock_timeout, lock_retries)
+    if rc != 0:
+        return None, (err or out or 'rc=%d' % rc).strip()
+    try:
+        return parse_top(out), None
+    except (ET.ParseError, ValueError) as e:
+        return None, to_native(e)
+
+
+def top_volumes(snapshot, names, metrics, top, block_size=None, block_count=None):
+    """Collect `gluster volume top` of the volumes in parallel.
+
+    The metrics of a volume are queried one after the other, each query
+    returning every brick, and the results are merged into the top paths of
+    the volume.  The open fd counters and the throughput measured by the
+    perf metrics are returned per brick, with the errors of the metrics
+    that failed.
+    """
+    global module
+    volumes = snapshot.volumes
+    for name in names:
+        if name not in volumes:
+            module.fail_json(msg='volume not found %s' % name)
+        if volumes[name]['status'].lower() != 'started':
+            module.fail_json(msg='volume %s is not started' % name)
+
+    def collect(name):
+        return [get_top(name, metric, top, block_size, block_count) for metric in metrics]
+
+    pool = ThreadPool(max(min(TOP_WORKERS, len(names)), 1))
+    try:
+        outcomes = pool.map(collect, names)
+    finally:
+        pool.close()
+        pool.join()
+    errors = [error for results in outcomes for bricks, error in results if bricks is None]
+    if errors and len(errors) == len(names) * len(metrics):
+        module.fail_json(msg='volume top failed on every volume: %s' % errors[0])
+
+    report = {}
+    for name, results in zip(names, outcomes):
+        volume = volumes[name]
+        report[name] = {'metrics': dict((metric, []) for metric in metrics),
+                        'bricks': dict((brick, {}) for brick in volume['bricks'])}
+        sets = brick_sets(volume)
+        for metric, (bricks, error) in zip(metrics, results):
+            if bricks is None:
+                report[name].setdefault('errors', {})[metric] = error
+                continue
+            report[name]['metrics'][metric] = merge_top(bricks, metric, top, sets)
+            for result in bricks:
+                figures = report[name]['bricks'].setdefault(result['name'], {})
+                if 'current_open' in result:
+                    figures['open'] = {'current': result['current_open'],
+                                       'max': result.get('max_open'),
+                                       'max_time': result.get('max_open_time')}
+                if 'throughput' in result:
+                    kind = metric.split('-')[0]
+                    figures['%s_mbps' % kind] = result['throughput']
+                    figures['%s_seconds' % kind] = result.get('time')
+    return report
 
 
 def check_gluster_version(module):
@@ -386,12 +1448,98 @@ def check_gluster_version(module):
     return version
 
 
+class GD2Error(Exception):
+    def __init__(self, status, reason):
+        super(GD2Error, self).__init__('%s %s' % (status, reason))
+        self.status = status
+        self.reason = reason
+
+
+class GD2Client(object):
+    """GlusterD2 REST client sending every request over one keep-alive connection.
+
+    Requests are authenticated with a short-lived HS256 token when a user
+    and secret are given, the way glusterd2 expects them.  Only requests
+    that do not change anything are resent after a connection error, a
+    create or delete may have been applied before the connection broke.
+    """
+
+    IDEMPOTENT = ('GET', 'HEAD')
+
+    def __init__(self, host, port, user=None, secret=None, timeout=60, verify=False):
+        self.user = user
+        self.secret = secret
+        self.calls = 0
+        context = self.ssl_context(verify)
+        if context is None:
+            self.conn = http_client.HTTPConnection(host, int(port), timeout=timeout)
+        else:
+            self.conn = http_client.HTTPSConnection(host, int(port), timeout=timeout,
+                                                    context=context)
+
+    @staticmethod
+    def ssl_context(verify):
+        """The SSL context checking the glusterd2 certificate, None for plain HTTP.
+
+        verify is a boolean, to check against the system CA bundle, or the
+        path of a CA bundle.
+        """
+        if not verify or str(verify).lower() in FALSE_VALUES:
+            return None
+        if str(verify).lower() in TRUE_VALUES:
+            return ssl.create_default_context()
+        return ssl.create_default_context(cafile=verify)
+
+    def _token(self, method, path):
+        def encode(data):
+            return base64.urlsafe_b64encode(data).rstrip(b'=')
+        now = int(time.time())
+        claims = {'iss': self.user, 'iat': now, 'exp': now + 120,
+                  'qsh': hashlib.sha256(to_bytes('%s&%s' % (method, path))).hexdigest()}
+        signing = b'.'.join([encode(to_bytes(json.dumps({'alg': 'HS256', 'typ': 'JWT'}))),
+                             encode(to_bytes(json.dumps(claims)))])
+        signature = hmac.new(to_bytes(self.secret), signing, hashlib.sha256).digest()
+        return to_native(signing + b'.' + encode(signature))
+
+    def request(self, method, path, body=None):
+        headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+        if self.user and self.secret:
+            headers['Authorization'] = 'bearer ' + self._token(method, path)
+        payload = json.dumps(body) if body is not None else None
+        attempts = 2 if method in self.IDEMPOTENT else 1
+        for attempt in range(attempts):
+            try:
+                self.conn.request(method, path, payload, headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                break
+            except (http_client.HTTPException, socket.error):
+                # glusterd2 closed the idle connection, reconnect once
+                self.conn.close()
+                if attempt == attempts - 1:
+                    raise
+        self.calls += 1
+        try:
+            result = json.loads(to_native(data)) if data else None
+        except ValueError:
+            result = None
+        if response.status >= 400:
+            reason = response.reason
+            if isinstance(result, dict) and result.get('errors'):
+                reason = result['errors'][0].get('message', reason)
+            raise GD2Error(response.status, reason)
+        return response.status, result
+
+    def close(self):
+        self.conn.close()
+
+
 class GlusterVolume(object):
     def __init__(self, module):
         # Init the parameters
         self.state = module.params['state']
         self.volume_name = module.params['name']
-        self.cluster = module.params['cluster']
+        self.cluster = module.params['cluster'] or []
         self.brick_paths = module.params['bricks']
         self.stripes = module.params['stripes']
         self.replicas = module.params['replicas']
@@ -403,6 +1551,7 @@ class GlusterVolume(object):
         self.start_on_create = module.boolean(module.params['start_on_create'])
         self.rebalance = module.boolean(module.params['rebalance'])
         self.force = module.boolean(module.params['force'])
+        self.options = module.params['options'] or {}
         self.module = module
         # GlusterD2.0 specific options
         self.user = self.module.params['user']
@@ -410,151 +1559,368 @@ class GlusterVolume(object):
         self.verify = self.module.params['verify']
         self.port = self.module.params['port']
         self.master = self.module.params['master']
+        self.actions = []
+
+    def _call(self, method, path, body=None, msg=None):
+        try:
+            return self.client.request(method, path, body)
+        except GD2Error as e:
+            self.module.fail_json(msg="%s: %s" % (msg or "GlusterD2 request failed", e.reason),
+                                  status=e.status, actions=self.actions)
+        except (http_client.HTTPException, socket.error) as e:
+            self.module.fail_json(msg="Unable to reach GlusterD2 on %s: %s" %
+                                  (self.master, to_native(e)), actions=self.actions)
 
     def _get_peers(self):
         peer_info = dict()
-
-        try:
-            status, peer_list = self.client.peer_status()
-        except GlusterApiError as e:
-            self.module.fail_json(msg="Unable to get peer list: %s" %
-                                  e.message.reason)
-        if status == 200:       # Success
-            for peer in peer_list:
-                hostname = peer['name']
-                peer_ipaddr = peer['peer-addresses'][0].split(':')[0]
-                peer_id = peer['id']
-                peer_info[hostname] = peer_id
-                peer_info[peer_ipaddr] = peer_id
-        else:
-            self.module.fail_json(msg="Failed to get peers")
+        status, peer_list = self._call('GET', '/v1/peers', msg="Unable to get peer list")
+        for peer in peer_list or []:
+            peer_info[peer['name']] = peer['id']
+            for address in peer.get('peer-addresses') or []:
+                peer_info[address.split(':')[0]] = peer['id']
         return peer_info
 
     def _get_volinfo(self):
-        vol_info = dict()
-
-        try:
-            pass
-        except GlusterApiError as e:
-            pass
-        return vol_info
+        # All the volumes, with their state and options, in one request
+        status, volumes = self._call('GET', '/v1/volumes', msg="Unable to get volume list")
+        return dict((volume['name'], volume) for volume in volumes or [])
 
     def _add_peers(self, peers, peer_info):
         for peer in peers:
-            try:
-                ret, result = self.client.peer_add(peer)
-                if result:
-                    peer_info[peer] = result['id']
-                    peer_info[result['name']] = result['id']
-            except GlusterApiError as e:
-                reason = e.message.reason
-                if reason.lower() == "internal server error":
-                    self.module.fail_json(msg="Failed: %s" % reason)
+            status, result = self._call('POST', '/v1/peers', {'addresses': [peer]},
+                                        msg="Unable to add peer %s" % peer)
+            if result:
+                peer_info[peer] = result['id']
+                peer_info[result['name']] = result['id']
+            self.actions.append('probe %s' % peer)
         return peer_info
 
-    def create_volume(self):
-        changed = False
-        # Create a GlusterD2 volume
-        brickinfo = list()
-        bricks = self.brick_paths.split(",")
-        # Check if peers are probed, else probe and create volume
-        peer_info = self._get_peers()
-        peers_to_probe = [peer for peer in self.cluster if
-                          peer not in peer_info.keys()]
-        if peers_to_probe:
-            peer_info = self._add_peers(peers_to_probe, peer_info)
-        # Create brick path for volume creation. GlusterD2 needs volume-id for
-        # brick creation
-        for node in self.cluster:
-            uuid = peer_info[node]
-            for brick in bricks:
-                brickinfo.append("%s:%s" % (uuid, brick))
-
-        # Do not create a volume if it is already present, when the support in
-        # python API is available get the list of volumes and compare
-        try:
-            code, out = self.client.volume_create(self.volume_name,
-                                                  bricks=brickinfo,
-                                                  replica=self.replicas,
-                                                  disperse=self.disperses,
-                                                  arbiter=self.arbiters,
-                                                  disperse_redundancy=self.redundancies,
-                                                  force=self.force)
-            if code == 201:
-                changed = True
-        except GlusterApiError as e:
-            reason = e.message.reason
-            # Once the error codes are refined, fail only on fatal errors
-            # For now, we ignore the errors
+    def _subvols(self, peer_info):
+        # Bricks are listed path by path across the nodes, so that each
+        # replica or disperse set spans distinct nodes
+        bricks = [{'peerid': peer_info[node], 'path': path}
+                  for path in self.brick_paths.split(",") for node in self.cluster]
+        size = self.replicas or self.disperses or 1
+        subvols = []
+        for index in range(0, len(bricks), size):
+            subvol = {'bricks': bricks[index:index + size]}
+            if self.replicas:
+                subvol.update({'type': 'replicate', 'replica': self.replicas})
+                if self.arbiters:
+                    subvol['arbiter'] = self.arbiters
+            elif self.disperses:
+                subvol.update({'type': 'disperse', 'disperse-count': self.disperses,
+                               'disperse-redundancy': self.redundancies})
+            else:
+                subvol['type'] = 'distribute'
+            subvols.append(subvol)
+        return subvols
+
+    def _state(self, volume):
+        return (volume.get('state') or '').lower()
+
+    def create_volume(self, volumes):
+        if self.volume_name not in volumes:
+            # Check if peers are probed, else probe and create volume
+            peer_info = self._get_peers()
+            peers_to_probe = [peer for peer in self.cluster if
+                              peer not in peer_info.keys()]
+            if peers_to_probe:
+                peer_info = self._add_peers(peers_to_probe, peer_info)
+            status, volume = self._call('POST', '/v1/volumes',
+                                        {'name': self.volume_name,
+                                         'transport': self.transport,
+                                         'subvols': self._subvols(peer_info),
+                                         'force': self.force},
+                                        msg="Unable to create the volume")
+            volumes[self.volume_name] = volume or {'name': self.volume_name, 'state': 'Created'}
+            self.actions.append('create')
+        volume = volumes[self.volume_name]
 
         # Start the volume if start_on_create is set
-        if self.start_on_create:
-            try:
-                code, out = self.client.volume_start(self.volume_name,
-                                                     self.force)
-                if out['state'].lower() != "started":
-                    self.module.fail_json(msg="Unable to start the volume")
-            except GlusterApiError as e:
-                pass
-        return changed
-
-    def stop_volume(self):
-        changed = False
-        # TODO: get the volume info and check the state
-        try:
-            retcode, out = self.client.volume_stop(self.volume_name)
-            if out['state'].lower() == "stopped":
-                changed = True
-            else:
-                # Fixme: Give a proper error code
-                self.module.fail_json("Unable to stop the volume")
-        except GlusterApiError as e:
-            # When the error codes are implemented, print proper message
-            pass        # Fix API! Do not raise an exception if unable to stop
-            # self.module.fail_json(msg="Unable to stop the volume")
-        return changed
-
-    def delete_volume(self):
-        changed = False
-        # Try to stop the volume if it is already started
-        changed = self.stop_volume()
-
-        # Delete the volume
-        try:
-            retcode, out = self.client.volume_delete(self.volume_name)
-            if retcode == 204:         # volume deleted successfully
-                changed = True
-        except GlusterApiError as e:
-            self.module.fail_json(msg="Unable to delete the volume")
-        return changed
-
-    def start_volume(self):
-        # TODO: Handle cases when state=changed and other variables are set.
-        try:
-            code, out = self.client.volume_start(self.volume_name,
-                                                 self.force)
-            if out['state'].lower() != "started":
-                self.module.fail_json(msg="Unable to start the volume")
-                changed = True
-        except GlusterApiError as e:
-            self.module.fail_json(msg="Unable to start the volume")
+        if self.start_on_create and self._state(volume) != "started":
+            self.start_volume(volumes)
+
+        # Set only the options that differ
+        current = volume.get('options') or {}
+        changes = option_changes(self.options, current)
+        if changes:
+            self._call('POST', '/v1/volumes/%s/options' % self.volume_name,
+                       {'options': dict((key, option_text(value)) for key, value in changes.items())},
+                       msg="Unable to set the volume options")
+            self.actions.append('set %s' % ','.join(sorted(changes)))
+
+    def stop_volume(self, volumes):
+        if self._state(volumes[self.volume_name]) != "started":
+            return
+        self._call('POST', '/v1/volumes/%s/stop' % self.volume_name,
+                   msg="Unable to stop the volume")
+        volumes[self.volume_name]['state'] = 'Stopped'
+        self.actions.append('stop')
+
+    def delete_volume(self, volumes):
+        # Stop the volume if it is started, then delete it
+        self.stop_volume(volumes)
+        self._call('DELETE', '/v1/volumes/%s' % self.volume_name,
+                   msg="Unable to delete the volume")
+        del volumes[self.volume_name]
+        self.actions.append('delete')
+
+    def start_volume(self, volumes):
+        if self._state(volumes[self.volume_name]) == "started":
+            return
+        self._call('POST', '/v1/volumes/%s/start' % self.volume_name,
+                   {'force-start-bricks': self.force},
+                   msg="Unable to start the volume")
+        volumes[self.volume_name]['state'] = 'Started'
+        self.actions.append('start')
 
     def manage_vol(self):
-        changed = False
         if self.master is None:
             self.module.fail_json(msg="master variable has to be set to use" +
                                   "gluster_volume with GlusterFS-4.0 or above")
-        master = "http://" + self.master + ":%s" % self.port
-        self.client = Client(master, self.user, self.passwd, self.verify)
-        if self.state == "present":
-            changed = self.create_volume()
-        elif self.state == "absent":
-            changed = self.delete_volume()
-        elif self.state == "started":
-            changed = self.start_volume()
-        elif self.state == "stopped":
-            changed = self.stop_volume()
-        self.module.exit_json(changed=changed)
+        try:
+            self.client = GD2Client(self.master, self.port, self.user, self.passwd,
+                                    verify=self.verify)
+        except (IOError, OSError, ssl.SSLError) as e:
+            self.module.fail_json(msg="Unable to load the CA bundle %s: %s" %
+                                  (self.verify, to_native(e)))
+        try:
+            volumes = self._get_volinfo()
+            if self.state == "present":
+                self.create_volume(volumes)
+            elif self.volume_name not in volumes:
+                if self.state != "absent":
+                    self.module.fail_json(msg="volume not found %s" % self.volume_name)
+            elif self.state == "absent":
+                self.delete_volume(volumes)
+            elif self.state == "started":
+                self.start_volume(volumes)
+            elif self.state == "stopped":
+                self.stop_volume(volumes)
+        finally:
+            self.client.close()
+        self.module.exit_json(changed=bool(self.actions), actions=self.actions,
+                              api_calls=self.client.calls)
+
+
+# Keys of a volume spec, and the alternative names accepted for them in
+# `volumes` entries (the latter match the gluster_features_hci_volumes items)
+VOLUME_SPEC_KEYS = ('state', 'cluster', 'bricks', 'stripes', 'replicas', 'arbiters',
+                    'disperses', 'redundancies', 'transport', 'start_on_create',
+                    'rebalance', 'options', 'quota', 'directory', 'quotas', 'force')
+VOLUME_SPEC_ALIASES = {'volname': 'name', 'volume': 'name', 'brick': 'bricks',
+                       'arbiter': 'arbiters', 'servers': 'cluster'}
+
+
+def volume_spec(params, defaults):
+    """Normalise one volume spec; unset keys fall back to the module parameters."""
+    global module
+    shared = params is defaults
+    if not shared:
+        params = dict((VOLUME_SPEC_ALIASES.get(key, key), value) for key, value in params.items())
+        # A misspelt key, e.g. replica, would otherwise silently fall back to
+        # the module option
+        unknown = sorted(key for key in params if key != 'name' and key not in VOLUME_SPEC_KEYS)
+        if unknown:
+            module.fail_json(msg='unsupported keys %s in the volumes entry %s, supported keys are '
+                                 'name, %s and the aliases %s' %
+                                 (', '.join(unknown), params.get('name'),
+                                  ', '.join(VOLUME_SPEC_KEYS), ', '.join(sorted(VOLUME_SPEC_ALIASES))))
+    spec = dict((key, params[key] if params.get(key) is not None else defaults.get(key))
+                for key in VOLUME_SPEC_KEYS)
+    spec['name'] = params.get('name')
+    if not spec['name']:
+        module.fail_json(msg='every entry in volumes needs a name')
+    if spec['state'] is None:
+        spec['state'] = 'present'
+    if spec['state'] not in ('absent', 'present', 'started', 'stopped'):
+        module.fail_json(msg='invalid state %s for volume %s' % (spec['state'], spec['name']))
+
+    # Options given for a volume are applied on top of the shared ones
+    options = dict(defaults.get('options') or {})
+    if not shared:
+        options.update(params.get('options') or {})
+    spec['options'] = options
+
+    # Clean up if last element is empty. Consider that yml can look like this:
+    #   cluster="{% for host in groups['glusterfs'] %}{{ hostvars[host]['private_ip'] }},{% endfor %}"
+    cluster = spec['cluster']
+    if isinstance(cluster, str):
+        cluster = cluster.split(',')
+    if cluster is not None and len(cluster) > 1 and cluster[-1] == '':
+        cluster = cluster[0:-1]
+    spec['cluster'] = cluster or []
+
+    brick_paths = spec['bricks']
+    if brick_paths is not None and "," in brick_paths:
+        brick_paths = brick_paths.split(",")
+    else:
+        brick_paths = [brick_paths]
+    spec['bricks'] = brick_paths
+
+    for key in ('start_on_create', 'rebalance', 'force'):
+        spec[key] = module.boolean(spec[key])
+    return spec
+
+
+def reconcile_volumes(snapshot, specs, myhostname):
+    """Bring every volume spec to its desired state.
+
+    All specs are planned against one snapshot and applied phase by phase:
+    peer probes, deletes, creates, starts, brick additions, quotas and
+    options, then stops.  Operations of one kind are issued back to back and
+    one at a time from this node, instead of interleaving long-running
+    create/start transactions of one volume with option updates of another,
+    which keeps the time spent waiting for the cluster lock low.
+
+    Returns the per-volume results, the quotas read per volume and the join
+    latency of newly probed peers.
+    """
+    global module
+    volumes = snapshot.volumes
+    results = dict((spec['name'], {'changed': False, 'actions': []}) for spec in specs)
+    quotas = {}
+
+    def record(name, action):
+        results[name]['changed'] = True
+        results[name]['actions'].append(action)
+
+    def status(name):
+        return volumes[name]['status'].lower()
+
+    for spec in specs:
+        name = spec['name']
+        if spec['state'] in ('started', 'stopped') and name not in volumes:
+            module.fail_json(msg='volume not found %s' % name)
+        if name in volumes and volumes[name]['quota'] and status(name) == 'started':
+            quotas[name] = snapshot.quotas(name, True)
+
+    present = [spec for spec in specs if spec['state'] == 'present']
+
+    hosts = []
+    for spec in present:
+        hosts.extend(host for host in spec['cluster'] if host not in hosts)
+    peer_latency = probe_all_peers(hosts, snapshot.peers, myhostname,
+                                   module.params['probe_workers'],
+                                   module.params['peer_timeout'])
+    if peer_latency:
+        snapshot.refresh_peers()
+
+    for spec in specs:
+        name = spec['name']
+        if spec['state'] == 'absent' and name in volumes:
+            if status(name) != 'stopped':
+                stop_volume(name)
+            run_gluster(['volume', 'delete', name])
+            record(name, 'delete')
+
+    # create if it doesn't exist
+    for spec in present:
+        name = spec['name']
+        if name not in volumes:
+            create_volume(name, spec['stripes'], spec['replicas'], spec['arbiters'],
+                          spec['disperses'], spec['redundancies'], spec['transport'],
+                          brick_layout(spec), spec['force'])
+            if snapshot.refresh_volume(name) is None:
+                module.fail_json(msg='failed to create volume %s' % name)
+            record(name, 'create')
+
+    for spec in specs:
+        name = spec['name']
+        if ((spec['state'] == 'present' and spec['start_on_create']) or
+                spec['state'] == 'started') and status(name) != 'started':
+            start_volume(name)
+            record(name, 'start')
+
+    # the brick and quota steps below run right away and need the volumes
+    # started, so the queued starts are run first
+    flush_gluster()
+
+    # switch bricks, this module does not yet remove bricks
+    for spec in present:
+        name = spec['name']
+        new_bricks = brick_layout(spec, volumes[name])
+        if new_bricks:
+            add_bricks(name, new_bricks, spec['stripes'], spec['replicas'], spec['force'])
+            record(name, 'add-brick')
+
+    # handle quotas, the limits of all the directories are read in one list
+    quota_volumes = []
+    for spec in present:
+        name = spec['name']
+        desired = dict((directory, quota_limit(value))
+                       for directory, value in (spec['quotas'] or {}).items())
+        if spec['quota']:
+            desired[spec['directory']] = quota_limit(spec['quota'])
+        if not desired:
+            continue
+        if not volumes[name]['quota']:
+            if all(limit is None for limit in desired.values()):
+                continue
+            enable_quota(name)
+            snapshot.refresh_quotas(name)
+        changes = quota_changes(desired, snapshot.quota_usage(name))
+        for change in changes:
+            run_gluster_queued(['volume', 'quota', name] + change)
+        if changes:
+            snapshot.refresh_quotas(name)
+            record(name, 'quota %s' % ','.join(change[1] for change in changes))
+        quota_volumes.append(name)
+
+    # host-aware tuning, explicitly given options win over the recommendation
+    tune = module.params['tune']
+    if tune != 'none':
+        if not module.params['host_profiles']:
+            module.fail_json(msg='host_profiles is required to tune the volumes')
+        recommended = recommend_options(module.params['host_profiles'])
+        for spec in present:
+            name = spec['name']
+            current = snapshot.option_values(name)
+            results[name]['tuning'] = dict((option, {'current': current.get(option),
+                                                     'recommended': value})
+                                           for option, value in recommended.items())
+            if tune == 'apply':
+                options = dict(recommended)
+                options.update(spec['options'])
+                spec['options'] = options
+
+    # set options, comparing against the effective values read in one go
+    for spec in present:
+        name = spec['name']
+        if not spec['options']:
+            continue
+        changes = option_changes(expand_options(spec['options']), snapshot.option_values(name))
+        if changes:
+            set_volume_options(name, changes)
+            record(name, 'set %s' % ','.join(sorted(changes)))
+
+    # the queued quota and option changes need the volumes still started
+    flush_gluster()
+
+    for spec in specs:
+        name = spec['name']
+        if spec['state'] == 'stopped' and status(name) != 'stopped':
+            stop_volume(name)
+            record(name, 'stop')
+
+    for spec in specs:
+        name = spec['name']
+        if not results[name]['changed']:
+            continue
+        if spec['state'] == 'absent':
+            volumes.pop(name, None)
+            continue
+        snapshot.refresh_volume(name)
+        if spec['rebalance']:
+            do_rebalance(name)
+            if module.params['rebalance_wait']:
+                results[name]['rebalance'] = wait_for_rebalance(name, module.params['rebalance_timeout'])
+
+    # the limits after the changes, listed again only where something changed
+    for name in quota_volumes:
+        quotas[name] = snapshot.quotas(name, False)
+    return results, quotas, peer_latency
 
 
 def main():
@@ -563,8 +1929,9 @@ def main():
     global module
     module = AnsibleModule(
         argument_spec=dict(
-            name=dict(type='str', required=True, aliases=['volume']),
-            state=dict(type='str', required=True, choices=['absent', 'started', 'stopped', 'present']),
+            name=dict(type='str', aliases=['volume']),
+            state=dict(type='str', choices=['absent', 'started', 'stopped', 'present']),
+            volumes=dict(type='list'),
             cluster=dict(type='list'),
             host=dict(type='str'),
             stripes=dict(type='int'),
@@ -579,150 +1946,115 @@ def main():
             options=dict(type='dict', default={}),
             quota=dict(type='str'),
             directory=dict(type='str'),
+            quotas=dict(type='dict'),
             force=dict(type='bool', default=False),
             master=dict(type='str', required=False),
             user=dict(type='str', required=False),
             passwd=dict(type='str', required=False, no_log=True),
-            verify=dict(type='str', required=False, default=False),
+            verify=dict(type='str', required=False, default='no'),
             port=dict(type='str', required=False, default='24007'),
+            batch=dict(type='bool', default=False),
+            probe_workers=dict(type='int', default=8),
+            peer_timeout=dict(type='int', default=60),
+            lock_timeout=dict(type='int', default=60),
+            placement=dict(type='str', default='ordered', choices=['ordered', 'spread']),
+            topology=dict(type='dict', default={}),
+            rebalance_wait=dict(type='bool', default=False),
+            rebalance_timeout=dict(type='int', default=3600),
+            tune=dict(type='str', default='none', choices=['none', 'report', 'apply']),
+            host_profiles=dict(type='list'),
+            cache_ttl=dict(type='int', default=30),
+            cache_path=dict(type='path', default='/var/lib/gluster-ansible/facts.json'),
+            facts_scope=dict(type='str', default='all', choices=['all', 'managed']),
+            action=dict(type='str', choices=['profile', 'top']),
+            profile_window=dict(type='int', default=60),
+            profile_interval=dict(type='int', default=10),
+            top_metrics=dict(type='list', default=['open', 'read', 'write', 'opendir', 'readdir'],
+                             choices=['open', 'read', 'write', 'opendir', 'readdir',
+                                      'read-perf', 'write-perf']),
+            top_block_size=dict(type='int'),
+            top_block_count=dict(type='int'),
+            top_n=dict(type='int', default=10),
         ),
+        required_one_of=[['name', 'volumes']],
+        mutually_exclusive=[['name', 'volumes']],
+        required_together=[['top_block_size', 'top_block_count']],
     )
 
-    # If gluster version is greater than 4.0, call gluster API
+    # If gluster version is greater than 4.0 and a GlusterD2 master is given,
+    # call gluster API
     version = check_gluster_version(module)
-    if LooseVersion(version) > LooseVersion("4"):
+    if LooseVersion(version) > LooseVersion("4") and module.params['master']:
+        if module.params['volumes']:
+            module.fail_json(msg='volumes is not supported with GlusterD2')
         gluster_vol = GlusterVolume(module)
         gluster_vol.manage_vol()
 
     global glusterbin
     glusterbin = module.get_bin_path('gluster', True)
 
-    changed = False
-
-    action = module.params['state']
-    volume_name = module.params['name']
-    cluster = module.params['cluster']
-    brick_paths = module.params['bricks']
-    stripes = module.params['stripes']
-    replicas = module.params['replicas']
-    arbiters = module.params['arbiters']
-    disperses = module.params['disperses']
-    redundancies = module.params['redundancies']
-    transport = module.params['transport']
-    myhostname = module.params['host']
-    start_on_create = module.boolean(module.params['start_on_create'])
-    rebalance = module.boolean(module.params['rebalance'])
-    force = module.boolean(module.params['force'])
+    global lock_timeout
+    lock_timeout = module.params['lock_timeout']
+
+    global batch
+    if module.params['batch']:
+        batch = GlusterBatch(module, glusterbin, lock_timeout, lock_retries)
 
+    myhostname = module.params['host']
     if not myhostname:
         myhostname = socket.gethostname()
 
-    # Clean up if last element is empty. Consider that yml can look like this:
-    #   cluster="{% for host in groups['glusterfs'] %}{{ hostvars[host]['private_ip'] }},{% endfor %}"
-    if cluster is not None and len(cluster) > 1 and cluster[-1] == '':
-        cluster = cluster[0:-1]
-
-    if cluster is None:
-        cluster = []
-
-    if brick_paths is not None and "," in brick_paths:
-        brick_paths = brick_paths.split(",")
-    else:
-        brick_paths = [brick_paths]
-
-    options = module.params['options']
-    quota = module.params['quota']
-    directory = module.params['directory']
-
-    # get current state info
-    peers = get_peers()
-    volumes = get_volumes()
-    quotas = {}
-    if volume_name in volumes and volumes[volume_name]['quota'] and volumes[volume_name]['status'].lower() == 'started':
-        quotas = get_quotas(volume_name, True)
-
-    # do the work!
-    if action == 'absent':
-        if volume_name in volumes:
-            if volumes[volume_name]['status'].lower() != 'stopped':
-                stop_volume(volume_name)
-            run_gluster(['volume', 'delete', volume_name])
-            changed = True
-
-    if action == 'present':
-        probe_all_peers(cluster, peers, myhostname)
-
-        # create if it doesn't exist
-        if volume_name not in volumes:
-            create_volume(volume_name, stripes, replicas, arbiters, disperses, redundancies, transport, cluster, brick_paths, force)
-            volumes = get_volumes()
-            changed = True
-
-        if volume_name in volumes:
-            if volumes[volume_name]['status'].lower() != 'started' and start_on_create:
-                start_volume(volume_name)
-                changed = True
-
-            # switch bricks
-            new_bricks = []
-            removed_bricks = []
-            all_bricks = []
-            for node in cluster:
-                for brick_path in brick_paths:
-                    brick = '%s:%s' % (node, brick_path)
-                    all_bricks.append(brick)
-                    if brick not in volumes[volume_name]['bricks']:
-                        new_bricks.append(brick)
-
-            # this module does not yet remove bricks, but we check those anyways
-            for brick in volumes[volume_name]['bricks']:
-                if brick not in all_bricks:
-                    removed_bricks.append(brick)
-
-            if new_bricks:
-                add_bricks(volume_name, new_bricks, stripes, replicas, force)
-                changed = True
-
-            # handle quotas
-            if quota:
-                if not volumes[volume_name]['quota']:
-                    enable_quota(volume_name)
-                quotas = get_quotas(volume_name, False)
-                if directory not in quotas or quotas[directory] != quota:
-                    set_quota(volume_name, directory, quota)
-                    changed = True
-
-            # set options
-            for option in options.keys():
-                if option not in volumes[volume_name]['options'] or volumes[volume_name]['options'][option] != options[option]:
-                    set_volume_option(volume_name, option, options[option])
-                    changed = True
-
+    if module.params['action']:
+        if module.params['volumes']:
+            names = [volume_spec(params, module.params)['name'] for params in module.params['volumes']]
         else:
-            module.fail_json(msg='failed to create volume %s' % volume_name)
-
-    if action != 'delete' and volume_name not in volumes:
-        module.fail_json(msg='volume not found %s' % volume_name)
-
-    if action == 'started':
-        if volumes[volume_name]['status'].lower() != 'started':
-            start_volume(volume_name)
-            changed = True
+            names = [module.params['name']]
+        if module.params['action'] == 'profile':
+            profile = profile_volumes(ClusterSnapshot(), names, module.params['profile_window'],
+                                      max(module.params['profile_interval'], 1), module.params['top_n'])
+            module.exit_json(changed=False, profile=profile, lock_retries=lock_retries)
+        if not 0 < module.params['top_n'] <= 100:
+            module.fail_json(msg='top_n has to be between 1 and 100 for the top action')
+        top = top_volumes(ClusterSnapshot(), names, module.params['top_metrics'], module.params['top_n'],
+                          module.params['top_block_size'], module.params['top_block_count'])
+        module.exit_json(changed=False, ansible_facts={'gluster_top': top}, lock_retries=lock_retries)
+
+    if module.params['volumes']:
+        specs = [volume_spec(params, module.params) for params in module.params['volumes']]
+    else:
+        if module.params['state'] is None:
+            module.fail_json(msg='state is required when managing a single volume')
+        specs = [volume_spec(module.params, module.params)]
+
+    # get current state info, once for all the volumes, and reuse the state
+    # cached by earlier runs while it is fresh
+    cache = FactsCache(module.params['cache_path'], module.params['cache_ttl'])
+    snapshot = ClusterSnapshot(cache)
+    results, quotas, peer_latency = reconcile_volumes(snapshot, specs, myhostname)
+    changed = any(result['changed'] for result in results.values())
+    if changed:
+        cache.invalidate()
+    else:
+        snapshot.save()
 
-    if action == 'stopped':
-        if volumes[volume_name]['status'].lower() != 'stopped':
-            stop_volume(volume_name)
-            changed = True
+    quota_usage = dict((name, dict((path, quota_headroom(usage)) for path, usage in
+                                   snapshot.quota_usage(name, True).items()))
+                       for name in quotas)
+    if not module.params['volumes']:
+        quotas = quotas.get(specs[0]['name'], {})
+        quota_usage = quota_usage.get(specs[0]['name'], {})
 
-    if changed:
-        volumes = get_volumes()
-        if rebalance:
-            do_rebalance(volume_name)
+    volumes = snapshot.volumes
+    if module.params['facts_scope'] == 'managed':
+        volumes = dict((spec['name'], volumes[spec['name']]) for spec in specs
+                       if spec['name'] in volumes)
 
     facts = {}
-    facts['glusterfs'] = {'peers': peers, 'volumes': volumes, 'quotas': quotas}
+    facts['glusterfs'] = {'peers': snapshot.peers, 'volumes': volumes, 'quotas': quotas,
+                          'quota_usage': quota_usage}
 
-    module.exit_json(changed=changed, ansible_facts=facts)
+    module.exit_json(changed=changed, ansible_facts=facts, peer_join_latency=peer_latency,
+                     lock_retries=lock_retries, results=results)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Cluster state shared by the gluster modules: the parsers of the gluster
+--xml output, the cache of that state kept on the node between runs, and
+how commands are run against glusterd.
+
+The role also installs this file next to the textfile exporter, which runs
+outside of ansible."""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import glob
+import hashlib
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+try:
+    from ansible.module_utils._text import to_bytes
+except ImportError:
+    # Imported by the textfile exporter, without ansible on the node
+    def to_bytes(value):
+        return value if isinstance(value, bytes) else value.encode('utf-8')
+
+
+# Where glusterd keeps its state, and the files that change with it
+GLUSTERD_DIR = '/var/lib/glusterd'
+GLUSTERD_STATE = ['glusterd.info', 'peers/*', 'vols/*/info',
+                  'geo-replication/*/gsyncd.conf', 'geo-replication/*/monitor.status']
+
+# Errors glusterd returns while another transaction holds the cluster lock
+LOCK_ERRORS = re.compile(r'another transaction is in progress|locking failed|'
+                         r'unable to acquire lock', re.I)
+
+# Longest command line written to a batch session, the CLI reads its input
+# into a buffer of 1024 bytes
+BATCH_LINE_MAX = 1000
+
+# Transport type codes used in `gluster volume info --xml`
+TRANSPORTS = {'0': 'tcp', '1': 'rdma', '2': 'tcp,rdma'}
+
+# Volume types that have a self-heal backlog
+HEAL_TYPES = ('Replicate', 'Distributed-Replicate', 'Disperse', 'Distributed-Disperse')
+
+# Multipliers for the size suffixes printed by `gluster volume quota list`
+SIZE_UNITS = [('PB', 1024 ** 5), ('TB', 1024 ** 4), ('GB', 1024 ** 3),
+              ('MB', 1024 ** 2), ('KB', 1024)]
+
+
+def cache_key(glusterd_dir=GLUSTERD_DIR):
+    """The op-version and a checksum of the glusterd state files, None when
+    they cannot be read."""
+    info = os.path.join(glusterd_dir, 'glusterd.info')
+    try:
+        with open(info) as f:
+            m = re.search(r'^operating-version=(\d+)', f.read(), re.M)
+    except (IOError, OSError):
+        return None
+    digest = hashlib.sha1()
+    for pattern in GLUSTERD_STATE:
+        for path in sorted(glob.glob(os.path.join(glusterd_dir, pattern))):
+            try:
+                with open(path, 'rb') as f:
+                    digest.update(to_bytes(path) + b'\0' + f.read())
+            except (IOError, OSError):
+                continue
+    return '%s-%s' % (m.group(1) if m else '0', digest.hexdigest())
+
+
+def local_uuid(glusterd_dir=GLUSTERD_DIR):
+    """The UUID of this node in the trusted storage pool, None when unknown."""
+    try:
+        with open(os.path.join(glusterd_dir, 'glusterd.info')) as f:
+            m = re.search(r'^UUID=(\S+)', f.read(), re.M)
+    except (IOError, OSError):
+        return None
+    return m.group(1) if m else None
+
+
+class FactsCache(object):
+    """Cluster state kept on the node between module runs.
+
+    The state is stored by section, each with the time it was read.  A
+    section is only used while the cache key still matches the glusterd state
+    and the section is younger than the ttl.  The cache can be shared by
+    threads, a section is not changed while the cache is being saved.
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.key = cache_key() if ttl > 0 else None
+        self.sections = {}
+        if self.key is None:
+            return
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get('key') == self.key:
+                self.sections = data.get('sections') or {}
+        except (IOError, OSError, ValueError):
+            pass
+
+    def get(self, section):
+        with self.lock:
+            entry = self.sections.get(section)
+        if entry is None or time.time() - entry['time'] >= self.ttl:
+            return None
+        return entry['value']
+
+    def set(self, section, value):
+        if self.key is not None:
+            with self.lock:
+                self.sections[section] = {'time': time.time(), 'value': value}
+
+    def save(self):
+        if self.key is None:
+            return
+        directory = os.path.dirname(self.path)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            fd, tmp = tempfile.mkstemp(dir=directory)
+            with self.lock:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({'key': self.key, 'sections': self.sections}, f)
+                os.rename(tmp, self.path)
+        except (IOError, OSError):
+            pass
+
+    def invalidate(self):
+        with self.lock:
+            self.sections = {}
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+
+_retries_lock = threading.Lock()
+
+
+def run_with_retry(module, args, timeout, retries=None, **kwargs):
+    """Run a command, retrying while glusterd reports lock contention.
+
+    The delay between attempts doubles up to 8 seconds and is jittered so
+    that concurrent callers do not retry in lock-step.  Retrying stops once
+    timeout seconds have been spent waiting.  The retries and the time spent
+    waiting are added to the retries dict, which threads can share.
+    """
+    delay = 0.5
+    waited = 0.0
+    while True:
+        rc, out, err = module.run_command(args, **kwargs)
+        if rc == 0 or not LOCK_ERRORS.search((out or '') + (err or '')) or waited >= timeout:
+            return rc, out, err
+        pause = min(random.uniform(delay / 2, delay), timeout - waited)
+        time.sleep(pause)
+        waited += pause
+        if retries is not None:
+            with _retries_lock:
+                retries['retries'] += 1
+                retries['wait_time'] = round(retries['wait_time'] + pause, 3)
+        delay = min(delay * 2, 8)
+
+
+class GlusterBatch(object):
+    """A queue of gluster commands executed through one CLI session.
+
+    The queued commands are written to the stdin of a single
+    `gluster --mode=script --xml` process instead of forking the CLI once per
+    command.  Every command is followed by a query of the cluster op-version,
+    which succeeds whatever the command did, so the combined output can be
+    split back into a separate rc and output for each command at those
+    markers.  A command without a result, because the CLI cannot read it as
+    one line or the session ended before it, is run in a process of its own.
+    """
+
+    MARKER = 'volume get all cluster.op-version'
+    MARKER_RE = re.compile(r'<Option>\s*cluster\.op-version\s*</Option>')
+    DOC_RE = re.compile(r'<cliOutput>.*?</cliOutput>', re.S)
+
+    def __init__(self, module, glusterbin, lock_timeout=0, lock_retries=None):
+        self.module = module
+        self.glusterbin = glusterbin
+        self.lock_timeout = lock_timeout
+        self.lock_retries = lock_retries
+        self.commands = []
+
+    def add(self, gargs):
+        self.commands.append([str(arg) for arg in gargs])
+        return len(self.commands) - 1
+
+    def run(self):
+        commands, self.commands = self.commands, []
+        batched = []
+        lines = []
+        for index, gargs in enumerate(commands):
+            # The CLI splits its input on whitespace and has no quoting
+            line = ' '.join(gargs)
+            if any(not arg or re.search(r'\s', arg) for arg in gargs) or \
+                    len(line) > BATCH_LINE_MAX:
+                continue
+            batched.append(index)
+            lines.extend([line, self.MARKER])
+        results = {}
+        if lines:
+            lines.append('exit')
+            rc, out, err = self.module.run_command([self.glusterbin, '--mode=script', '--xml'],
+                                                   data='\n'.join(lines) + '\n')
+            results = dict(zip(batched, self._split(out or '')))
+        # Retry what lost a race for the cluster lock on its own
+        for index, gargs in enumerate(commands):
+            if index not in results or (results[index][0] != 0 and
+                                        LOCK_ERRORS.search(results[index][2])):
+                rc, out, err = run_with_retry(self.module,
+                                              [self.glusterbin, '--mode=script'] + gargs + ['--xml'],
+                                              self.lock_timeout, self.lock_retries)
+                if rc != 0 and not err:
+                    err = self._result(out or '')[2]
+                results[index] = (rc, out, err)
+        return [(gargs,) + results[index] for index, gargs in enumerate(commands)]
+
+    def _split(self, out):
+        """The result of every command, in order, up to the last marker."""
+        results = []
+        start = 0
+        for m in self.DOC_RE.finditer(out):
+            if self.MARKER_RE.search(m.group(0)):
+                results.append(self._result(out[start:m.start()]))
+                start = m.end()
+        return results
+
+    def _result(self, segment):
+        docs = self.DOC_RE.findall(segment)
+        if not docs:
+            return 1, '', segment.replace('gluster>', '').strip()
+        doc = docs[-1]
+        try:
+            root = ET.fromstring(doc)
+        except ET.ParseError:
+            return 1, doc, 'unable to parse gluster xml output'
+        if root.findtext('opRet') == '0':
+            return 0, doc, ''
+        return 1, doc, root.findtext('opErrstr') or ''
+
+
+def parse_size(value):
+    """Convert a quota size such as '10.0MB' or '1024Bytes' to bytes."""
+    if value is None:
+        return None
+    m = re.match(r'^\s*([0-9.]+)\s*([A-Za-z]*)\s*$', str(value))
+    if not m:
+        return None
+    unit = m.group(2).upper()
+    for suffix, factor in SIZE_UNITS:
+        if unit in (suffix, suffix[0]):
+            return int(float(m.group(1)) * factor)
+    return int(float(m.group(1)))
+
+
+def human_size(value):
+    """Format a byte count the way `gluster volume quota list` prints it."""
+    value = int(value)
+    for suffix, factor in SIZE_UNITS:
+        if value >= factor:
+            return '%.1f%s' % (float(value) / factor, suffix)
+    return '%dBytes' % value
+
+
+def parse_percent(value):
+    m = re.match(r'^\s*([0-9.]+)\s*%?\s*$', str(value or ''))
+    return int(float(m.group(1))) if m else None
+
+
+def synced_epoch(utc, local):
+    """When a geo-replication worker last synced, as seconds since the epoch.
+
+    gsyncd reports the times as local "YYYY-MM-DD HH:MM:SS", newer versions
+    also as seconds since the epoch.
+    """
+    if utc and re.match(r'^\d+$', utc):
+        return int(utc)
+    if not local:
+        return None
+    try:
+        return time.mktime(time.strptime(local, '%Y-%m-%d %H:%M:%S'))
+    except ValueError:
+        return None
+
+
+def parse_peer(elem):
+    names = [elem.findtext('hostname')]
+    names.extend(h.text for h in elem.iterfind('hostnames/hostname')
+                 if h.text not in names)
+    return names, [elem.findtext('uuid'), elem.findtext('stateStr')]
+
+
+def parse_volume(elem):
+    volume = {'name': elem.findtext('name'),
+              'id': elem.findtext('id'),
+              'status': elem.findtext('statusStr'),
+              'type': elem.findtext('typeStr'),
+              'transport': TRANSPORTS.get(elem.findtext('transport'), 'tcp'),
+              'bricks': [],
+              'options': {},
+              'quota': False}
+    for key in ('brickCount', 'distCount', 'replicaCount', 'arbiterCount',
+                'disperseCount', 'redundancyCount'):
+        if elem.findtext(key) is not None:
+            volume[re.sub('([A-Z])', r'_\1', key).lower()] = int(elem.findtext(key))
+    for brick in elem.iterfind('bricks/brick'):
+        name = brick.findtext('name') or (brick.text or '').strip()
+        volume['bricks'].append(name)
+        if brick.findtext('isArbiter') == '1':
+            volume.setdefault('arbiters', []).append(name)
+    for option in elem.iterfind('options/option'):
+        volume['options'][option.findtext('name')] = option.findtext('value')
+    if volume['options'].get('features.quota') == 'on':
+        volume['quota'] = True
+    return volume
+
+
+def parse_quota(elem):
+    hard_limit = int(elem.findtext('hard_limit') or 0)
+    return elem.findtext('path'), {'hard_limit': hard_limit,
+                                   'limit': human_size(hard_limit),
+                                   'soft_limit_percent': elem.findtext('soft_limit_percent'),
+                                   'used': int(elem.findtext('used_space') or 0),
+                                   'available': int(elem.findtext('avail_space') or 0),
+                                   'sl_exceeded': elem.findtext('sl_exceeded'),
+                                   'hl_exceeded': elem.findtext('hl_exceeded')}
+
+
+def quota_headroom(usage):
+    """Usage of a quota with the bytes left below its hard and soft limits."""
+    hard = usage['hard_limit']
+    soft = parse_percent(usage['soft_limit_percent'])
+    used = usage['used']
+    headroom = dict(usage)
+    headroom['headroom'] = max(hard - used, 0)
+    headroom['soft_headroom'] = max(hard * soft // 100 - used, 0) if soft is not None else None
+    headroom['used_percent'] = round(used * 100.0 / hard, 1) if hard else None
+    return headroom
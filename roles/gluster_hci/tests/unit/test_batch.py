@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Checks of the gluster CLI batch session and the lock retry shared by the
+modules, against the output of a multi-command session in fixtures/."""
+
+import os
+import sys
+import unittest
+
+ROLE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+import ansible.module_utils  # noqa: E402
+if os.path.join(ROLE_DIR, 'module_utils') not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(os.path.join(ROLE_DIR, 'module_utils'))
+sys.path.insert(0, os.path.join(ROLE_DIR, 'library'))
+
+import glusterd2_volume  # noqa: E402
+from ansible.module_utils import gluster_state  # noqa: E402
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+
+class FakeModule(object):
+    """Answers the batch session from a fixture and records the commands
+    run on their own."""
+
+    def __init__(self, session='', results=None):
+        self.session = session
+        self.results = results or {}
+        self.stdin = None
+        self.commands = []
+
+    def run_command(self, args, data=None, **kwargs):
+        if data is not None:
+            self.stdin = data
+            return 0, self.session, ''
+        command = ' '.join(args[2:-1])
+        self.commands.append(command)
+        if command in self.results:
+            return self.results[command].pop(0)
+        return 0, '<cliOutput><opRet>0</opRet></cliOutput>', ''
+
+
+class BatchTest(unittest.TestCase):
+
+    def test_split(self):
+        results = gluster_state.GlusterBatch(None, 'gluster')._split(fixture('batch_session.out'))
+        # The output after the last marker has no result
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0][0], 0)
+        self.assertIn('<volname>data</volname>', results[0][1])
+        self.assertEqual((results[1][0], results[1][2]), (1, 'Volume engine already started'))
+        self.assertEqual(results[2][0], 1)
+        self.assertTrue(results[2][2].startswith('quota command failed : Another transaction'))
+
+    def test_split_without_markers(self):
+        # A CLI that stopped at the first command, or cannot answer the marker
+        self.assertEqual(gluster_state.GlusterBatch(None, 'gluster')._split(
+            '<cliOutput><opRet>-1</opRet><opErrstr>failed</opErrstr></cliOutput>'), [])
+
+    def test_run(self):
+        module = FakeModule(fixture('batch_session.out'))
+        batch = gluster_state.GlusterBatch(module, 'gluster', lock_timeout=0)
+        batch.add(['volume', 'set', 'data', 'cluster.shd-max-threads', '4'])
+        batch.add(['volume', 'start', 'engine'])
+        batch.add(['volume', 'quota', 'vmstore', 'enable'])
+        batch.add(['volume', 'set', 'vmstore', 'cluster.shd-max-threads', '4'])
+        batch.add(['volume', 'set', 'data', 'user.comment', 'two words'])
+        results = batch.run()
+        self.assertEqual(module.stdin.splitlines(), [
+            'volume set data cluster.shd-max-threads 4', gluster_state.GlusterBatch.MARKER,
+            'volume start engine', gluster_state.GlusterBatch.MARKER,
+            'volume quota vmstore enable', gluster_state.GlusterBatch.MARKER,
+            'volume set vmstore cluster.shd-max-threads 4', gluster_state.GlusterBatch.MARKER,
+            'exit'])
+        # Lost the lock, ended the session and cannot be quoted on the input
+        self.assertEqual(module.commands, ['volume quota vmstore enable',
+                                           'volume set vmstore cluster.shd-max-threads 4',
+                                           'volume set data user.comment two words'])
+        self.assertEqual([result[1] for result in results], [0, 1, 0, 0, 0])
+        self.assertEqual(batch.commands, [])
+
+    def test_long_line_runs_alone(self):
+        module = FakeModule()
+        batch = gluster_state.GlusterBatch(module, 'gluster')
+        batch.add(['volume', 'set', 'data', 'user.comment', 'x' * gluster_state.BATCH_LINE_MAX])
+        batch.run()
+        self.assertIsNone(module.stdin)
+        self.assertEqual(len(module.commands), 1)
+
+    def test_set_options_fit_a_line(self):
+        module = FakeModule()
+        glusterd2_volume.batch = gluster_state.GlusterBatch(module, 'gluster')
+        try:
+            options = dict(('user.option%02d' % i, 'v' * 40) for i in range(40))
+            glusterd2_volume.set_volume_options('data', options)
+            commands = glusterd2_volume.batch.commands
+        finally:
+            glusterd2_volume.batch = None
+        self.assertGreater(len(commands), 1)
+        self.assertTrue(all(len(' '.join(gargs)) <= gluster_state.BATCH_LINE_MAX
+                            for gargs in commands))
+        self.assertTrue(all(gargs[:3] == ['volume', 'set', 'data'] for gargs in commands))
+        self.assertEqual(sum(len(gargs) - 3 for gargs in commands), 80)
+
+
+class RetryTest(unittest.TestCase):
+
+    def test_retries_lock_contention(self):
+        busy = (1, '', 'Another transaction is in progress for data. Please try again after some time.')
+        module = FakeModule(results={'volume start data': [busy, busy, (0, 'ok', '')]})
+        retries = {'retries': 0, 'wait_time': 0.0}
+        rc, out, err = gluster_state.run_with_retry(module, ['gluster', '--mode=script', 'volume',
+                                                             'start', 'data', '--xml'], 5, retries)
+        self.assertEqual((rc, out), (0, 'ok'))
+        self.assertEqual(retries['retries'], 2)
+        self.assertLess(retries['wait_time'], 5)
+
+    def test_other_errors_are_not_retried(self):
+        module = FakeModule(results={'volume start data': [(1, '', 'Volume data does not exist')]})
+        rc, out, err = gluster_state.run_with_retry(module, ['gluster', '--mode=script', 'volume',
+                                                             'start', 'data', '--xml'], 5)
+        self.assertEqual(rc, 1)
+        self.assertEqual(len(module.commands), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Checks of the GlusterD2 REST client of the volume module against a local
+stand-in for glusterd2, over HTTP and over HTTPS with the self-signed
+localhost certificate in fixtures/."""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import ssl
+import sys
+import threading
+import unittest
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+ROLE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+import ansible.module_utils  # noqa: E402
+if os.path.join(ROLE_DIR, 'module_utils') not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(os.path.join(ROLE_DIR, 'module_utils'))
+sys.path.insert(0, os.path.join(ROLE_DIR, 'library'))
+
+import glusterd2_volume  # noqa: E402
+
+CERT = os.path.join(FIXTURES, 'gd2_localhost.pem')
+KEY = os.path.join(FIXTURES, 'gd2_localhost.key')
+
+VOLUMES = [{'name': 'data', 'state': 'Started'}]
+
+
+class GD2Handler(BaseHTTPRequestHandler):
+    """Answers GET /v1/volumes, 404 with a glusterd2 error otherwise."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else None
+        self.server.requests.append((self.command, self.path,
+                                     self.headers.get('Authorization'), body))
+        if self.command == 'GET' and self.path == '/v1/volumes':
+            status, data = 200, VOLUMES
+        else:
+            status, data = 404, {'errors': [{'code': 2, 'message': 'volume not found'}]}
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        # An idle connection closed by glusterd2, without telling the client
+        self.close_connection = self.server.drop
+
+    do_GET = do_POST = do_DELETE = respond
+
+
+class GD2Server(HTTPServer):
+
+    def __init__(self, certfile=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), GD2Handler)
+        self.connections = 0
+        self.requests = []
+        self.drop = False
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, KEY)
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class ClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = GD2Server()
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_keep_alive(self):
+        client = glusterd2_volume.GD2Client('127.0.0.1', self.port)
+        try:
+            self.assertEqual(client.request('GET', '/v1/volumes'), (200, VOLUMES))
+            self.assertEqual(client.request('GET', '/v1/volumes'), (200, VOLUMES))
+        finally:
+            client.close()
+        self.assertEqual((client.calls, self.server.connections), (2, 1))
+        self.assertIsNone(self.server.requests[0][2])
+
+    def test_token(self):
+        client = glusterd2_volume.GD2Client('127.0.0.1', self.port, 'glustercli', 's3cret')
+        try:
+            client.request('GET', '/v1/volumes')
+        finally:
+            client.close()
+        scheme, token = self.server.requests[0][2].split(' ')
+        self.assertEqual(scheme, 'bearer')
+        header, claims, signature = token.split('.')
+        expected = hmac.new(b's3cret', ('%s.%s' % (header, claims)).encode('ascii'),
+                            hashlib.sha256).digest()
+        self.assertEqual(base64.urlsafe_b64decode(signature + '=' * (-len(signature) % 4)),
+                         expected)
+        claims = json.loads(base64.urlsafe_b64decode(claims + '=' * (-len(claims) % 4)).decode())
+        self.assertEqual(claims['iss'], 'glustercli')
+        self.assertEqual(claims['qsh'], hashlib.sha256(b'GET&/v1/volumes').hexdigest())
+
+    def test_error(self):
+        client = glusterd2_volume.GD2Client('127.0.0.1', self.port)
+        try:
+            with self.assertRaises(glusterd2_volume.GD2Error) as raised:
+                client.request('DELETE', '/v1/volumes/missing')
+        finally:
+            client.close()
+        self.assertEqual((raised.exception.status, raised.exception.reason),
+                         (404, 'volume not found'))
+
+    def test_reconnect_idempotent_only(self):
+        self.server.drop = True
+        client = glusterd2_volume.GD2Client('127.0.0.1', self.port)
+        try:
+            client.request('GET', '/v1/volumes')
+            # Resent on a new connection
+            self.assertEqual(client.request('GET', '/v1/volumes'), (200, VOLUMES))
+            # A create may have been applied, it is not resent
+            with self.assertRaises((glusterd2_volume.http_client.HTTPException,
+                                    glusterd2_volume.socket.error)):
+                client.request('POST', '/v1/volumes', {'name': 'data'})
+        finally:
+            client.close()
+        self.assertEqual([request[0] for request in self.server.requests], ['GET', 'GET'])
+
+
+class VerifyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = GD2Server(CERT)
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_plain_http(self):
+        for verify in (False, None, 'no', 'False'):
+            client = glusterd2_volume.GD2Client('localhost', self.port, verify=verify)
+            self.assertNotIsInstance(client.conn, glusterd2_volume.http_client.HTTPSConnection)
+
+    def test_ca_bundle(self):
+        client = glusterd2_volume.GD2Client('localhost', self.port, verify=CERT)
+        try:
+            self.assertEqual(client.request('GET', '/v1/volumes'), (200, VOLUMES))
+        finally:
+            client.close()
+
+    def test_system_bundle_rejects_self_signed(self):
+        client = glusterd2_volume.GD2Client('localhost', self.port, verify='yes')
+        try:
+            with self.assertRaises(ssl.SSLError):
+                client.request('GET', '/v1/volumes')
+        finally:
+            client.close()
+
+    def test_missing_bundle(self):
+        with self.assertRaises((IOError, OSError)):
+            glusterd2_volume.GD2Client('localhost', self.port,
+                                       verify=os.path.join(FIXTURES, 'missing.pem'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Checks of the heal summary parsing of gluster_heal against
+`gluster volume heal <volume> info summary --xml` outputs in fixtures/."""
+
+import os
+import sys
+import unittest
+
+ROLE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+import ansible.module_utils  # noqa: E402
+if os.path.join(ROLE_DIR, 'module_utils') not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(os.path.join(ROLE_DIR, 'module_utils'))
+sys.path.insert(0, os.path.join(ROLE_DIR, 'library'))
+
+import gluster_heal  # noqa: E402
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+
+class SummarizeTest(unittest.TestCase):
+
+    def test_possibly_healing_is_not_settled(self):
+        bricks = gluster_heal.parse_heal_summary(fixture('heal_info_summary_healing.xml'))
+        info = gluster_heal.summarize(bricks, 0)
+        self.assertEqual((info['pending'], info['healing'], info['backlog']), (0, 5, 5))
+        self.assertFalse(info['settled'])
+
+    def test_threshold_covers_healing(self):
+        bricks = gluster_heal.parse_heal_summary(fixture('heal_info_summary_healing.xml'))
+        self.assertFalse(gluster_heal.summarize(bricks, 4)['settled'])
+        self.assertTrue(gluster_heal.summarize(bricks, 5)['settled'])
+
+    def test_split_brain_is_not_settled(self):
+        bricks = gluster_heal.parse_heal_summary(fixture('heal_info_summary_split_brain.xml'))
+        info = gluster_heal.summarize(bricks, 100)
+        self.assertEqual(info['split_brain'], 1)
+        self.assertFalse(info['settled'])
+
+    def test_unreachable_brick(self):
+        bricks = gluster_heal.parse_heal_summary(fixture('heal_info_summary_split_brain.xml'))
+        self.assertIsNone(bricks[1]['pending'])
+        bricks[0]['split_brain'] = 0
+        self.assertFalse(gluster_heal.summarize(bricks, 100)['settled'])
+
+    def test_rate(self):
+        self.assertEqual(gluster_heal.heal_rate([(0, 50), (10, 30), (20, 10)]), 2.0)
+        self.assertIsNone(gluster_heal.heal_rate([(0, 50)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Checks of gluster_host_profile against the procfs and sysfs trees of two
+hosts in fixtures/: one with NVMe bricks, one with bricks on LVM."""
+
+import os
+import sys
+import unittest
+
+ROLE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+sys.path.insert(0, os.path.join(ROLE_DIR, 'library'))
+
+import gluster_host_profile  # noqa: E402
+
+
+def roots(host):
+    return os.path.join(FIXTURES, host, 'sys'), os.path.join(FIXTURES, host, 'proc')
+
+
+class HostProfileTest(unittest.TestCase):
+
+    def test_nvme_host(self):
+        profile = gluster_host_profile.host_profile(['/gluster_bricks/data/data',
+                                                     '/gluster_bricks/data/extra/data'],
+                                                    *roots('host_nvme'))
+        self.assertEqual((profile['cpus'], profile['memory_mb']), (4, 64214))
+        # The fastest interface that is up, without the loopback
+        self.assertEqual(profile['nic_speed_mbps'], 25000)
+        self.assertEqual(profile['storage'], 'nvme')
+        self.assertEqual([brick['device'] for brick in profile['bricks']],
+                         ['nvme1n1', 'nvme1n1'])
+
+    def test_lvm_host(self):
+        profile = gluster_host_profile.host_profile(['/gluster_bricks/data/data',
+                                                     '/gluster_bricks/engine/engine',
+                                                     '/gluster_bricks/vmstore/vmstore'],
+                                                    *roots('host_lvm'))
+        self.assertEqual((profile['cpus'], profile['memory_mb']), (5, 15933))
+        self.assertEqual(profile['nic_speed_mbps'], 10000)
+        self.assertEqual(profile['bricks'], [
+            {'path': '/gluster_bricks/data/data', 'device': 'sdb', 'rotational': True,
+             'nvme': False},
+            {'path': '/gluster_bricks/engine/engine', 'device': 'sdc', 'rotational': False,
+             'nvme': False},
+            # Not mounted on its own, on the partition of the root file system
+            {'path': '/gluster_bricks/vmstore/vmstore', 'device': 'sda', 'rotational': False,
+             'nvme': False}])
+        # One rotational brick is enough
+        self.assertEqual(profile['storage'], 'rotational')
+
+    def test_ssd_bricks(self):
+        profile = gluster_host_profile.host_profile(['/gluster_bricks/engine/engine'],
+                                                    *roots('host_lvm'))
+        self.assertEqual(profile['storage'], 'ssd')
+
+    def test_mount_device(self):
+        procfs = roots('host_nvme')[1]
+        self.assertEqual(gluster_host_profile.mount_device('/gluster_bricks/data', procfs),
+                         '/dev/nvme1n1p1')
+        self.assertEqual(gluster_host_profile.mount_device('/gluster_bricks/database', procfs),
+                         '/dev/nvme0n1p2')
+
+    def test_missing_trees(self):
+        missing = os.path.join(FIXTURES, 'missing')
+        profile = gluster_host_profile.host_profile(['/gluster_bricks/data/data'],
+                                                    missing, missing)
+        self.assertEqual((profile['cpus'], profile['memory_mb'], profile['nic_speed_mbps']),
+                         (1, 0, 0))
+        self.assertEqual(profile['bricks'][0]['device'], None)
+        self.assertEqual(profile['storage'], 'ssd')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Checks of the schedule, the thresholds and the loopback measurements of
+gluster_net_bench."""
+
+import os
+import sys
+import time
+import unittest
+
+ROLE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROLE_DIR, 'library'))
+
+import gluster_net_bench  # noqa: E402
+
+
+class FlagsTest(unittest.TestCase):
+
+    def test_thresholds(self):
+        result = {'rtt_ms': 0.4, 'rtt_max_ms': 2.0, 'mbps': 940.7}
+        self.assertFalse(gluster_net_bench.flags(result, 900, 1))
+        self.assertTrue(gluster_net_bench.flags(result, 1000, 1))
+        self.assertTrue(gluster_net_bench.flags(result, 900, 0.2))
+        self.assertFalse(gluster_net_bench.flags(result, None, None))
+
+    def test_error(self):
+        self.assertTrue(gluster_net_bench.flags({'rtt_ms': None, 'mbps': None,
+                                                 'error': 'connection refused'}, None, None))
+
+    def test_not_measured(self):
+        # pings: 0 and duration: 0 leave the measurements unset
+        result = {'rtt_ms': None, 'rtt_max_ms': None, 'mbps': None}
+        self.assertFalse(gluster_net_bench.flags(result, 1000, 1))
+        self.assertTrue(gluster_net_bench.flags(dict(result, mbps=10.0), 1000, 1))
+        self.assertTrue(gluster_net_bench.flags(dict(result, rtt_ms=5.0), 1000, 1))
+
+
+class ScheduleTest(unittest.TestCase):
+
+    def test_rounds(self):
+        hosts = ['h1', 'h2', 'h3', 'h4', 'h5']
+        schedule = gluster_net_bench.rounds(hosts)
+        pairs = [frozenset(pair) for pairs in schedule for pair in pairs]
+        self.assertEqual(len(pairs), 10)
+        self.assertEqual(len(set(pairs)), 10)
+        for pairs in schedule:
+            members = [host for pair in pairs for host in pair]
+            self.assertEqual(len(members), len(set(members)))
+
+    def test_partner(self):
+        self.assertEqual(gluster_net_bench.partner([('h1', 'h3')], 'h3', ['h1', 'h2', 'h3']),
+                         ('h1', False))
+        self.assertEqual(gluster_net_bench.partner([('h1', 'h3')], 'h2', ['h1', 'h2', 'h3']),
+                         (None, False))
+
+
+class LoopbackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = gluster_net_bench.BenchServer(0)
+        self.port = self.server.sock.getsockname()[1]
+        self.server.advance(10)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_round_trips(self):
+        result = gluster_net_bench.round_trips('localhost', self.port, 0, 5, time.time() + 10)
+        self.assertTrue(0 <= result['rtt_ms'] <= result['rtt_max_ms'])
+        self.assertTrue(self.server.wait_served(0, time.time() + 10))
+
+    def test_no_pings(self):
+        self.assertEqual(gluster_net_bench.round_trips('localhost', self.port, 1, 0,
+                                                       time.time() + 10), {})
+
+    def test_no_duration(self):
+        self.assertEqual(gluster_net_bench.throughput('localhost', self.port, 2, 0,
+                                                      time.time() + 10), {})
+        # The peer still counts the step as measured
+        self.assertTrue(self.server.wait_served(2, time.time() + 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
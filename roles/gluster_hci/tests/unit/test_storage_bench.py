@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Checks of the latency percentiles and the summary of gluster_storage_bench."""
+
+import os
+import sys
+import tempfile
+import unittest
+
+ROLE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROLE_DIR, 'library'))
+
+import gluster_storage_bench  # noqa: E402
+
+
+class PercentileTest(unittest.TestCase):
+
+    def test_nearest_rank(self):
+        latencies = [float(i) for i in range(1, 101)]
+        self.assertEqual(gluster_storage_bench.percentile(latencies, 0.50), 50.0)
+        self.assertEqual(gluster_storage_bench.percentile(latencies, 0.99), 99.0)
+        self.assertEqual(gluster_storage_bench.percentile(latencies, 0.999), 100.0)
+        self.assertEqual(gluster_storage_bench.percentile(latencies, 1.0), 100.0)
+        self.assertEqual(gluster_storage_bench.percentile(latencies, 0.0), 1.0)
+
+    def test_rounding_of_the_rank(self):
+        # 0.07 * 100 is a hair above 7 in floating point
+        latencies = [float(i) for i in range(1, 101)]
+        self.assertEqual(gluster_storage_bench.percentile(latencies, 0.07), 7.0)
+
+    def test_few_samples(self):
+        self.assertEqual(gluster_storage_bench.percentile([0.004], 0.999), 0.004)
+        self.assertEqual(gluster_storage_bench.percentile([0.001, 0.002, 0.003], 0.5), 0.002)
+        self.assertIsNone(gluster_storage_bench.percentile([], 0.5))
+
+
+class SummarizeTest(unittest.TestCase):
+
+    def test_summary(self):
+        # 1000 I/Os of 4 KiB in 2 seconds, one of them slow
+        latencies = [0.001] * 989 + [0.002] * 10 + [0.5]
+        summary = gluster_storage_bench.summarize(list(reversed(latencies)), 4096, 2.0)
+        self.assertEqual(summary, {'ops': 1000, 'mbps': 1.95, 'iops': 500.0,
+                                   'p50_ms': 1.0, 'p99_ms': 2.0, 'p999_ms': 2.0})
+
+    def test_tail(self):
+        latencies = [0.001] * 998 + [0.3, 0.5]
+        summary = gluster_storage_bench.summarize(latencies, 4096, 1.0)
+        self.assertEqual((summary['p999_ms'], summary['p99_ms']), (300.0, 1.0))
+
+    def test_no_io(self):
+        self.assertEqual(gluster_storage_bench.summarize([], 4096, 0),
+                         {'ops': 0, 'mbps': 0.0, 'iops': 0.0,
+                          'p50_ms': None, 'p99_ms': None, 'p999_ms': None})
+
+
+class RunIOTest(unittest.TestCase):
+
+    def test_deadline(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            latencies = gluster_storage_bench.run_io(fd, b'x' * 512, range(0, 4096, 512), True,
+                                                     gluster_storage_bench.monotonic() + 60)
+            self.assertEqual(len(latencies), 8)
+            self.assertTrue(all(latency >= 0 for latency in latencies))
+            # A deadline already passed stops before the first I/O
+            self.assertEqual(gluster_storage_bench.run_io(fd, b'x' * 512, range(0, 4096, 512),
+                                                          True, gluster_storage_bench.monotonic()),
+                             [])
+        finally:
+            os.close(fd)
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
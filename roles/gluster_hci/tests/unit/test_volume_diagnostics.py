@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Checks of the profile and top parsers of the volume module against
+`gluster ... --xml` outputs kept in fixtures/.
+
+Run from the role directory with `python -m pytest tests/unit` or
+`python -m unittest discover tests/unit`, ansible has to be importable.
+"""
+
+import os
+import sys
+import unittest
+import xml.etree.ElementTree as ET
+
+ROLE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Ansible ships the role module_utils with the module, outside a playbook run
+# they are found through the module_utils package path
+import ansible.module_utils  # noqa: E402
+if os.path.join(ROLE_DIR, 'module_utils') not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(os.path.join(ROLE_DIR, 'module_utils'))
+sys.path.insert(0, os.path.join(ROLE_DIR, 'library'))
+
+import glusterd2_volume  # noqa: E402
+from ansible.module_utils.gluster_state import parse_volume  # noqa: E402
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return f.read()
+
+
+class ProfileTest(unittest.TestCase):
+
+    def test_parse_incremental(self):
+        bricks = glusterd2_volume.parse_profile(fixture('profile_info_incremental.xml'))
+        self.assertEqual(sorted(bricks), ['host1:/gluster_bricks/data/data',
+                                          'host2:/gluster_bricks/data/data'])
+        brick = bricks['host1:/gluster_bricks/data/data']
+        self.assertEqual((brick['duration'], brick['read_bytes'], brick['write_bytes']),
+                         (10, 0, 409600))
+        # FOPs that were not called are left out
+        self.assertEqual(sorted(brick['fops']), ['LOOKUP', 'WRITE'])
+        self.assertEqual(brick['fops']['WRITE'], {'calls': 100, 'min_us': 40.0,
+                                                  'avg_us': 250.0, 'max_us': 1800.0})
+
+    def test_parse_cumulative(self):
+        bricks = glusterd2_volume.parse_profile(fixture('profile_info_cumulative.xml'))
+        brick = bricks['host1:/gluster_bricks/data/data']
+        self.assertEqual((brick['duration'], brick['read_bytes']), (3600, 3932160))
+        self.assertEqual(brick['fops']['READ']['calls'], 30)
+
+    def test_parse_error(self):
+        with self.assertRaises(ValueError) as raised:
+            glusterd2_volume.parse_profile(fixture('profile_not_started.xml'))
+        self.assertIn('is not started', str(raised.exception))
+
+    def test_merge_samples(self):
+        sample = glusterd2_volume.parse_profile(fixture('profile_info_incremental.xml'))
+        other = glusterd2_volume.parse_profile(fixture('profile_info_incremental.xml'))
+        other['host1:/gluster_bricks/data/data']['fops']['WRITE'].update(avg_us=750.0,
+                                                                         max_us=5000.0)
+        merged = glusterd2_volume.merge_profile([sample, other])
+        brick = merged['host1:/gluster_bricks/data/data']
+        self.assertEqual((brick['duration'], brick['write_bytes']), (20, 819200))
+        self.assertEqual(brick['fops']['WRITE'], {'calls': 200, 'min_us': 40.0,
+                                                  'avg_us': 500.0, 'max_us': 5000.0})
+
+    def test_rank(self):
+        bricks = glusterd2_volume.parse_profile(fixture('profile_info_incremental.xml'))
+        hot_bricks, hot_fops = glusterd2_volume.rank_profile(bricks, 10)
+        self.assertEqual([brick['brick'] for brick in hot_bricks],
+                         ['host2:/gluster_bricks/data/data', 'host1:/gluster_bricks/data/data'])
+        self.assertEqual(hot_bricks[1]['latency_us'], 26000.0)
+        self.assertEqual(hot_bricks[1]['calls_per_sec'], 12.0)
+        self.assertEqual(hot_fops[0], {'fop': 'WRITE', 'calls': 200, 'latency_us': 115000.0,
+                                       'avg_us': 575.0, 'max_us': 9000.0})
+        self.assertEqual(hot_fops[1]['fop'], 'LOOKUP')
+
+
+class TopTest(unittest.TestCase):
+
+    def setUp(self):
+        root = ET.fromstring(fixture('volume_info_replica.xml'))
+        self.volume = parse_volume(root.find('.//volume'))
+
+    def test_parse_open(self):
+        bricks = glusterd2_volume.parse_top(fixture('top_open.xml'))
+        self.assertEqual(len(bricks), 4)
+        self.assertEqual(bricks[0]['name'], 'host1:/gluster_bricks/data/data')
+        self.assertEqual((bricks[0]['current_open'], bricks[0]['max_open']), (3, 12))
+        self.assertEqual(bricks[0]['files'], [('/images/vm1.img', 40.0),
+                                              ('/images/vm2.img', 7.0)])
+
+    def test_parse_perf(self):
+        bricks = glusterd2_volume.parse_top(fixture('top_write_perf.xml'))
+        self.assertEqual((bricks[0]['throughput'], bricks[0]['time']), (350.2, 0.77))
+
+    def test_brick_sets(self):
+        sets = glusterd2_volume.brick_sets(self.volume)
+        self.assertEqual([sets[brick] for brick in self.volume['bricks']], [0, 0, 1, 1])
+
+    def test_merge_per_replica_set(self):
+        bricks = glusterd2_volume.parse_top(fixture('top_open.xml'))
+        ranked = glusterd2_volume.merge_top(bricks, 'open', 10,
+                                            glusterd2_volume.brick_sets(self.volume))
+        # The replicas of a file count once, the sets of a path add up
+        self.assertEqual([(entry['path'], entry['count']) for entry in ranked],
+                         [('/images/vm1.img', 40), ('/images/vm3.img', 25),
+                          ('/images/vm2.img', 12)])
+        self.assertEqual(ranked[0]['bricks'], ['host1:/gluster_bricks/data/data',
+                                               'host2:/gluster_bricks/data/data'])
+
+    def test_merge_top_n(self):
+        bricks = glusterd2_volume.parse_top(fixture('top_open.xml'))
+        ranked = glusterd2_volume.merge_top(bricks, 'open', 1,
+                                            glusterd2_volume.brick_sets(self.volume))
+        self.assertEqual([entry['path'] for entry in ranked], ['/images/vm1.img'])
+
+    def test_merge_perf_keeps_best(self):
+        bricks = glusterd2_volume.parse_top(fixture('top_write_perf.xml'))
+        ranked = glusterd2_volume.merge_top(bricks, 'write-perf', 10)
+        self.assertEqual([(entry['path'], entry['count']) for entry in ranked],
+                         [('/images/vm1.img', 120.5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Checks of the normalisation of the `volumes` entries of the volume module."""
+
+import os
+import sys
+import unittest
+
+ROLE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ansible.module_utils  # noqa: E402
+if os.path.join(ROLE_DIR, 'module_utils') not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(os.path.join(ROLE_DIR, 'module_utils'))
+sys.path.insert(0, os.path.join(ROLE_DIR, 'library'))
+
+import glusterd2_volume  # noqa: E402
+
+
+class Failed(Exception):
+    pass
+
+
+class FakeModule(object):
+
+    def fail_json(self, **kwargs):
+        raise Failed(kwargs['msg'])
+
+    def boolean(self, value):
+        return value in (True, 'yes', 'true', 'on', '1', 1)
+
+
+DEFAULTS = dict((key, None) for key in glusterd2_volume.VOLUME_SPEC_KEYS)
+DEFAULTS.update(name=None, state='present', cluster=['h1', 'h2', 'h3'], replicas=3,
+                options={'group': 'virt'}, start_on_create=True, rebalance=False, force=True)
+
+
+class VolumeSpecTest(unittest.TestCase):
+
+    def setUp(self):
+        glusterd2_volume.module = FakeModule()
+
+    def test_aliases_and_defaults(self):
+        spec = glusterd2_volume.volume_spec({'volname': 'data', 'brick': '/gluster_bricks/data/data',
+                                             'arbiter': 1,
+                                             'options': {'performance.strict-o-direct': 'on'}},
+                                            DEFAULTS)
+        self.assertEqual((spec['name'], spec['bricks'], spec['arbiters'], spec['replicas']),
+                         ('data', ['/gluster_bricks/data/data'], 1, 3))
+        self.assertEqual(spec['options'], {'group': 'virt', 'performance.strict-o-direct': 'on'})
+        self.assertEqual(spec['cluster'], ['h1', 'h2', 'h3'])
+
+    def test_unknown_key(self):
+        with self.assertRaises(Failed) as raised:
+            glusterd2_volume.volume_spec({'volname': 'data', 'brick': '/gluster_bricks/data/data',
+                                          'replica': 2}, DEFAULTS)
+        self.assertIn('unsupported keys replica in the volumes entry data', str(raised.exception))
+
+    def test_module_options_are_not_checked(self):
+        params = dict(DEFAULTS, name='data', bricks='/gluster_bricks/data/data')
+        params['tune'] = 'none'
+        self.assertEqual(glusterd2_volume.volume_spec(params, params)['name'], 'data')
+
+    def test_name_required(self):
+        with self.assertRaises(Failed):
+            glusterd2_volume.volume_spec({'brick': '/gluster_bricks/data/data'}, DEFAULTS)
+
+
+if __name__ == '__main__':
+    unittest.main()